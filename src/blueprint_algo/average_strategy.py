@@ -1,90 +1,220 @@
-import collections
-import glob
+"""Average of the current strategies of the snapshots of a run.
+
+The snapshots of a checkpoint directory are reduced in parallel, one key
+range at a time:
+
+* ``.gz`` snapshots of earlier runs are converted by the pool to ``.bp``
+  files in a temporary directory, each of them once.
+* The keys of the latest full base are split into `n_shards` ranges of
+  about the same number of info sets.
+* A pool of processes takes one range each. A process reads the rows of
+  the range from every snapshot in order, while a background thread reads
+  the next snapshot. It rebuilds the range at every retained iteration
+  from the full bases and deltas, and adds its regret matching strategy
+  to float64 sums.
+* The sums of a range are normalised into a blueprint file of the range.
+  As the ranges are in key order, these files are concatenated into the
+  blueprint without sorting again.
+
+Snapshots are memory mapped and only the rows of a range are read, so the
+memory of a process is bounded by the size of a range, not of the table.
+Converting ``.gz`` snapshots with ``tools/blueprint/binary_format.py``
+beforehand saves the conversion on every run.
+
+    python src/blueprint_algo/average_strategy.py --results_dir_path start --n_processes 4
+"""
+import multiprocessing as mp
 import os
-import re
-from typing import Dict, List, Union
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.pool import Pool
+from typing import List, Optional, Sequence, Tuple
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(os.path.split(curPath)[0])[0]
+sys.path.append(rootPath)
 
 import click
-import joblib
+import numpy as np
 from tqdm import tqdm
 
+from tools.blueprint.binary_format import BinaryCheckpoint, concatenate, read_checkpoint
+from tools.blueprint.checkpoint import list_checkpoints
+from tools.blueprint.info_set_table import average_policy, regret_matching
+from tools.poker.actions import n_actions
+from tools.poker.info_set import key_bytes
 
-def calculate_strategy(this_info_sets_regret: Dict[str, float]) -> Dict[str, float]:
-    """Calculate the strategy based on the current information sets regret."""
-    # TODO: Could we instanciate a state object from an info set?
-    actions = this_info_sets_regret.keys()
-    regret_sum = sum([max(regret, 0) for regret in this_info_sets_regret.values()])
-    if regret_sum > 0:
-        strategy: Dict[str, float] = {
-            action: max(this_info_sets_regret[action], 0) / regret_sum
-            for action in actions
-        }
-    else:
-        default_probability = 1 / len(actions)
-        strategy: Dict[str, float] = {action: default_probability for action in actions}
-    return strategy
+Snapshot = Tuple[int, bool, str]
 
 
-def try_to_int(text: str) -> Union[str, int]:
-    """Attempt to return int."""
-    return int(text) if text.isdigit() else text
+def shard_bounds(snapshots: Sequence[Snapshot], n_shards: int) -> List[Optional[bytes]]:
+    """Keys splitting the latest full base into `n_shards` ranges.
 
+    The first and last bounds are None, the ranges are open there.
+    """
+    bases = [path for _, full, path in snapshots if full]
+    if not bases:
+        raise ValueError("The snapshots have no full base.")
+    keys = read_checkpoint(bases[-1]).keys
+    if len(keys) == 0:
+        # One open range, the base was dumped before any info set was visited.
+        return [None, None]
+    inner = keys[np.linspace(0, len(keys), n_shards + 1).astype(np.int64)[1:-1]]
+    return [None] + sorted(set(inner.tolist())) + [None]
 
-def natural_key(text):
-    """Sort with natural numbers."""
-    return [try_to_int(c) for c in re.split(r"(\d+)", text)]
 
+def _convert(task: Tuple[str, str]) -> str:
+    """Write the ``.gz`` snapshot at the first path to the ``.bp`` file at the second."""
+    gz_path, bp_path = task
+    read_checkpoint(gz_path).save(bp_path)
+    return bp_path
 
-def average_strategy(all_file_paths: List[str]) -> Dict[str, Dict[str, float]]:
-    """Compute the mean strategy over all timesteps."""
-    # The offline strategy for all information sets.
-    offline_strategy: Dict[str, Dict[str, float]] = collections.defaultdict(
-        lambda: collections.defaultdict(lambda: 0.0)
+
+def convert_snapshots(pool: Pool, snapshots: Sequence[Snapshot], directory: str) -> List[Snapshot]:
+    """Snapshots with every ``.gz`` file replaced by a ``.bp`` file in `directory`.
+
+    The files are converted by `pool`, so every ``.gz`` file is parsed once
+    instead of once per key range.
+    """
+    tasks = [
+        (path, os.path.join(directory, os.path.basename(path)[: -len(".gz")] + ".bp"))
+        for _, _, path in snapshots
+        if path.endswith(".gz")
+    ]
+    bp_paths = dict(tasks)
+    for _ in tqdm(pool.imap_unordered(_convert, tasks), total=len(tasks), desc="convert"):
+        pass
+    return [(iteration, full, bp_paths.get(path, path)) for iteration, full, path in snapshots]
+
+
+def _read_range(path: str, low: Optional[bytes], high: Optional[bytes]) -> BinaryCheckpoint:
+    """Rows of a ``.bp`` snapshot in a key range, read into memory."""
+    part = BinaryCheckpoint.load(path).between(low, high)
+    return BinaryCheckpoint(
+        *(np.array(getattr(part, name)) for name in ("keys", "masks", "regret", "strategy")),
+        part.iteration,
+        part.parent,
+        discounts=part.discounts,
     )
-    # Sum up all strategies.
-    for dump_path in tqdm(all_file_paths, desc="loading dumps"):
-        # Load file.
-        try:
-            agent = joblib.load(dump_path)
-        except Exception as e:
-            tqdm.write(f"Failed to load file at {dump_path} because:{e}")
-            agent = {}
-        regret = agent.get("regret", {})
-        # Sum probabilities from computed strategy..
-        for info_set, this_info_sets_regret in sorted(regret.items()):
-            strategy = calculate_strategy(this_info_sets_regret)
-            for action, probability in strategy.items():
-                offline_strategy[info_set][action] += probability
-    # Normalise summed probabilities.
-    for info_set, this_info_sets_strategy in offline_strategy.items():
-        norm = sum(this_info_sets_strategy.values())
-        for action in this_info_sets_strategy.keys():
-            offline_strategy[info_set][action] /= norm
-    # Return regular dict, not defaultdict.
-    return {info_set: dict(strategy) for info_set, strategy in offline_strategy.items()}
+
+
+def _add(
+    keys: np.ndarray,
+    masks: np.ndarray,
+    sums: np.ndarray,
+    snapshot: BinaryCheckpoint,
+    policy: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Add `policy` of the rows of `snapshot` to the `sums` of `keys`."""
+    if len(keys) == len(snapshot) and (keys == snapshot.keys).all():
+        sums += policy
+        masks[:] = snapshot.masks
+        return keys, masks, sums
+    union = np.union1d(keys, snapshot.keys)
+    rows, new_rows = np.searchsorted(union, keys), np.searchsorted(union, snapshot.keys)
+    union_sums = np.zeros((len(union), n_actions), dtype=np.float64)
+    union_sums[rows] = sums
+    union_sums[new_rows] += policy
+    union_masks = np.zeros(len(union), dtype=np.uint8)
+    union_masks[rows] = masks
+    union_masks[new_rows] = snapshot.masks
+    return union, union_masks, union_sums
+
+
+def reduce_shard(
+    snapshots: Sequence[Snapshot], low: Optional[bytes], high: Optional[bytes], path: str
+) -> int:
+    """Write the average strategy of the info sets in a key range to `path`.
+
+    Returns
+    -------
+    n_info_sets : int
+    """
+    keys = np.empty(0, dtype=f"S{key_bytes}")
+    masks = np.empty(0, dtype=np.uint8)
+    sums = np.empty((0, n_actions), dtype=np.float64)
+    state: Optional[BinaryCheckpoint] = None
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        future = prefetch.submit(_read_range, snapshots[0][2], low, high)
+        for n, (_, full, snapshot_path) in enumerate(snapshots):
+            part = future.result()
+            if n + 1 < len(snapshots):
+                future = prefetch.submit(_read_range, snapshots[n + 1][2], low, high)
+            if full:
+                state = part
+            elif state is None:
+                raise ValueError(f"{snapshot_path} is a delta without a full base before it.")
+            else:
+                state = BinaryCheckpoint.merge([state, part])
+            policy = regret_matching(
+                state.regret, state.masks, np.empty((len(state), n_actions), np.float32)
+            )
+            keys, masks, sums = _add(keys, masks, sums, state, policy)
+    BinaryCheckpoint(
+        keys,
+        masks,
+        np.zeros((len(keys), n_actions), dtype=np.int32),
+        average_policy(sums, masks),
+        kind="blueprint",
+    ).save(path)
+    return len(keys)
+
+
+def _reduce_shard(task) -> int:
+    return reduce_shard(*task)
+
+
+def average_strategy(
+    results_dir_path: str, save_path: str, n_processes: int = 1, n_shards: int = 16
+) -> int:
+    """Write the mean strategy over all snapshots of a directory to `save_path`.
+
+    Returns
+    -------
+    n_info_sets : int
+    """
+    snapshots = list_checkpoints(results_dir_path)
+    if not snapshots:
+        raise ValueError(f"No checkpoints could be found at: {results_dir_path}")
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(os.path.abspath(save_path))
+    ) as tmp, mp.Pool(n_processes) as pool:
+        snapshots = convert_snapshots(pool, snapshots, tmp)
+        bounds = shard_bounds(snapshots, n_shards)
+        shard_paths = [os.path.join(tmp, f"shard_{i}.bp") for i in range(len(bounds) - 1)]
+        tasks = [
+            (snapshots, low, high, shard_path)
+            for low, high, shard_path in zip(bounds[:-1], bounds[1:], shard_paths)
+        ]
+        for _ in tqdm(
+            pool.imap_unordered(_reduce_shard, tasks), total=len(tasks), desc="shards"
+        ):
+            pass
+        shards = [BinaryCheckpoint.load(shard_path) for shard_path in shard_paths]
+        concatenate(shards, save_path, "blueprint", snapshots[-1][0])
+        return sum(len(shard) for shard in shards)
 
 
 @click.command()
 @click.option(
-    "--results_dir_path", default=".", help="the location of the agent file dumps."
+    "--results_dir_path", default=".", help="the location of the checkpoints."
 )
 @click.option(
     "--write_dir_path", default=".", help="where to save the offline strategy"
 )
-def cli(results_dir_path: str, write_dir_path: str):
+@click.option("--n_processes", default=mp.cpu_count(), help="processes reducing shards.")
+@click.option("--n_shards", default=16, help="key ranges the info sets are split into.")
+def cli(results_dir_path: str, write_dir_path: str, n_processes: int, n_shards: int):
     """Compute the strategy and write to file."""
-    # Find all files to load.
-    all_file_paths = glob.glob(os.path.join(results_dir_path, "agent*.gz"))
-    if not all_file_paths:
-        raise ValueError(f"No agent dumps could be found at: {results_dir_path}")
-    # Sort the file paths in the order they were created.
-    all_file_paths = sorted(all_file_paths, key=natural_key)
-    offline_strategy = average_strategy(all_file_paths)
-    # Save dictionary to compressed file.
-    latest_file = os.path.basename(all_file_paths[-1])
-    latest_iteration: int = int(re.findall(r"\d+", latest_file)[0])
-    save_file: str = f"offline_strategy_{latest_iteration}.gz"
-    joblib.dump(offline_strategy, os.path.join(write_dir_path, save_file))
+    snapshots = list_checkpoints(results_dir_path)
+    if not snapshots:
+        raise ValueError(f"No checkpoints could be found at: {results_dir_path}")
+    save_file: str = f"offline_strategy_{snapshots[-1][0]}.bp"
+    n_info_sets = average_strategy(
+        results_dir_path, os.path.join(write_dir_path, save_file), n_processes, n_shards
+    )
+    click.echo(f"{n_info_sets} info sets written to {save_file}")
 
 
 if __name__ == "__main__":
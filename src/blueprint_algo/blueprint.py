@@ -4,62 +4,60 @@
 from __future__ import annotations
 
 import copy
-import collections
 import datetime
 import json
-import random
 from pathlib import Path
-from typing import Any, Dict
-import logging
-root_logger= logging.getLogger()
-root_logger.setLevel(logging.DEBUG) # or whatever
-handler = logging.FileHandler(filename="test.txt",mode='w',encoding='utf-8') # or whatever
-handler.setFormatter(logging.Formatter('%(name)s %(message)s')) # or whatever
-root_logger.addHandler(handler)
+from typing import Any, Dict, Optional, Tuple
 # from numba import jit
-# logging.basicConfig(filename="test.txt", level=logging.DEBUG)
 import sys
 import os
 curPath = os.path.abspath(os.path.dirname(__file__))
 rootPath = os.path.split(os.path.split(curPath)[0])[0]
 sys.path.append(rootPath)
 import click
-import joblib
 import numpy as np
 from tqdm import tqdm
 
+from tools.blueprint.checkpoint import AsyncCheckpointer, load_checkpoint, write_blueprint
+from tools.blueprint.info_set_table import InfoSetTable
+from tools.blueprint.sampling import ActionSampler
+from tools.blueprint.tracing import Tracer, streets
 from tools.poker.state import PokerState
 from tools.poker.state import new_game
+from tools.poker.actions import action_names
 # from tools.simple_poker.pot import Pot
 
 
 class Agent:
-    # TODO(fedden): Note from the supplementary material, the data here will
-    #               need to be lower precision: "To save memory, regrets were
-    #               stored using 4-byte integers rather than 8-byte doubles.
-    #               There was also a ﬂoor on regret at -310,000,000 for every
-    #               action. This made it easier to unprune actions that were
-    #               initially pruned but later improved. This also prevented
-    #               integer overﬂows".
-    def __init__(self): #'{"cards_cluster":150,"history":[]}'
-        self.strategy = collections.defaultdict(
-            lambda: collections.defaultdict(lambda: 0)
-        )
-        self.regret = collections.defaultdict(
-            lambda: collections.defaultdict(lambda: 0)
-        )
+    # NOTE: As in the supplementary material, "To save memory, regrets were
+    #       stored using 4-byte integers rather than 8-byte doubles. There was
+    #       also a ﬂoor on regret at -310,000,000 for every action. This made
+    #       it easier to unprune actions that were initially pruned but later
+    #       improved. This also prevented integer overﬂows". The table stores
+    #       one row of regrets and strategy counts per info set.
+    def __init__(
+        self,
+        seed: Optional[int] = None,
+        average_power: float = 0.0,
+        tracer: Optional[Tracer] = None,
+    ): #'{"cards_cluster":150,"history":[]}'
+        self.table = InfoSetTable()
+        self.sampler = ActionSampler(seed)
+        self.average_power = average_power
+        # Off unless it is given a path, see `tools.blueprint.tracing`.
+        self.tracer = Tracer() if tracer is None else tracer
         # self.init_strategy()
         # dd = joblib.load('start/' + "strategy_426000.gz")
         # print()
     # @jit()
     def init_strategy(self):
-        dd = joblib.load('start/' + "strategy_20000.gz")
-        for keyI , valueA in dd['strategy'].items():
-            for A , deta in valueA.items():
-                self.strategy[keyI][A] = deta
-        for keyI , valueA in dd['regret'].items():
-            for A , deta in valueA.items():
-                self.regret[keyI][A] = deta
+        dd = load_checkpoint('start', 20000)
+        self.table = InfoSetTable(max(1, len(dd)))
+        dd.load_into(self.table)
+
+    def strategy_weight(self, t: int) -> float:
+        """Weight of the strategy counts of iteration `t` in the average strategy."""
+        return t ** self.average_power
 
 
 
@@ -87,12 +85,6 @@ def update_strategy(agent: Agent, state: PokerState, i: int, t: int):
     if state.is_terminal or state.betting_round > 0:
         return
 
-    try:
-        logging.debug(f"I(h): {state.info_set}")
-    except KeyError:
-        pass
-    logging.debug(f"Betting Action Correct?: {state.players}")
-
     ph = state.player_i  # this is always the case no matter what i is
 
     # NOTE(fedden): According to Algorithm 1 in the supplementary material,
@@ -106,58 +98,47 @@ def update_strategy(agent: Agent, state: PokerState, i: int, t: int):
     #   update_strategy(rs, h + a, i, t)
 
     if ph == i:
-        I = state.info_set
-        # if 'turn' in I:
-        #     print()
+        I = agent.table.row(state.info_set_key, state.legal_action_mask)
         # calculate regret
-        # logging.debug(f"About to Calculate Strategy, Regret: {agent.regret[I]}")
-        # logging.debug(f"Current regret: {agent.regret[I]}")
-        sigma = calculate_strategy(agent.regret, I, state)
-        # logging.debug(f"Calculated Strategy for {I}: {sigma[I]}")
+        sigma = calculate_strategy(agent.table, I)
         # choose an action based of sigma
-        try:
-            a = np.random.choice(list(sigma[I].keys()), 1, p=list(sigma[I].values()))[0]
-            # logging.debug(f"ACTION SAMPLED: ph {state.player_i} ACTION: {a}")
-        except ValueError:
-            p = 1 / len(state.legal_actions)
-            probabilities = np.full(len(state.legal_actions), p)
-            a = np.random.choice(state.legal_actions, p=probabilities)
-            sigma[I] = {action: p for action in state.legal_actions}
-            # logging.debug(f"ACTION SAMPLED: ph {state.player_i} ACTION: {a}")
-
-        # Increment the action counter.
-        agent.strategy[I][a] += 1
+        a_id = agent.sampler.choose(sigma)
+        a = action_names[a_id]
+        # logging.debug(f"ACTION SAMPLED: ph {state.player_i} ACTION: {a}")
+        if agent.tracer.on and agent.tracer.traces(state.betting_round):
+            agent.tracer.record(
+                "update_strategy",
+                info_set=state.info_set,
+                strategy=sigma.tolist(),
+                action=a,
+                chips=[p.n_chips for p in state.players],
+            )
+
+        # Increment the action counter, weighted by the iteration.
+        agent.table.add_strategy(I, a_id, agent.strategy_weight(t))
         # logging.debug(f"Updated Strategy for {I}: {agent.strategy[I]}")
-        new_state: PokerState = state.apply_action(a)
-        update_strategy(agent, new_state, i, t)
+        state.apply_action(a, inplace=True)
+        update_strategy(agent, state, i, t)
+        state.undo_action()
     else:
         # Traverse each action.
         for a in state.legal_actions:
             # logging.debug(f"Going to Traverse {a} for opponent")
 
-            new_state: PokerState = state.apply_action(a)
-            update_strategy(agent, new_state, i, t)
+            state.apply_action(a, inplace=True)
+            update_strategy(agent, state, i, t)
+            state.undo_action()
 
 
-def calculate_strategy(
-    regret: Dict[str, Dict[str, float]], I: str, state: PokerState,
-):
+def calculate_strategy(table: InfoSetTable, I: int) -> np.ndarray:
     """
 
-    :param regret: dictionary of regrets, I is key, then each action at I, with values being regret
-    :param sigma: dictionary of strategy updated by regret, iteration is key, then I is key, then each action with prob
-    :param I:
-    :param state: the game state
-    :return: doesn't return anything, just updates sigma
+    :param table: regrets and strategies of the info sets
+    :param I: the row of the info set in the table
+    :return: the strategy at I indexed by action id, zero for illegal actions.
+        It is cached in the table, so it must not be modified.
     """
-    sigma = collections.defaultdict(lambda: collections.defaultdict(lambda: 1 / 3))
-    rsum = sum([max(x, 0) for x in regret[I].values()])
-    for a in state.legal_actions:
-        if rsum > 0:
-            sigma[I][a] = max(regret[I][a], 0) / rsum
-        else:
-            sigma[I][a] = 1 / len(state.legal_actions)
-    return sigma
+    return table.current_strategy(I)
 
 
 def cfr(agent: Agent, state: PokerState, i: int, t: int) -> float:
@@ -209,61 +190,49 @@ def cfr(agent: Agent, state: PokerState, i: int, t: int) -> float:
     #   cfr()
 
     elif ph == i:
-        I = state.info_set
+        I = agent.table.row(state.info_set_key, state.legal_action_mask)
         # calculate strategy
-        # logging.debug(f"About to Calculate Strategy, Regret: {agent.regret[I]}")
-        # logging.debug(f"Current regret: {agent.regret[I]}")
-        sigma = calculate_strategy(agent.regret, I, state)
-        # logging.debug(f"Calculated Strategy for {I}: {sigma[I]}")
+        sigma = calculate_strategy(agent.table, I)
+        # logging.debug(f"Calculated Strategy for {I}: {sigma}")
 
         vo = 0.0
         voa = {}
-        for a in state.legal_actions:
+        for a_id, a in zip(state.legal_action_ids, state.legal_actions):
             # logging.debug(
             #     f"ACTION TRAVERSED FOR REGRET:  ph {state.player_i} ACTION: {a}"
             # )
-            new_state: PokerState = state.apply_action(a)
-            voa[a] = cfr(agent, new_state, i, t)
+            state.apply_action(a, inplace=True)
+            voa[a] = cfr(agent, state, i, t)
+            state.undo_action()
             # logging.debug(f"Got EV for {a}: {voa[a]}")
-            vo += sigma[I][a] * voa[a]
+            vo += sigma[a_id] * voa[a]
         #     logging.debug(
         #         f"""Added to Node EV for ACTION: {a} INFOSET: {I}
         #         STRATEGY: {sigma[I][a]}: {sigma[I][a] * voa[a]}"""
         #     )
         # logging.debug(f"Updated EV at {I}: {vo}")
-        try:
-            for a in state.legal_actions:
-                agent.regret[I][a] += voa[a] - vo
-        except Exception:
-            print(I,a)
-            print(agent.regret[I][a])
-            print(voa[a])
-            raise Exception('')
-        # logging.debug(f"Updated Regret at {I}: {agent.regret[I]}")
+        agent.table.add_regret(
+            I, state.legal_action_ids, [voa[a] - vo for a in state.legal_actions]
+        )
+        if agent.tracer.on and agent.tracer.traces(state.betting_round):
+            agent.tracer.record(
+                "cfr", info_set=state.info_set, strategy=sigma.tolist(), values=voa, value=vo
+            )
+        # logging.debug(f"Updated Regret at {I}: {agent.table.regret[I]}")
 
         return vo
     else:
-        Iph = state.info_set
-        # logging.debug(f"About to Calculate Strategy, Regret: {agent.regret[Iph]}")
-        # logging.debug(f"Current regret: {agent.regret[Iph]}")
-        sigma = calculate_strategy(agent.regret, Iph, state)
-        # logging.debug(f"Calculated Strategy for {Iph}: {sigma[Iph]}")
+        Iph = agent.table.row(state.info_set_key, state.legal_action_mask)
+        sigma = calculate_strategy(agent.table, Iph)
+        # logging.debug(f"Calculated Strategy for {Iph}: {sigma}")
 
-        try:
-            a = np.random.choice(
-                list(sigma[Iph].keys()), 1, p=list(sigma[Iph].values()),
-            )[0]
-            # logging.debug(f"ACTION SAMPLED: ph {state.player_i} ACTION: {a}")
+        a = action_names[agent.sampler.choose(sigma)]
+        # logging.debug(f"ACTION SAMPLED: ph {state.player_i} ACTION: {a}")
 
-        except ValueError:
-            p = 1 / len(state.legal_actions)
-            probabilities = np.full(len(state.legal_actions), p)
-            a = np.random.choice(state.legal_actions, p=probabilities)
-            sigma[Iph] = {action: p for action in state.legal_actions}
-            # logging.debug(f"ACTION SAMPLED: ph {state.player_i} ACTION: {a}")
-
-        new_state: PokerState = state.apply_action(a)
-        return cfr(agent, new_state, i, t)
+        state.apply_action(a, inplace=True)
+        vo = cfr(agent, state, i, t)
+        state.undo_action()
+        return vo
 
 
 def cfrp(agent: Agent, state: PokerState, i: int, t: int, c: int):
@@ -294,41 +263,38 @@ def cfrp(agent: Agent, state: PokerState, i: int, t: int, c: int):
     #   sample action from strategy for h
     #   cfr()
     elif ph == i:
-        I = state.info_set
+        I = agent.table.row(state.info_set_key, state.legal_action_mask)
         # calculate strategy
-        sigma = calculate_strategy(agent.regret, I, state)
+        sigma = calculate_strategy(agent.table, I)
         # TODO: Does updating sigma here (as opposed to after regret) miss out
         #       on any updates? If so, is there any benefit to having it up
         #       here?
         vo = 0.0
         voa = {}
-        explored = {}  # keeps tracked of items that can be skipped
-        for a in state.legal_actions:
-            if agent.regret[I][a] > c:
-                new_state: PokerState = state.apply_action(a)
-                voa[a] = cfrp(agent, new_state, i, t, c)
-                explored[a] = True
-                vo += sigma[I][a] * voa[a]
-            else:
-                explored[a] = False
-        for a in state.legal_actions:
-            if explored[a]:
-                agent.regret[I][a] += voa[a] - vo
+        explored = {}  # id to action of the actions that were not skipped
+        for a_id, a in zip(state.legal_action_ids, state.legal_actions):
+            if agent.table.regret[I, a_id] > c:
+                state.apply_action(a, inplace=True)
+                voa[a] = cfrp(agent, state, i, t, c)
+                state.undo_action()
+                explored[a_id] = a
+                vo += sigma[a_id] * voa[a]
+        agent.table.add_regret(
+            I, list(explored), [voa[a] - vo for a in explored.values()]
+        )
+        if agent.tracer.on and agent.tracer.traces(state.betting_round):
+            agent.tracer.record(
+                "cfrp", info_set=state.info_set, strategy=sigma.tolist(), values=voa, value=vo
+            )
         return vo
     else:
-        Iph = state.info_set
-        sigma = calculate_strategy(agent.regret, Iph, state)
-        try:
-            a = np.random.choice(
-                list(sigma[Iph].keys()), 1, p=list(sigma[Iph].values()),
-            )[0]
-        except ValueError:
-            p = 1 / len(state.legal_actions)
-            probabilities = np.full(len(state.legal_actions), p)
-            a = np.random.choice(state.legal_actions, p=probabilities)
-            sigma[Iph] = {action: p for action in state.legal_actions}
-        new_state: PokerState = state.apply_action(a)
-        return cfrp(agent, new_state, i, t, c)
+        Iph = agent.table.row(state.info_set_key, state.legal_action_mask)
+        sigma = calculate_strategy(agent.table, Iph)
+        a = action_names[agent.sampler.choose(sigma)]
+        state.apply_action(a, inplace=True)
+        vo = cfrp(agent, state, i, t, c)
+        state.undo_action()
+        return vo
 
 
 def print_strategy(strategy: Dict[str, Dict[str, int]]):
@@ -365,6 +331,24 @@ def _create_dir() -> Path:
 @click.option("--print_iteration", default=10, help=".")
 @click.option("--dump_iteration", default=1, help=".")
 @click.option("--update_threshold", default=1, help=".")
+@click.option("--seed", default=None, type=int, help="seed of the action sampling and the dealt cards.")
+@click.option("--full_interval", default=10, help="dumps between two full checkpoints.")
+@click.option("--keep_last", default=0, help="dumps kept in full, 0 keeps all of them.")
+@click.option(
+    "--average_power",
+    default=0.0,
+    help="strategy counts of iteration t are weighted by t ** average_power, on top of the "
+    "LCFR discount. 0 keeps plain counts, which the discount weights linearly up to "
+    "lcfr_threshold.",
+)
+@click.option("--trace_path", default=None, help="JSON lines file of traced iterations, off if unset.")
+@click.option("--trace_every", default=1000, help="one iteration in trace_every is traced.")
+@click.option(
+    "--trace_street",
+    multiple=True,
+    type=click.Choice(streets),
+    help="street that is traced, can be repeated, all streets if unset.",
+)
 def train(
     strategy_interval: int,
     n_iterations: int,
@@ -376,6 +360,13 @@ def train(
     print_iteration: int,
     dump_iteration: int,
     update_threshold: int,
+    seed: Optional[int],
+    full_interval: int,
+    keep_last: int,
+    average_power: float,
+    trace_path: Optional[str],
+    trace_every: int,
+    trace_street: Tuple[str, ...],
 ):
     """Train agent."""
     # Get the values passed to this method, save this.
@@ -383,46 +374,46 @@ def train(
     # with open(save_path / "config.yaml", "w") as steam:
     #     yaml.dump(config, steam)
     # utils.random.seed(42)
-    agent = Agent()
+    tracer = Tracer(trace_path, trace_every, trace_street or None)
+    agent = Agent(seed, average_power, tracer)
+    checkpointer = AsyncCheckpointer('start', full_interval, keep_last, dump_iteration)
 
 
     for t in range(1, n_iterations + 1):
-        # if t == 2:
-        #     logging.disable(logging.DEBUG)
+        tracer.start_iteration(t)
         for i in range(n_players):  # fixed position i
             # Create a new state.
-            state: PokerState = new_game(n_players)
+            state: PokerState = new_game(n_players, rng=agent.sampler.generator)
             if t > update_threshold and t % strategy_interval == 0:
                 update_strategy(agent, state, i, t)
             if t > prune_threshold:
-                if random.uniform(0, 1) < 0.05:
+                if agent.sampler.uniform() < 0.05:
                     cfr(agent, state, i, t)
                 else:
                     cfrp(agent, state, i, t, c)
             else:
                 cfr(agent, state, i, t)
-        if t < lcfr_threshold & t % discount_interval == 0:
+        if t < lcfr_threshold and t % discount_interval == 0:
             # TODO(fedden): Is discount_interval actually set/managed in
             #               minutes here? In Algorithm 1 this should be managed
             #               in minutes using perhaps the time module, but here
             #               it appears to be being managed by the iterations
             #               count.
             d = (t / discount_interval) / ((t / discount_interval) + 1)
-            for I in agent.regret.keys():
-                for a in agent.regret[I].keys():
-                    agent.regret[I][a] *= d
-                    agent.strategy[I][a] *= d
+            agent.table.discount(d)
         if (t > update_threshold) & (t % dump_iteration == 0):
             # dump the current
             # strategy (sigma) throughout training and then take an average.
             # This allows for estimation of expected value in leaf nodes later
             # on using modified versions of the blueprint strategy
-            to_persist = to_dict(strategy=agent.strategy, regret=agent.regret)
-            joblib.dump(to_persist, 'start/' + f"strategy_{t}.gz", compress="gzip")
+            checkpointer.save(agent.table, t)
 
         # if t % print_iteration == 0:
         #     print_strategy(agent.strategy)
+    checkpointer.close()
+    tracer.close()
     save_path: Path = 'start'
+    write_blueprint(agent.table, os.path.join(save_path, f"blueprint_{n_iterations}.bp"), n_iterations)
     # to_persist = to_dict(strategy=agent.strategy, regret=agent.regret)
     # joblib.dump(to_persist, 'start/' + "strategy.gz", compress="gzip")
     # print_strategy(agent.strategy)
@@ -0,0 +1,167 @@
+"""Throughput of sync_blueprint workers against the number of processes.
+
+For every process count, each worker runs for a fixed time and the totals
+of all workers are reported:
+
+* cfr: MCCFR iterations on freshly dealt games, all on one
+  `SharedInfoSetTable`.
+* shared: regret updates of random info sets in the shared table.
+* manager: the same updates as read-modify-writes of a Manager dict, the
+  way the agent stored regrets before.
+
+Bucket lookups are replaced by a hash of the cards, so only the training
+loop is timed.
+
+    python src/blueprint_algo/sync_benchmark.py --n_processes 1 --n_processes 2 --n_processes 4
+"""
+import multiprocessing as mp
+import os
+import queue
+import random
+import sys
+import time
+from typing import Callable, Sequence
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(os.path.split(curPath)[0])[0]
+sys.path.append(rootPath)
+
+import click
+
+import tools.EHS_based_v2.bucket_table as bucket_table
+from tools.blueprint.sampling import ActionSampler
+from tools.blueprint.shared_table import SharedInfoSetTable
+from tools.blueprint.tracing import Tracer
+from tools.poker.actions import Action
+from tools.poker.state import new_game
+import sync_blueprint
+
+# Info set keys for the update benchmarks: a bucket and a few actions.
+_keys = [(1 << 8 | bucket) << 12 | 0x222 for bucket in range(256)] * 64
+_keys = [key << 4 | i % 8 + 1 for i, key in enumerate(_keys)]
+
+
+def _lookup(board_card, hole_card) -> int:
+    return hash((tuple(board_card), tuple(hole_card))) % 50
+
+
+class _Agent:
+    """Agent of a worker, the shared table, a sampler of its own stream and
+    a tracer that is off."""
+
+    def __init__(self, table: SharedInfoSetTable, worker_id: int):
+        self.table = table
+        self.sampler = ActionSampler(0, worker_id)
+        self.tracer = Tracer()
+
+
+def _run_cfr(table: SharedInfoSetTable, worker_id: int, deadline: float) -> int:
+    bucket_table.lossy_lookup = _lookup
+    agent = _Agent(table, worker_id)
+    n_iterations = 0
+    while time.time() < deadline:
+        for i in range(2):
+            state = new_game(2, rng=agent.sampler.generator)
+            sync_blueprint.cfr(agent, state, i, n_iterations + 1)
+        n_iterations += 1
+    return n_iterations
+
+
+def _run_shared(table: SharedInfoSetTable, worker_id: int, deadline: float) -> int:
+    rng = random.Random(worker_id)
+    ids = [Action.fold, Action.call, Action.allin]
+    n_updates = 0
+    while time.time() < deadline:
+        for _ in range(100):
+            row = table.row(rng.choice(_keys), 0b10000011)
+            table.add_regret(row, ids, [1.0, -1.0, 2.0])
+        n_updates += 100
+    return n_updates
+
+
+def _run_manager(regret, worker_id: int, deadline: float) -> int:
+    rng = random.Random(worker_id)
+    n_updates = 0
+    while time.time() < deadline:
+        for _ in range(100):
+            key = rng.choice(_keys)
+            this_states_regret = regret.get(key, {"fold": 0, "call": 0, "allin": 0})
+            for action, delta in zip(("fold", "call", "allin"), (1.0, -1.0, 2.0)):
+                this_states_regret[action] += delta
+            regret[key] = this_states_regret
+        n_updates += 100
+    return n_updates
+
+
+def _worker(run: Callable, store, worker_id: int, start: float, seconds: float, results):
+    while time.time() < start:
+        time.sleep(0.001)
+    results.put(run(store, worker_id, start + seconds))
+
+
+def measure(
+    run: Callable, store, n_processes: int, seconds: float, margin: float = 60.0
+) -> float:
+    """Total rate of `run` over `n_processes` workers sharing `store`.
+
+    Raises a RuntimeError if a worker dies, or if the results are not in
+    `margin` seconds after the end of the measurement.
+    """
+    results = mp.Queue()
+    start = time.time() + 0.5
+    workers = [
+        mp.Process(target=_worker, args=(run, store, i, start, seconds, results))
+        for i in range(n_processes)
+    ]
+    for worker in workers:
+        worker.start()
+    total = 0
+    try:
+        for _ in workers:
+            total += _result(results, workers, start + seconds + margin)
+    except RuntimeError:
+        for worker in workers:
+            worker.terminate()
+        raise
+    finally:
+        for worker in workers:
+            worker.join()
+    return total / seconds
+
+
+def _result(results, workers: Sequence[mp.Process], deadline: float) -> int:
+    """Next result of the workers, checking that they are alive while waiting."""
+    while True:
+        try:
+            return results.get(timeout=1.0)
+        except queue.Empty:
+            pass
+        # A worker that put its result exits with 0.
+        for worker in workers:
+            if worker.exitcode:
+                raise RuntimeError(f"{worker.name} died, exit code {worker.exitcode}.")
+        if time.time() > deadline:
+            raise RuntimeError("The workers did not report their results in time.")
+
+
+@click.command()
+@click.option("--n_processes", multiple=True, type=int, help="process counts, 1 2 4 by default.")
+@click.option("--seconds", default=5.0, help="duration of every measurement.")
+@click.option("--table_capacity", default=1 << 20, help="slots of the shared table.")
+def cli(n_processes: Sequence[int], seconds: float, table_capacity: int):
+    """Print the throughput of the workers for every process count."""
+    manager = mp.Manager()
+    click.echo(f"{'processes':>9} {'cfr it/s':>10} {'shared upd/s':>13} {'manager upd/s':>14}")
+    for n in n_processes or (1, 2, 4):
+        rates = []
+        for run in (_run_cfr, _run_shared):
+            table = SharedInfoSetTable(table_capacity)
+            rates.append(measure(run, table, n, seconds))
+            table.close()
+            table.unlink()
+        rates.append(measure(_run_manager, manager.dict(), n, seconds))
+        click.echo(f"{n:>9} {rates[0]:>10.0f} {rates[1]:>13.0f} {rates[2]:>14.0f}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -7,12 +7,14 @@ import copy
 import datetime
 import json
 import multiprocessing as mp
+import queue
+import threading
 import time
+import traceback
 from pathlib import Path
-from typing import Any, Dict, List, Tuple, Optional
+from typing import Any, Dict, Tuple, Optional
 
 import click
-import joblib
 import numpy as np
 from tqdm import tqdm, trange
 
@@ -20,41 +22,53 @@ from tqdm import tqdm, trange
 import collections
 import logging
 root_logger= logging.getLogger()
-root_logger.setLevel(logging.DEBUG) # or whatever
-handler = logging.FileHandler(filename="test.txt",mode='w',encoding='utf-8') # or whatever
-handler.setFormatter(logging.Formatter('%(name)s %(message)s')) # or whatever
-root_logger.addHandler(handler)
 # from numba import jit
-# logging.basicConfig(filename="test.txt", level=logging.DEBUG)
 import sys
 import os
 curPath = os.path.abspath(os.path.dirname(__file__))
 rootPath = os.path.split(os.path.split(curPath)[0])[0]
 sys.path.append(rootPath)
 
+from tools.blueprint.sampling import ActionSampler
+from tools.blueprint.checkpoint import (
+    AsyncCheckpointer,
+    load_checkpoint,
+    write_blueprint,
+    write_checkpoint,
+)
+from tools.blueprint.shared_table import SharedInfoSetTable
+from tools.blueprint.tracing import Tracer, streets
+from tools.poker.actions import action_names
 from tools.poker.state import PokerState
 from tools.poker.state import new_game
-from tools.poker.pot import Pot
 
 class Agent:
-    # TODO(fedden): Note from the supplementary material, the data here will
-    #               need to be lower precision: "To save memory, regrets were
-    #               stored using 4-byte integers rather than 8-byte doubles.
-    #               There was also a ﬂoor on regret at -310,000,000 for every
-    #               action. This made it easier to unprune actions that were
-    #               initially pruned but later improved. This also prevented
-    #               integer overﬂows".
+    # NOTE: The regrets and strategies of all workers live in one shared
+    #       memory table, stored as 4-byte integers with a floor of
+    #       -310,000,000 as in the supplementary material.
 
-    def __init__(self):
-        self.strategy = manager.dict()
-        self.regret = manager.dict()
+    def __init__(
+        self,
+        seed: Optional[int] = None,
+        table_capacity: int = 1 << 22,
+        average_power: float = 0.0,
+        tracer: Optional[Tracer] = None,
+    ):
+        self.table = SharedInfoSetTable(table_capacity)
+        # Workers replace this with a sampler of their own stream.
+        self.sampler = ActionSampler(seed)
+        self.average_power = average_power
+        # Off unless it is given a path, workers replace it with a tracer
+        # writing to a file of their own.
+        self.tracer = Tracer() if tracer is None else tracer
         # self.init_strategy()
     def init_strategy(self):
-        dd = joblib.load('start/' + "strategy_55000.gz")
-        for keyI , valueA in dd['strategy'].items():
-            self.strategy[keyI] = valueA
-        for keyI , valueA in dd['regret'].items():
-            self.regret[keyI] = valueA
+        dd = load_checkpoint('start', 55000)
+        dd.load_into(self.table)
+
+    def strategy_weight(self, t: int) -> float:
+        """Weight of the strategy counts of iteration `t` in the average strategy."""
+        return t ** self.average_power
 
 
 def update_strategy(agent: Agent, state: PokerState, i: int, t: int):
@@ -86,7 +100,7 @@ def update_strategy(agent: Agent, state: PokerState, i: int, t: int):
 
     ph = state.player_i  # this is always the case no matter what i is
 
-    player_not_in_hand = not state.players[i].is_active
+    player_not_in_hand = not state.players[i].active
     if state.is_terminal or player_not_in_hand or state.betting_round > 0:
         return
 
@@ -101,51 +115,44 @@ def update_strategy(agent: Agent, state: PokerState, i: int, t: int):
     #   update_strategy(rs, h + a, i, t)
 
     elif ph == i:
-        I = state.info_set
+        I = agent.table.row(state.info_set_key, state.legal_action_mask)
         # calculate regret
-        sigma = calculate_strategy(agent.regret, state)
+        sigma = calculate_strategy(agent.table, I)
         # log.debug(f"Calculated Strategy for {I}: {sigma}")
         # choose an action based of sigma
-        available_actions: List[str] = list(sigma.keys())
-        action_probabilities: List[float] = list(sigma.values())
-        action: str = np.random.choice(available_actions, p=action_probabilities)
+        action_id = agent.sampler.choose(sigma)
+        action: str = action_names[action_id]
         # log.debug(f"ACTION SAMPLED: ph {state.player_i} ACTION: {action}")
-        # Increment the action counter.
-        this_states_strategy = agent.strategy.get(I, state.initial_strategy)
-        this_states_strategy[action] += 1
-        # Update the master strategy by assigning.
-        agent.strategy[I] = this_states_strategy
-        new_state: PokerState = state.apply_action(action)
-        update_strategy(agent, new_state, i, t)
+        if agent.tracer.on and agent.tracer.traces(state.betting_round):
+            agent.tracer.record(
+                "update_strategy",
+                info_set=state.info_set,
+                strategy=sigma.tolist(),
+                action=action,
+                chips=[p.n_chips for p in state.players],
+            )
+        # Increment the action counter, weighted by the iteration.
+        agent.table.add_strategy(I, action_id, agent.strategy_weight(t))
+        state.apply_action(action, inplace=True)
+        update_strategy(agent, state, i, t)
+        state.undo_action()
     else:
         # Traverse each action.
         for action in state.legal_actions:
             # log.debug(f"Going to Traverse {action} for opponent")
-            new_state: PokerState = state.apply_action(action)
-            update_strategy(agent, new_state, i, t)
+            state.apply_action(action, inplace=True)
+            update_strategy(agent, state, i, t)
+            state.undo_action()
 
 
-def calculate_strategy(
-    regret: Dict[str, Dict[str, float]], state: PokerState,
-) -> Dict[str, float]:
+def calculate_strategy(table: SharedInfoSetTable, I: int) -> np.ndarray:
     """
 
-    :param regret: dictionary of regrets, I is key, then each action at I, with values being regret
-    :param state: the game state
-    :return: doesn't return anything, just updates sigma
+    :param table: regrets and strategies of the info sets
+    :param I: the row of the info set in the table
+    :return: the strategy at I indexed by action id, zero for illegal actions
     """
-    default_probability = 1 / len(state.legal_actions)
-    sigma: Dict[str, float] = dict()
-    # We don't make use of default dicts anymore, so prepare a dictionary
-    # describing uniform regret of zero for all legal actions for this state.
-    this_states_regret = regret.get(state.info_set, state.initial_regret)
-    regret_sum = sum([max(r, 0) for r in this_states_regret.values()])
-    for action in state.legal_actions:
-        if regret_sum > 0:
-            sigma[action] = max(this_states_regret[action], 0) / regret_sum
-        else:
-            sigma[action] = default_probability
-    return sigma
+    return table.current_strategy(I)
 
 
 def cfr(agent: Agent, state: PokerState, i: int, t: int) -> float:
@@ -176,7 +183,7 @@ def cfr(agent: Agent, state: PokerState, i: int, t: int) -> float:
 
     ph = state.player_i
 
-    player_not_in_hand = not state.players[i].is_active
+    player_not_in_hand = not state.players[i].active
     if state.is_terminal or player_not_in_hand:
         return state.payout[i]
 
@@ -196,42 +203,45 @@ def cfr(agent: Agent, state: PokerState, i: int, t: int) -> float:
     #   cfr()
 
     elif ph == i:
-        I = state.info_set
+        I = agent.table.row(state.info_set_key, state.legal_action_mask)
         # calculate strategy
-        sigma = calculate_strategy(agent.regret, state)
+        sigma = calculate_strategy(agent.table, I)
         # log.debug(f"Calculated Strategy for {I}: {sigma}")
 
         vo = 0.0
         voa: Dict[str, float] = {}
-        for action in state.legal_actions:
+        for action_id, action in zip(state.legal_action_ids, state.legal_actions):
             # log.debug(
             #     f"ACTION TRAVERSED FOR REGRET: ph {state.player_i} ACTION: {action}"
             # )
-            new_state: PokerState = state.apply_action(action)
-            voa[action] = cfr(agent, new_state, i, t)
+            state.apply_action(action, inplace=True)
+            voa[action] = cfr(agent, state, i, t)
+            state.undo_action()
             # log.debug(f"Got EV for {action}: {voa[action]}")
-            vo += sigma[action] * voa[action]
+            vo += sigma[action_id] * voa[action]
             # log.debug(
             #     f"Added to Node EV for ACTION: {action} INFOSET: {I}\n"
             #     f"STRATEGY: {sigma[action]}: {sigma[action] * voa[action]}"
             # )
         # log.debug(f"Updated EV at {I}: {vo}")
-        this_states_regret = agent.regret.get(I, state.initial_regret)
-        for action in state.legal_actions:
-            this_states_regret[action] += voa[action] - vo
-        # Assign regret back to the shared memory.
-        agent.regret[I] = this_states_regret
+        agent.table.add_regret(
+            I, state.legal_action_ids, [voa[action] - vo for action in state.legal_actions]
+        )
+        if agent.tracer.on and agent.tracer.traces(state.betting_round):
+            agent.tracer.record(
+                "cfr", info_set=state.info_set, strategy=sigma.tolist(), values=voa, value=vo
+            )
         return vo
     else:
-        Iph = state.info_set
-        sigma = calculate_strategy(agent.regret, state)
+        Iph = agent.table.row(state.info_set_key, state.legal_action_mask)
+        sigma = calculate_strategy(agent.table, Iph)
         # log.debug(f"Calculated Strategy for {Iph}: {sigma}")
-        available_actions: List[str] = list(sigma.keys())
-        action_probabilities: List[float] = list(sigma.values())
-        action: str = np.random.choice(available_actions, p=action_probabilities)
+        action: str = action_names[agent.sampler.choose(sigma)]
         # log.debug(f"ACTION SAMPLED: ph {state.player_i} ACTION: {action}")
-        new_state: PokerState = state.apply_action(action)
-        return cfr(agent, new_state, i, t)
+        state.apply_action(action, inplace=True)
+        vo = cfr(agent, state, i, t)
+        state.undo_action()
+        return vo
 
 
 def cfrp(agent: Agent, state: PokerState, i: int, t: int, c: int):
@@ -263,38 +273,42 @@ def cfrp(agent: Agent, state: PokerState, i: int, t: int, c: int):
     #   sample action from strategy for h
     #   cfr()
     elif ph == i:
-        I = state.info_set
+        I = agent.table.row(state.info_set_key, state.legal_action_mask)
         # calculate strategy
-        sigma = calculate_strategy(agent.regret, state)
+        sigma = calculate_strategy(agent.table, I)
         # TODO: Does updating sigma here (as opposed to after regret) miss out
         #       on any updates? If so, is there any benefit to having it up
         #       here?
         vo = 0.0
         voa: Dict[str, float] = dict()
-        # Explored dictionary to keep track of regret updates that can be
-        # skipped.
-        explored: Dict[str, bool] = {action: False for action in state.legal_actions}
+        # Explored dictionary from action id to action, of the actions whose
+        # regret is updated.
+        explored: Dict[int, str] = {}
         # Get the regret for this state.
-        this_states_regret = agent.regret.get(I, state.initial_regret)
-        for action in state.legal_actions:
-            if this_states_regret[action] > c:
-                new_state: PokerState = state.apply_action(action)
-                voa[action] = cfrp(agent, new_state, i, t, c)
-                explored[action] = True
-                vo += sigma[action] * voa[action]
-        for action in state.legal_actions:
-            if explored[action]:
-                this_states_regret[action] += voa[action] - vo
-        # Update the master copy of the regret.
-        agent.regret[I] = this_states_regret
+        this_states_regret = agent.table.regret[I]
+        for action_id, action in zip(state.legal_action_ids, state.legal_actions):
+            if this_states_regret[action_id] > c:
+                state.apply_action(action, inplace=True)
+                voa[action] = cfrp(agent, state, i, t, c)
+                state.undo_action()
+                explored[action_id] = action
+                vo += sigma[action_id] * voa[action]
+        agent.table.add_regret(
+            I, list(explored), [voa[action] - vo for action in explored.values()]
+        )
+        if agent.tracer.on and agent.tracer.traces(state.betting_round):
+            agent.tracer.record(
+                "cfrp", info_set=state.info_set, strategy=sigma.tolist(), values=voa, value=vo
+            )
         return vo
     else:
-        sigma = calculate_strategy(agent.regret, state)
-        available_actions: List[str] = list(sigma.keys())
-        action_probabilities: List[float] = list(sigma.values())
-        action: str = np.random.choice(available_actions, p=action_probabilities)
-        new_state: PokerState = state.apply_action(action)
-        return cfrp(agent, new_state, i, t, c)
+        Iph = agent.table.row(state.info_set_key, state.legal_action_mask)
+        sigma = calculate_strategy(agent.table, Iph)
+        action: str = action_names[agent.sampler.choose(sigma)]
+        state.apply_action(action, inplace=True)
+        vo = cfrp(agent, state, i, t, c)
+        state.undo_action()
+        return vo
 
 
 
@@ -333,7 +347,7 @@ class Worker(mp.Process):
 
     def __init__(
         self,
-        queue: mp.Queue,
+        queue: mp.JoinableQueue,
         agent: Agent,
         info_set_lut: InfoSetLookupTable,
         n_players: int,
@@ -345,10 +359,13 @@ class Worker(mp.Process):
         dump_iteration: int,
         save_path: Path,
         worker_status: Dict[str, bool],
+        worker_errors: Dict[str, str],
+        seed: Optional[int],
+        worker_id: int,
     ):
         """"""
         super(Worker, self).__init__()
-        self._queue: mp.Queue = queue
+        self._queue: mp.JoinableQueue = queue
         self._state: PokerState = None
         self._info_set_lut: InfoSetLookupTable = info_set_lut
         self._n_players = n_players
@@ -361,31 +378,60 @@ class Worker(mp.Process):
         self._dump_iteration = dump_iteration
         self._save_path = save_path
         self._worker_status = worker_status
+        self._worker_errors = worker_errors
+        self._seed = seed
+        self._worker_id = worker_id
 
     def run(self):
         """"""
+        # The agent is a copy in this process, only its tables are shared.
+        self._agent.sampler = ActionSampler(self._seed, self._worker_id)
+        self._agent.tracer = self._agent.tracer.for_worker(self._worker_id)
         while True:
             # Get the name of the method and the key word arguments needed for
             # the method.
             self._update_status("idle")
             name, kwargs = self._queue.get(block=True)
-            if name == "terminate":
+            # Mark the job done also if it fails, the server joins the queue.
+            # A failed job stops the worker, the server raises its traceback.
+            try:
+                if name == "terminate":
+                    self._agent.tracer.close()
+                    break
+                elif name == "cfr":
+                    function = self._cfr
+                elif name == "update_strategy":
+                    function = self._update_strategy
+                elif name == "discount":
+                    function = self._discount
+                else:
+                    raise ValueError(f"Unrecognised function name: {name}")
+                self._update_status(name)
+                # The server may have grown the table since the last job.
+                self._agent.table.follow()
+                function(**kwargs)
+            except Exception:
+                self._worker_errors[self.name] = traceback.format_exc()
+                self._update_status("failed")
                 break
-            elif name == "cfr":
-                function = self._cfr
-            elif name == "discount":
-                function = self._discount
-            elif name == "serialise_agent":
-                function = self._serialise_agent
-            else:
-                raise ValueError(f"Unrecognised function name: {name}")
-            self._update_status(name)
-            function(**kwargs)
+            finally:
+                self._queue.task_done()
+
+    def _update_strategy(self, t, i):
+        """Add the strategy of player i in a random game to the average."""
+        state: PokerState = new_game(
+            self._n_players, self._info_set_lut, rng=self._agent.sampler.generator
+        )
+        self._agent.tracer.start_iteration(t)
+        update_strategy(self._agent, state, i, t)
 
     def _cfr(self, t, i):
         """Search over random game and calculate the strategy."""
-        self._state: PokerState = new_game(self._n_players, self._info_set_lut)
-        use_pruning = np.random.uniform() < 0.95
+        self._state: PokerState = new_game(
+            self._n_players, self._info_set_lut, rng=self._agent.sampler.generator
+        )
+        use_pruning = self._agent.sampler.uniform() < 0.95
+        self._agent.tracer.start_iteration(t)
         if t > self._prune_threshold and use_pruning:
             cfr(self._agent, self._state, i, t)
         else:
@@ -401,19 +447,7 @@ class Worker(mp.Process):
         discount_factor = (t / self._discount_interval) / (
             (t / self._discount_interval) + 1
         )
-        for info_set in self._agent.regret.keys():
-            for action in self._agent.regret[info_set].keys():
-                self._agent.regret[info_set,action] *= discount_factor
-                self._agent.strategy[info_set,action] *= discount_factor
-
-    def _serialise_agent(self, t):
-        """Write agent to file."""
-        # dump the current
-        # strategy (sigma) throughout training and then take an average.
-        # This allows for estimation of expected value in leaf nodes later
-        # on using modified versions of the blueprint strategy
-        to_persist = to_dict(strategy=self._agent.strategy, regret=self._agent.regret)
-        joblib.dump(to_persist, self._save_path +"strategy_"+str(t)+".gz", compress="gzip")
+        self._agent.table.discount(discount_factor)
 
     def _update_status(self, status):
         """Update the status of this worker in the shared dictionary."""
@@ -456,6 +490,11 @@ class Server:
         update_threshold: int,
         n_processes: int = mp.cpu_count() - 1,
         seed: Optional[int] = None,
+        table_capacity: int = 1 << 22,
+        full_interval: int = 10,
+        keep_last: int = 0,
+        average_power: float = 0.0,
+        tracer: Optional[Tracer] = None,
     ):
         """Set up the optimisation server."""
         config: Dict[str, int] = {**locals()}
@@ -469,15 +508,22 @@ class Server:
         self._lcfr_threshold = lcfr_threshold
         self._discount_interval = discount_interval
         self._update_threshold = update_threshold
+        self._strategy_interval = strategy_interval
         self._dump_iteration = dump_iteration
         self._n_players = n_players
+        # Fraction of the slots of the table in use at which it doubles.
+        self._grow_load = 0.5
         self._info_set_lut: InfoSetLookupTable = None #load_info_set_lut()
         root_logger.info("Loaded lookup table.")
-        self._queue: mp.Queue = mp.Queue(maxsize=n_processes)
+        self._queue: mp.JoinableQueue = mp.JoinableQueue(maxsize=n_processes)
         self._worker_status: Dict[str, bool] = manager.dict()
-        self._agent: Agent = Agent()
+        self._worker_errors: Dict[str, str] = manager.dict()
+        self._agent: Agent = Agent(seed, table_capacity, average_power, tracer)
+        self._checkpointer = AsyncCheckpointer(
+            self._save_path, full_interval, keep_last, dump_iteration
+        )
         self._workers: Dict[str, Worker] = dict()
-        for _ in range(n_processes):
+        for worker_id in range(n_processes):
             worker = Worker(
                 queue=self._queue,
                 agent=self._agent,
@@ -491,6 +537,9 @@ class Server:
                 dump_iteration=dump_iteration,
                 save_path=self._save_path,
                 worker_status=self._worker_status,
+                worker_errors=self._worker_errors,
+                seed=seed,
+                worker_id=worker_id,
             )
             self._workers[worker.name] = worker
             self._workers[worker.name].start()
@@ -503,13 +552,35 @@ class Server:
         # ipdb.set_trace()
         for t in trange(1, self._n_iterations + 1, desc="train iter"):
             for i in range(self._n_players):
+                if t > self._update_threshold and t % self._strategy_interval == 0:
+                    self._send_job("update_strategy", t=t, i=i)
                 self._send_job("cfr", t=t, i=i)
-                if t < self._lcfr_threshold & t % self._discount_interval == 0:
-                    self._wait_until_all_workers_are_idle()
-                    self._send_job("discount", t=t)
-                if t > self._update_threshold and t % self._dump_iteration == 0:
-                    self._wait_until_all_workers_are_idle()
-                    self._send_job("serialise_agent", t=t)
+            # Discount once per iteration, while no other job runs: the
+            # discount is not locked and may settle every row of the table.
+            if t < self._lcfr_threshold and t % self._discount_interval == 0:
+                self._wait_until_all_workers_are_idle()
+                self._send_job("discount", t=t)
+                self._wait_until_all_workers_are_idle()
+            # Grow the table at half load. Inserts fail at 75%, which leaves a
+            # quarter of the slots to the jobs in flight.
+            if self._agent.table.load > self._grow_load:
+                self._wait_until_all_workers_are_idle()
+                self._agent.table.grow()
+                root_logger.info(f"grew the table to {self._agent.table.capacity} slots")
+            # Dump once both players are done, a second snapshot of the same
+            # iteration would be hidden by the first.
+            if t > self._update_threshold and t % self._dump_iteration == 0:
+                self._wait_until_all_workers_are_idle()
+                self._serialise_agent(t)
+
+    def _serialise_agent(self, t):
+        """Write agent to file in the background."""
+        # dump the current
+        # strategy (sigma) throughout training and then take an average.
+        # This allows for estimation of expected value in leaf nodes later
+        # on using modified versions of the blueprint strategy. Workers keep
+        # updating the shared table, so the writer gets a copy of the rows.
+        self._checkpointer.save(self._agent.table, t, copy=True)
 
     def terminate(self):
         """Kill all workers."""
@@ -522,21 +593,57 @@ class Server:
             worker.join()
             root_logger.info(f"worker {name} joined.")
 
+    def kill(self):
+        """Stop the workers without waiting for their jobs, after a failure."""
+        for worker in self._workers.values():
+            worker.terminate()
+            worker.join()
+
     def serialise_agent(self):
         """Write agent to file."""
-        to_persist = to_dict(strategy=self._agent.strategy, regret=self._agent.regret)
-        joblib.dump(to_persist, self._save_path + "strategy.gz", compress="gzip")
+        self._checkpointer.close()
+        write_checkpoint(self._agent.table, self._save_path + "strategy.bp")
+        write_blueprint(self._agent.table, self._save_path + "blueprint.bp", self._n_iterations)
         # print_strategy(self._agent.strategy)
 
+    def close(self):
+        """Free the shared memory of the agent, once the workers have joined."""
+        self._agent.table.close()
+        self._agent.table.unlink()
+
     def _send_job(self, name, **kwargs):
         """Send job of type `name` with arguments `kwargs` to worker pool."""
-        self._queue.put((name, kwargs), block=True)
+        # The queue stays full if no worker is left to take the job.
+        while True:
+            try:
+                self._queue.put((name, kwargs), block=True, timeout=1.0)
+                return
+            except queue.Full:
+                self._check_workers()
 
     def _wait_until_all_workers_are_idle(self, sleep_secs=0.5):
         """Blocks until all workers have finished their current job."""
+        # A worker still reads as idle between a put and its get, so wait
+        # for every job sent to be done first. Jobs of a worker that died
+        # are never done, so the join runs in a thread and is not waited on
+        # once a worker has failed.
+        joined = threading.Thread(target=self._queue.join, daemon=True)
+        joined.start()
+        while joined.is_alive():
+            self._check_workers()
+            joined.join(sleep_secs)
         while any(status != "idle" for status in self._worker_status.values()):
+            self._check_workers()
             time.sleep(sleep_secs)
 
+    def _check_workers(self):
+        """Raise the error of a worker whose job failed or that has died."""
+        for name, worker in self._workers.items():
+            if name in self._worker_errors:
+                raise RuntimeError(f"Worker {name} failed:\n{self._worker_errors[name]}")
+            if worker.exitcode is not None:
+                raise RuntimeError(f"Worker {name} died, exit code {worker.exitcode}.")
+
 
 @click.command()
 @click.option("--strategy_interval", default=2, help=".")
@@ -549,6 +656,40 @@ class Server:
 @click.option("--print_iteration", default=1000, help=".")
 @click.option("--dump_iteration", default=1000, help=".")
 @click.option("--update_threshold", default=0, help=".")
+@click.option(
+    "--seed",
+    default=None,
+    type=int,
+    help="seed of the action sampling and the dealt cards, every worker draws its own stream.",
+)
+@click.option(
+    "--table_capacity",
+    default=1 << 22,
+    help="initial info set slots of the shared table, a power of two. Every slot takes "
+    "about 134 bytes of /dev/shm, 1 << 22 about 560MB. The table doubles once half of "
+    "its slots are used.",
+)
+@click.option("--full_interval", default=10, help="dumps between two full checkpoints.")
+@click.option("--keep_last", default=0, help="dumps kept in full, 0 keeps all of them.")
+@click.option(
+    "--average_power",
+    default=0.0,
+    help="strategy counts of iteration t are weighted by t ** average_power, on top of the "
+    "LCFR discount. 0 keeps plain counts, which the discount weights linearly up to "
+    "lcfr_threshold.",
+)
+@click.option(
+    "--trace_path",
+    default=None,
+    help="JSON lines file of traced iterations, one per worker, off if unset.",
+)
+@click.option("--trace_every", default=1000, help="one iteration in trace_every is traced.")
+@click.option(
+    "--trace_street",
+    multiple=True,
+    type=click.Choice(streets),
+    help="street that is traced, can be repeated, all streets if unset.",
+)
 def search(
     strategy_interval: int,
     n_iterations: int,
@@ -560,6 +701,14 @@ def search(
     print_iteration: int,
     dump_iteration: int,
     update_threshold: int,
+    seed: Optional[int],
+    table_capacity: int,
+    full_interval: int,
+    keep_last: int,
+    average_power: float,
+    trace_path: Optional[str],
+    trace_every: int,
+    trace_street: Tuple[str, ...],
 ):
     """Train agent."""
     # Get the values passed to this method, save this.
@@ -575,11 +724,23 @@ def search(
         dump_iteration=dump_iteration,
         update_threshold=update_threshold,
         # n_processes=1,
-        seed=42,
+        seed=seed,
+        table_capacity=table_capacity,
+        full_interval=full_interval,
+        keep_last=keep_last,
+        average_power=average_power,
+        tracer=Tracer(trace_path, trace_every, trace_street or None),
     )
-    server.search()
+    try:
+        server.search()
+    except Exception:
+        # The workers left would keep the process alive.
+        server.kill()
+        server.close()
+        raise
     server.terminate()
     server.serialise_agent()
+    server.close()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,44 @@
 import tools.EHS_based_v2.parallel_holdem_calc_dev as parallel_holdem_calc_dev
-import tools.EHS_based_v2.holdem_calc as holdem_calc
+import tools.EHS_based_v2.vectorized_holdem_calc as vectorized_holdem_calc
 import os
+import numpy as np
+from tools.poker.evaluation.eval_card import EvaluationCard
 curPath = os.path.abspath(os.path.dirname(__file__))
+
+# card string ("As") to the integer id of EvaluationCard.str_to_int52
+card_str_to_int52 = {
+    rank + suit: EvaluationCard.str_to_int52(rank + suit)
+    for rank in EvaluationCard.STR_RANKS
+    for suit in EvaluationCard.CHAR_SUIT_TO_INT_SUIT
+}
+
+
+def _build_lossless_table():
+    """52x52 table of the preflop bucket (line of preflop_canonical_hands.txt).
+
+    The canonical hands are written "Xh Ys" for pairs and offsuit hands and
+    "Xh Yh" for suited hands, so every line covers all the suit assignments
+    that `lossless` maps onto it.
+    """
+    table = np.zeros((52, 52), dtype=np.uint8)
+    f = open(curPath + '/preflop_canonical_hands.txt', 'r', encoding='utf8')
+    for poker_line, lines in enumerate(f.readlines(), start=1):
+        card1, card2 = lines.split()
+        rank1 = EvaluationCard.CHAR_RANK_TO_INT_RANK[card1[0]]
+        rank2 = EvaluationCard.CHAR_RANK_TO_INT_RANK[card2[0]]
+        suited = card1[1] == card2[1]
+        for suit1 in range(4):
+            for suit2 in range(4):
+                if (suit1 == suit2) == suited and (rank1, suit1) != (rank2, suit2):
+                    c1 = rank1 + suit1 * 13
+                    c2 = rank2 + suit2 * 13
+                    table[c1, c2] = table[c2, c1] = poker_line
+    f.close()
+    return table
+
+
+# Built once at import so no file is read while dealing games.
+lossless_table = _build_lossless_table()
 def lossy(board_card, hole_card):
 
     hole_card.extend(["?","?"]) #unknown opponent hands 
@@ -23,7 +60,7 @@ def lossy(board_card, hole_card):
 def lossy_single(board_card, hole_card):
 
     hole_card.extend(["?","?"]) #unknown opponent hands 
-    L = holdem_calc.calculate(board_card, False, 1000, None, hole_card, False)
+    L = vectorized_holdem_calc.calculate(board_card, False, 1000, None, hole_card, False)
     EHS = L[0]/2 + L[1] - L[2]
 
     classify = False
@@ -40,61 +77,16 @@ def lossy_single(board_card, hole_card):
 
 
 def lossless(hole_card):
-    dict = {"2": 2, "3": 3, "4": 4,"5": 5, 
-            "6": 6,"7": 7, "8": 8, "9": 9,
-             "T": 10, "J": 11, "Q": 12, "K": 13, "A": 14}
-    card1 = hole_card[0]
-    card2 = hole_card[1]
-    # print(card1,card2)
-    rank1_value = dict[card1[:1]]
-    rank2_value = dict[card2[:1]]
-    suit1 = card1[1:2]
-    suit2 = card2[1:2]
-    if rank1_value == rank2_value:
-        suit1 = "h"
-        suit2 = "s"
-        rank1 = list(dict.keys())[list(dict.values()).index(rank1_value)]
-        rank2 = list(dict.keys())[list(dict.values()).index(rank2_value)]
-        card1 = rank1 + suit1
-        card2 = rank2 + suit2
-    else:
-        if suit1 == suit2:
-            if rank1_value < rank2_value:
-                pass
-            else:
-                temp = rank1_value
-                rank1_value = rank2_value
-                rank2_value = temp
-            suit1 = "h"
-            suit2 = "h"
-            rank1 = list(dict.keys())[list(dict.values()).index(rank1_value)]
-            rank2 = list(dict.keys())[list(dict.values()).index(rank2_value)]
-        else:
-            if rank1_value > rank2_value:
-                pass
-            else:
-                temp = rank1_value
-                rank1_value = rank2_value
-                rank2_value = temp
-            suit1 = "h"
-            suit2 = "s"
-            rank1 = list(dict.keys())[list(dict.values()).index(rank1_value)]
-            rank2 = list(dict.keys())[list(dict.values()).index(rank2_value)]
-        card1 = rank1 + suit1
-        card2 = rank2 + suit2
-    space = " "
-    hole_card_find = card1 + space + card2
-    # print(hole_card_find)
-    
-    poker_line=0;
-    f = open(curPath+'/preflop_canonical_hands.txt','r',encoding='utf8')
-    
-    for lines in f.readlines():
-        poker_line=poker_line+1;
-        if lines.find(hole_card_find)!=-1:
-           break 
+    """Preflop bucket (1-169) of two hole cards given as strings, e.g. ["Ks", "Ac"]."""
+    return int(lossless_table[card_str_to_int52[hole_card[0]], card_str_to_int52[hole_card[1]]])
+
+
+def lossless_int52(card1, card2):
+    """Preflop bucket of two cards in EvaluationCard.str_to_int52 form."""
+    return int(lossless_table[card1, card2])
 
-    f.close()
-    return poker_line
 
-  
\ No newline at end of file
+def lossless_batch(hole_cards):
+    """Preflop buckets of an (n, 2) array of str_to_int52 hole cards."""
+    hole_cards = np.asarray(hole_cards)
+    return lossless_table[hole_cards[:, 0], hole_cards[:, 1]]
@@ -0,0 +1,170 @@
+"""Precomputed EHS bucket tables for the flop, turn and river.
+
+`EHS_based_bucket.lossy_single` runs an equity rollout every time a street is
+dealt. The builder in this module evaluates it once for every suit-isomorphic
+(hole cards, board) class of a street and stores the bucket as a uint8 in a
+``.npy`` file, indexed by `HandIndexer`. At runtime the files are opened with
+``mmap_mode="r"``, so a bucket costs one index computation and one array
+read, and forked training workers share the pages.
+
+Build a table (resumable, safe to interrupt and restart):
+
+    python tools/EHS_based_v2/bucket_table.py --street flop --n_processes 8
+"""
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(os.path.split(curPath)[0])[0]
+sys.path.append(rootPath)
+
+import click
+import numpy as np
+from tqdm import tqdm
+
+import tools.EHS_based_v2.EHS_based_bucket as EHS_based_bucket
+from tools.poker.hand_indexer import HandIndexer
+
+default_table_dir: str = os.path.join(curPath, "tables")
+
+# The board is a single round because EHS does not depend on the order in
+# which the board cards were dealt.
+street_to_cards_per_round: Dict[str, Tuple[int, int]] = {
+    "flop": (2, 3),
+    "turn": (2, 4),
+    "river": (2, 5),
+}
+board_length_to_street: Dict[int, str] = {3: "flop", 4: "turn", 5: "river"}
+
+card_str_to_int52: Dict[str, int] = EHS_based_bucket.card_str_to_int52
+int52_to_card_str: Dict[int, str] = {
+    card: string for string, card in card_str_to_int52.items()
+}
+
+_indexers: Dict[str, HandIndexer] = {}
+_tables: Dict[Tuple[str, str], Optional[np.ndarray]] = {}
+
+
+def get_indexer(street: str) -> HandIndexer:
+    """Return the (cached) indexer used by the table of `street`."""
+    if street not in _indexers:
+        _indexers[street] = HandIndexer(street_to_cards_per_round[street])
+    return _indexers[street]
+
+
+def table_paths(street: str, table_dir: str = default_table_dir) -> Tuple[str, str]:
+    """Return the path of the bucket table and of its progress file."""
+    return (
+        os.path.join(table_dir, f"{street}_buckets.npy"),
+        os.path.join(table_dir, f"{street}_progress.npy"),
+    )
+
+
+def load_table(street: str, table_dir: str = default_table_dir) -> Optional[np.ndarray]:
+    """Memory map the bucket table of `street`.
+
+    Returns None if the table does not exist or its build has not finished,
+    the result is cached so the file system is only checked once.
+    """
+    key = (street, table_dir)
+    if key not in _tables:
+        table_path, progress_path = table_paths(street, table_dir)
+        table = None
+        if os.path.isfile(table_path) and os.path.isfile(progress_path):
+            if np.load(progress_path, mmap_mode="r").all():
+                table = np.load(table_path, mmap_mode="r")
+        _tables[key] = table
+    return _tables[key]
+
+
+def lossy_lookup(board_card: List[str], hole_card: List[str]) -> int:
+    """Drop-in replacement for `EHS_based_bucket.lossy_single`.
+
+    Reads the bucket from the precomputed table of the street, and falls back
+    to the equity rollout if that table has not been built.
+    """
+    street = board_length_to_street[len(board_card)]
+    table = load_table(street)
+    if table is None:
+        return EHS_based_bucket.lossy_single(board_card, list(hole_card))
+    cards = [card_str_to_int52[card] for card in hole_card[:2]]
+    cards += [card_str_to_int52[card] for card in board_card]
+    return int(table[get_indexer(street).index(cards)])
+
+
+def _build_chunk(args: Tuple[str, int, int]) -> Tuple[int, np.ndarray]:
+    """Compute the buckets of the indices in [start, stop)."""
+    street, start, stop = args
+    indexer = get_indexer(street)
+    buckets = np.zeros(stop - start, dtype=np.uint8)
+    for i, hand in enumerate(indexer.unindex_batch(np.arange(start, stop))):
+        cards = [int52_to_card_str[card] for card in hand]
+        buckets[i] = EHS_based_bucket.lossy_single(cards[2:], cards[:2])
+    return start, buckets
+
+
+def build_table(
+    street: str,
+    n_processes: int = mp.cpu_count(),
+    chunk_size: int = 1000,
+    table_dir: str = default_table_dir,
+):
+    """Compute and store the bucket of every isomorphism class of `street`.
+
+    The table is filled chunk by chunk and a progress file records finished
+    chunks, so an interrupted build continues where it stopped. Restarting
+    with a different `chunk_size` is not supported.
+    """
+    os.makedirs(table_dir, exist_ok=True)
+    size = get_indexer(street).size
+    n_chunks = (size + chunk_size - 1) // chunk_size
+    table_path, progress_path = table_paths(street, table_dir)
+    if os.path.isfile(table_path) and os.path.isfile(progress_path):
+        table = np.load(table_path, mmap_mode="r+")
+        progress = np.load(progress_path, mmap_mode="r+")
+        if len(table) != size or len(progress) != n_chunks:
+            raise ValueError(
+                f"Existing files in {table_dir} were built with another "
+                f"chunk_size or indexer, delete them to rebuild."
+            )
+    else:
+        table = np.lib.format.open_memmap(
+            table_path, mode="w+", dtype=np.uint8, shape=(size,)
+        )
+        progress = np.lib.format.open_memmap(
+            progress_path, mode="w+", dtype=np.uint8, shape=(n_chunks,)
+        )
+    jobs = [
+        (street, chunk * chunk_size, min(size, (chunk + 1) * chunk_size))
+        for chunk in np.flatnonzero(progress == 0)
+    ]
+    with mp.Pool(processes=n_processes) as pool:
+        for start, buckets in tqdm(
+            pool.imap_unordered(_build_chunk, jobs),
+            total=len(jobs),
+            desc=f"{street} buckets",
+        ):
+            table[start : start + len(buckets)] = buckets
+            # Persist the buckets before marking the chunk as done.
+            table.flush()
+            progress[start // chunk_size] = 1
+            progress.flush()
+    _tables.pop((street, table_dir), None)
+
+
+@click.command()
+@click.option("--street", type=click.Choice(list(street_to_cards_per_round)), required=True)
+@click.option("--n_processes", default=mp.cpu_count(), help="number of worker processes.")
+@click.option("--chunk_size", default=1000, help="isomorphism classes per job.")
+@click.option("--table_dir", default=default_table_dir, help="where to write the tables.")
+def cli(street: str, n_processes: int, chunk_size: int, table_dir: str):
+    """Build the bucket table of a street."""
+    build_table(street, n_processes, chunk_size, table_dir)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,201 @@
+"""Batched NumPy version of `holdem_calc`.
+
+`holdem_functions.find_winner` evaluates one board at a time through Python
+`Card` objects. Here every (opponent hole cards, board) combination is a row
+of an integer card array, each row is ranked by `SevenCardEvaluator`, and
+wins, ties and losses are counted with array reductions. Hand ranks follow
+`LookupTable`: 1 is a royal flush, 7462 the worst high card, lower is better.
+
+`calculate` has the same contract as `holdem_calc.calculate`, so callers can
+switch between the two modules without any other change.
+"""
+import itertools
+import time
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+import tools.EHS_based_v2.holdem_argparser as holdem_argparser
+import tools.EHS_based_v2.holdem_functions as holdem_functions
+from tools.poker.evaluation import seven_card
+from tools.poker.evaluation.eval_card import EvaluationCard
+from tools.poker.evaluation.lookup import LookupTable
+
+# Upper bound on the number of rows evaluated at once, bounds memory use.
+chunk_rows = 1 << 18
+
+# Worst rank of each hand category, indexed like holdem_functions.hand_rankings
+# (royal flush is rank 1 and high card the largest ranks).
+_category_max_rank = np.array(
+    [
+        1,
+        LookupTable.MAX_STRAIGHT_FLUSH,
+        LookupTable.MAX_FOUR_OF_A_KIND,
+        LookupTable.MAX_FULL_HOUSE,
+        LookupTable.MAX_FLUSH,
+        LookupTable.MAX_STRAIGHT,
+        LookupTable.MAX_THREE_OF_A_KIND,
+        LookupTable.MAX_TWO_PAIR,
+        LookupTable.MAX_PAIR,
+        LookupTable.MAX_HIGH_CARD,
+    ]
+)
+
+
+def rank_seven(cards: np.ndarray) -> np.ndarray:
+    """Rank every row of an (n, 7) array of str_to_int52 cards."""
+    return seven_card.get_evaluator().evaluate_batch(cards)
+
+
+def _to_int52(card: holdem_functions.Card) -> int:
+    """Convert a holdem_functions.Card to its str_to_int52 id."""
+    return EvaluationCard.str_to_int52(str(card))
+
+
+def _card_masks(cards: np.ndarray) -> np.ndarray:
+    """One 52 bit mask per row of a card array."""
+    return (np.int64(1) << cards.astype(np.int64)).sum(axis=1)
+
+
+def _exhaustive_rows(
+    deck: np.ndarray, opponents: Optional[np.ndarray], n_missing: int
+) -> Iterator[Tuple[Optional[np.ndarray], np.ndarray]]:
+    """Yield (opponent hole cards, board completion) chunks of every board."""
+    boards = list(itertools.combinations(deck, n_missing))
+    boards = np.array(boards, dtype=np.int64).reshape(len(boards), n_missing)
+    if opponents is None:
+        for start in range(0, len(boards), chunk_rows):
+            yield None, boards[start : start + chunk_rows]
+        return
+    board_masks = _card_masks(boards)
+    opponent_masks = _card_masks(opponents)
+    board_chunk = min(len(boards), chunk_rows)
+    opponent_chunk = max(1, chunk_rows // board_chunk)
+    for b_start in range(0, len(boards), board_chunk):
+        b_stop = b_start + board_chunk
+        for o_start in range(0, len(opponents), opponent_chunk):
+            o_stop = o_start + opponent_chunk
+            valid = (
+                opponent_masks[o_start:o_stop, None] & board_masks[None, b_start:b_stop]
+            ) == 0
+            o, b = np.nonzero(valid)
+            yield opponents[o_start + o], boards[b_start + b]
+
+
+def _random_rows(
+    deck: np.ndarray,
+    opponents: Optional[np.ndarray],
+    n_missing: int,
+    num: int,
+    rng: np.random.Generator,
+) -> Iterator[Tuple[Optional[np.ndarray], np.ndarray]]:
+    """Yield chunks of `num` random boards (per opponent hand, if unknown)."""
+    if opponents is None:
+        opponents_per_chunk, n_chunks = 1, 1
+    else:
+        opponents_per_chunk = max(1, chunk_rows // num)
+        n_chunks = len(opponents)
+    position = np.zeros(52, dtype=np.int64)
+    position[deck] = np.arange(len(deck))
+    for start in range(0, n_chunks, opponents_per_chunk):
+        stop = min(n_chunks, start + opponents_per_chunk)
+        keys = rng.random(((stop - start) * num, len(deck)))
+        chunk_opponents = None
+        if opponents is not None:
+            chunk_opponents = np.repeat(opponents[start:stop], num, axis=0)
+            # Opponent cards can not be dealt to the board.
+            rows = np.arange(len(keys))
+            for column in range(2):
+                keys[rows, position[chunk_opponents[:, column]]] = 2.0
+        # The n_missing smallest keys are a uniform sample without replacement.
+        boards = deck[np.argpartition(keys, n_missing, axis=1)[:, :n_missing]]
+        yield chunk_opponents, boards
+
+
+def run_simulation(hole_cards, num, exact, given_board, deck, verbose):
+    """Batched replacement of `holdem_calc.run_simulation`."""
+    num_players = len(hole_cards)
+    board = [] if given_board is None else [_to_int52(card) for card in given_board]
+    n_missing = 5 - len(board)
+    deck = np.array([_to_int52(card) for card in deck], dtype=np.int64)
+    unknown_index = None
+    opponents = None
+    if (None, None) in hole_cards:
+        unknown_index = hole_cards.index((None, None))
+        opponents = np.array(list(itertools.combinations(deck, 2)), dtype=np.int64)
+    known = [
+        None if i == unknown_index else [_to_int52(card) for card in hole_card]
+        for i, hole_card in enumerate(hole_cards)
+    ]
+    # When a board is given, exact calculation is much faster than Monte Carlo
+    # simulation, so default to exact if a board is given
+    if exact or given_board is not None:
+        chunks = _exhaustive_rows(deck, opponents, n_missing)
+    else:
+        chunks = _random_rows(deck, opponents, n_missing, num, np.random.default_rng())
+    winner_list = np.zeros(num_players + 1, dtype=np.int64)
+    result_histograms = np.zeros(
+        (num_players, len(holdem_functions.hand_rankings)), dtype=np.int64
+    )
+    for chunk_opponents, boards in chunks:
+        n_rows = len(boards)
+        full_boards = np.hstack(
+            [np.broadcast_to(np.array(board, dtype=np.int64), (n_rows, len(board))), boards]
+        )
+        ranks = np.empty((num_players, n_rows), dtype=np.int64)
+        for i, hole_card in enumerate(known):
+            if hole_card is None:
+                hands = chunk_opponents
+            else:
+                hands = np.broadcast_to(np.array(hole_card, dtype=np.int64), (n_rows, 2))
+            ranks[i] = rank_seven(np.hstack([hands, full_boards]))
+        best = ranks.min(axis=0)
+        winners = ranks == best
+        tie = winners.sum(axis=0) > 1
+        winner_list[0] += tie.sum()
+        winner_list[1:] += (winners & ~tie).sum(axis=1)
+        if verbose:
+            categories = 9 - np.searchsorted(_category_max_rank, ranks)
+            for i in range(num_players):
+                result_histograms[i] += np.bincount(
+                    categories[i], minlength=len(holdem_functions.hand_rankings)
+                )
+    winner_list = winner_list.tolist()
+    if verbose:
+        holdem_functions.print_results(
+            hole_cards, winner_list, result_histograms.tolist()
+        )
+    return holdem_functions.find_winning_percentage(winner_list)
+
+
+def calculate(board, exact, num, input_file, hole_cards, verbose):
+    args = holdem_argparser.LibArgs(board, exact, num, input_file, hole_cards)
+    hole_cards, n, e, board, filename = holdem_argparser.parse_lib_args(args)
+    return run(hole_cards, n, e, board, filename, verbose)
+
+
+def run(hole_cards, num, exact, board, file_name, verbose):
+    if file_name:
+        input_file = open(file_name, 'r')
+        for line in input_file:
+            if line is not None and len(line.strip()) == 0:
+                continue
+            hole_cards, board = holdem_argparser.parse_file_args(line)
+            deck = holdem_functions.generate_deck(hole_cards, board)
+            run_simulation(hole_cards, num, exact, board, deck, verbose)
+            print ("-----------------------------------")
+        input_file.close()
+    else:
+        deck = holdem_functions.generate_deck(hole_cards, board)
+        return run_simulation(hole_cards, num, exact, board, deck, verbose)
+
+
+def main():
+    hole_cards, num, exact, board, file_name = holdem_argparser.parse_args()
+    run(hole_cards, num, exact, board, file_name, True)
+
+
+if __name__ == '__main__':
+    start = time.time()
+    main()
+    print ("\nTime elapsed(seconds): ", time.time() - start)
@@ -0,0 +1,378 @@
+"""Binary, memory mappable checkpoint and blueprint files.
+
+A ``.bp`` file holds the rows of the info sets of a checkpoint, sorted by
+key, as aligned NumPy arrays:
+
+* ``keys``, the keys as `key_to_bytes` strings (``S32``), in ascending
+  order so an info set is found by binary search.
+* ``masks``, the uint8 bitmask of the legal actions.
+* ``regret``, int32 regrets and ``strategy``, float32 strategy sums, with
+  one column per `Action` id.
+
+A blueprint, ``kind`` ``"blueprint"``, holds the average policy of every
+info set in ``strategy`` instead of strategy counts, and no regrets.
+
+The file starts with the magic ``BLUEPRNT``, the format version and the
+length of a JSON header, which holds the kind, the iteration, the parent of
+a delta, the discounts of a delta and the dtype, shape and offset of every
+array. Arrays start at 64 byte
+boundaries, so `BinaryCheckpoint.load` maps them with `np.memmap` without
+reading the file, in milliseconds whatever its size.
+
+Convert existing ``strategy_*.gz`` dumps with
+
+    python tools/blueprint/binary_format.py --input start
+"""
+import glob
+import json
+import os
+import re
+import struct
+import sys
+from typing import Any, Dict, List, Optional, Sequence
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(os.path.split(curPath)[0])[0]
+sys.path.append(rootPath)
+
+import click
+import joblib
+import numpy as np
+
+from tools.blueprint.info_set_table import InfoSetTable, regret_ceiling, regret_floor, scale_rows
+from tools.poker.actions import action_names, from_mask, n_actions, name_to_action, to_mask
+from tools.poker.info_set import bytes_to_key, key_bytes, key_to_bytes, key_to_str, str_to_key
+
+magic = b"BLUEPRNT"
+format_version = 1
+_prefix = struct.Struct("<8sII")
+_alignment = 64
+_dtypes = {
+    "keys": np.dtype(f"S{key_bytes}"),
+    "masks": np.dtype(np.uint8),
+    "regret": np.dtype(np.int32),
+    "strategy": np.dtype(np.float32),
+}
+_row_shapes = {"keys": (), "masks": (), "regret": (n_actions,), "strategy": (n_actions,)}
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _alignment) * _alignment
+
+
+class BinaryCheckpoint:
+    """Rows of the info sets of a checkpoint, sorted by key.
+
+    Parameters
+    ----------
+    keys : np.ndarray
+        (n,) ``S32`` keys in ascending order.
+    masks : np.ndarray
+        (n,) bitmasks of the legal actions.
+    regret : np.ndarray
+        (n, n_actions) regrets.
+    strategy : np.ndarray
+        (n, n_actions) strategy sums.
+    iteration : int, optional
+        Training iteration of the checkpoint.
+    parent : int, optional
+        Iteration of the snapshot a delta applies to, None for full bases.
+    kind : str
+        ``"checkpoint"``, or ``"blueprint"`` if `strategy` holds
+        probabilities.
+    discounts : list of float, optional
+        Logs of the discounts of a delta, applied in order to the rows of its
+        parent with `scale_rows` before its rows replace them.
+    """
+
+    def __init__(
+        self,
+        keys: np.ndarray,
+        masks: np.ndarray,
+        regret: np.ndarray,
+        strategy: np.ndarray,
+        iteration: Optional[int] = None,
+        parent: Optional[int] = None,
+        kind: str = "checkpoint",
+        discounts: Optional[List[float]] = None,
+    ):
+        if kind not in ("checkpoint", "blueprint"):
+            raise ValueError(f"Unknown kind of blueprint file: {kind}")
+        self.keys = keys
+        self.masks = masks
+        self.regret = regret
+        self.strategy = strategy
+        self.iteration = iteration
+        self.parent = parent
+        self.kind = kind
+        self.discounts = list(discounts or [])
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def from_rows(
+        cls,
+        keys: Sequence[int],
+        masks: np.ndarray,
+        regret: np.ndarray,
+        strategy: np.ndarray,
+        iteration: Optional[int] = None,
+        parent: Optional[int] = None,
+        discounts: Optional[List[float]] = None,
+    ) -> "BinaryCheckpoint":
+        """Sort rows given with integer keys."""
+        encoded = np.array([key_to_bytes(key) for key in keys], dtype=_dtypes["keys"])
+        order = np.argsort(encoded, kind="stable")
+        return cls(
+            encoded[order],
+            np.asarray(masks, dtype=np.uint8)[order],
+            np.asarray(regret, dtype=np.int32)[order],
+            np.asarray(strategy, dtype=np.float32)[order],
+            iteration,
+            parent,
+            discounts=discounts,
+        )
+
+    @classmethod
+    def from_table(
+        cls,
+        table: InfoSetTable,
+        rows: Optional[np.ndarray] = None,
+        iteration: Optional[int] = None,
+        parent: Optional[int] = None,
+        discounts: Optional[List[float]] = None,
+    ) -> "BinaryCheckpoint":
+        """Rows of `table`, all rows in use by default, with the pending
+        discounts applied."""
+        if rows is None:
+            keys, rows = table.used_rows()
+        else:
+            keys = table.keys_of(rows)
+        regret, strategy = table.settled(rows)
+        return cls.from_rows(keys, table.masks[rows], regret, strategy, iteration, parent, discounts)
+
+    @classmethod
+    def from_dict(cls, checkpoint: Dict[str, Any]) -> "BinaryCheckpoint":
+        """Convert a dict-of-dicts checkpoint."""
+        regret = checkpoint.get("regret", {})
+        strategy = checkpoint.get("strategy", {})
+        info_sets = list(regret) + [info_set for info_set in strategy if info_set not in regret]
+        masks = np.zeros(len(info_sets), dtype=np.uint8)
+        regret_rows = np.zeros((len(info_sets), n_actions), dtype=np.int64)
+        strategy_rows = np.zeros((len(info_sets), n_actions), dtype=np.float32)
+        for i, info_set in enumerate(info_sets):
+            values = [regret.get(info_set, {}), strategy.get(info_set, {})]
+            masks[i] = to_mask(name_to_action[action] for action in set(values[0]) | set(values[1]))
+            for action, value in values[0].items():
+                regret_rows[i, name_to_action[action]] = round(value)
+            for action, value in values[1].items():
+                strategy_rows[i, name_to_action[action]] = value
+        return cls.from_rows(
+            [str_to_key(info_set) for info_set in info_sets],
+            masks,
+            np.clip(regret_rows, regret_floor, regret_ceiling),
+            strategy_rows,
+            checkpoint.get("iteration"),
+            checkpoint.get("parent"),
+            checkpoint.get("discounts"),
+        )
+
+    def int_keys(self) -> List[int]:
+        """Keys of the rows as ints."""
+        return [bytes_to_key(key) for key in self.keys.tolist()]
+
+    def find(self, key: int) -> int:
+        """Row of `key`, or -1 if it has none."""
+        encoded = np.array(key_to_bytes(key), dtype=_dtypes["keys"])
+        row = int(np.searchsorted(self.keys, encoded))
+        if row < len(self.keys) and self.keys[row] == encoded:
+            return row
+        return -1
+
+    def between(self, low: Optional[bytes], high: Optional[bytes]) -> "BinaryCheckpoint":
+        """Rows whose keys are at least `low` and less than `high`, as views.
+
+        None leaves the range open on that side.
+        """
+        start = 0 if low is None else int(np.searchsorted(self.keys, low))
+        stop = len(self) if high is None else int(np.searchsorted(self.keys, high))
+        return BinaryCheckpoint(
+            self.keys[start:stop],
+            self.masks[start:stop],
+            self.regret[start:stop],
+            self.strategy[start:stop],
+            self.iteration,
+            self.parent,
+            self.kind,
+            self.discounts,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to the dict-of-dicts checkpoint format of `InfoSetTable.to_dict`."""
+        regret = self.regret.tolist()
+        strategy = self.strategy.tolist()
+        has_strategy = np.asarray(self.strategy).any(axis=1).tolist()
+        checkpoint: Dict[str, Any] = {"regret": {}, "strategy": {}}
+        for i, (key, mask) in enumerate(zip(self.int_keys(), self.masks.tolist())):
+            info_set = key_to_str(key)
+            ids = from_mask(mask)
+            checkpoint["regret"][info_set] = {action_names[a]: regret[i][a] for a in ids}
+            if has_strategy[i]:
+                checkpoint["strategy"][info_set] = {action_names[a]: strategy[i][a] for a in ids}
+        if self.iteration is not None:
+            checkpoint["iteration"] = self.iteration
+            checkpoint["parent"] = self.parent
+        if self.discounts:
+            checkpoint["discounts"] = self.discounts
+        return checkpoint
+
+    def load_into(self, table: InfoSetTable):
+        """Add the rows to `table`, replacing those of the same keys."""
+        table.load_arrays(self.int_keys(), self.masks, self.regret, self.strategy)
+
+    @staticmethod
+    def merge(checkpoints: Sequence["BinaryCheckpoint"]) -> "BinaryCheckpoint":
+        """Apply checkpoints in order, rows of later ones replacing earlier ones.
+
+        Rows are scaled by the discounts of the later checkpoints. The result
+        keeps the discounts of all of them, which apply to the parent of the
+        first one.
+        """
+        # np.unique keeps the first of equal keys, so the latest come first.
+        latest_first = list(reversed(checkpoints))
+        keys = np.concatenate([checkpoint.keys for checkpoint in latest_first])
+        keys, index = np.unique(keys, return_index=True)
+        masks, regret, strategy = [
+            np.concatenate([getattr(checkpoint, name) for checkpoint in latest_first])[index]
+            for name in ("masks", "regret", "strategy")
+        ]
+        # Position in `checkpoints` of the checkpoint every row comes from.
+        ends = np.cumsum([len(checkpoint) for checkpoint in latest_first])
+        source = len(checkpoints) - 1 - np.searchsorted(ends, index, side="right")
+        for position, checkpoint in enumerate(checkpoints):
+            rows = np.flatnonzero(source < position)
+            for log_discount in checkpoint.discounts:
+                regret[rows], strategy[rows] = scale_rows(
+                    regret[rows], strategy[rows], np.full(len(rows), log_discount)
+                )
+        discounts = [d for checkpoint in checkpoints for d in checkpoint.discounts]
+        return BinaryCheckpoint(keys, masks, regret, strategy, discounts=discounts)
+
+    def save(self, path: str):
+        """Write to `path`, under a temporary name first so readers never
+        see a partial file."""
+        concatenate([self], path, self.kind, self.iteration, self.parent, self.discounts)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "BinaryCheckpoint":
+        """Read a ``.bp`` file, memory mapping its arrays unless `mmap` is False."""
+        with open(path, "rb") as f:
+            file_magic, version, header_size = _prefix.unpack(f.read(_prefix.size))
+            if file_magic != magic:
+                raise ValueError(f"{path} is not a blueprint file.")
+            if version != format_version:
+                raise ValueError(
+                    f"{path} has format version {version}, only {format_version} can be read."
+                )
+            header = json.loads(f.read(header_size).decode("utf-8"))
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+            if mmap and np.prod(shape) > 0:
+                arrays[name] = np.memmap(path, dtype, "r", spec["offset"], shape)
+            else:
+                count = int(np.prod(shape))
+                arrays[name] = np.fromfile(
+                    path, dtype, count=count, offset=spec["offset"]
+                ).reshape(shape)
+        return cls(
+            iteration=header["iteration"],
+            parent=header["parent"],
+            kind=header.get("kind", "checkpoint"),
+            discounts=header.get("discounts"),
+            **arrays,
+        )
+
+
+def concatenate(
+    parts: Sequence[BinaryCheckpoint],
+    path: str,
+    kind: str = "checkpoint",
+    iteration: Optional[int] = None,
+    parent: Optional[int] = None,
+    discounts: Sequence[float] = (),
+):
+    """Write `parts`, each after the keys of the previous one, as one file.
+
+    The parts are written one after the other, so memory mapped parts are
+    read one at a time. The file is written under a temporary name first so
+    readers never see a partial file.
+    """
+    for previous, part in zip(parts, parts[1:]):
+        if len(previous) and len(part) and previous.keys[-1] >= part.keys[0]:
+            raise ValueError("The keys of the parts are not in order.")
+    header = {
+        "kind": kind,
+        "iteration": iteration,
+        "parent": parent,
+        "discounts": list(discounts),
+        "arrays": {},
+    }
+    # The offsets depend on the length of the header, which depends on the
+    # offsets, so lay the arrays out after a generous header.
+    offset = _aligned(_prefix.size + 512 + 64 * len(_dtypes) + 32 * len(header["discounts"]))
+    for name, dtype in _dtypes.items():
+        shape = [sum(len(part) for part in parts)] + list(_row_shapes[name])
+        header["arrays"][name] = {"dtype": dtype.str, "shape": shape, "offset": offset}
+        offset = _aligned(offset + int(np.prod(shape)) * dtype.itemsize)
+    encoded = json.dumps(header).encode("utf-8")
+    if _prefix.size + len(encoded) > header["arrays"]["keys"]["offset"]:
+        raise ValueError("The header does not fit before the arrays.")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_prefix.pack(magic, format_version, len(encoded)))
+        f.write(encoded)
+        for name, dtype in _dtypes.items():
+            f.seek(header["arrays"][name]["offset"])
+            for part in parts:
+                np.ascontiguousarray(getattr(part, name), dtype).tofile(f)
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path: str, mmap: bool = True) -> BinaryCheckpoint:
+    """Read a ``.bp`` file or a joblib dumped dict-of-dicts ``.gz`` file."""
+    if path.endswith(".gz"):
+        checkpoint = BinaryCheckpoint.from_dict(joblib.load(path))
+        if checkpoint.iteration is None:
+            iterations = re.findall(r"strategy_(\d+)", os.path.basename(path))
+            checkpoint.iteration = int(iterations[0]) if iterations else None
+        return checkpoint
+    return BinaryCheckpoint.load(path, mmap)
+
+
+@click.command()
+@click.option(
+    "--input",
+    "inputs",
+    multiple=True,
+    required=True,
+    help="strategy_*.gz files, or directories of them.",
+)
+def cli(inputs: Sequence[str]):
+    """Convert joblib dumps to ``.bp`` files next to them."""
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            paths += sorted(glob.glob(os.path.join(path, "strategy*.gz")))
+        else:
+            paths.append(path)
+    for path in paths:
+        bp_path = path[: -len(".gz")] + ".bp"
+        read_checkpoint(path).save(bp_path)
+        click.echo(bp_path)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,329 @@
+"""Background writing, retention and loading of blueprint checkpoints.
+
+A run writes a series of snapshots into one directory:
+
+* full bases, ``strategy_{t}.bp``, hold every info set of the table as a
+  `BinaryCheckpoint`.
+* deltas, ``strategy_{t}.delta.bp``, hold only the info sets touched since
+  the previous snapshot, whose iteration they store as their parent, and
+  the discounts to apply to the other info sets of the parent.
+
+Snapshots of earlier runs, joblib dumped dict-of-dicts ``.gz`` files, are
+still read. At the end of a run `write_blueprint` writes the average policy
+of the table, the blueprint itself.
+
+`load_checkpoint` rebuilds an iteration from the latest full base at or
+before it and the deltas after that base. To bound the disk used by long
+runs, `retained_iterations` keeps the last snapshots and thins older ones
+geometrically, and `compact` folds the dropped snapshots into the next
+kept one, so every kept iteration can still be rebuilt. Compact a
+directory by hand with
+
+    python tools/blueprint/checkpoint.py --directory start --keep_last 10 --interval 1000
+
+Writing a table takes time proportional to the table. `AsyncCheckpointer`
+does it in a child process while training goes on.
+When processes are forked the child inherits a copy-on-write view of the
+table as it was at the call, so plain tables need no copy. A
+`SharedInfoSetTable` is not copy-on-write, so it is copied first. One
+write is in flight at a time: `save` first waits for the previous write
+to finish, so a slow disk slows training down instead of piling up
+checkpoints in memory.
+"""
+import math
+import multiprocessing as mp
+import os
+import re
+import sys
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(os.path.split(curPath)[0])[0]
+sys.path.append(rootPath)
+
+import click
+import numpy as np
+
+from tools.blueprint.binary_format import BinaryCheckpoint, read_checkpoint
+from tools.blueprint.info_set_table import InfoSetTable, average_policy
+
+_file_name = re.compile(r"strategy_(\d+)(\.delta)?\.(gz|bp)$")
+
+
+def checkpoint_path(directory: str, iteration: int, full: bool) -> str:
+    """Path of the full base or delta snapshot of `iteration`."""
+    suffix = "" if full else ".delta"
+    return os.path.join(directory, f"strategy_{iteration}{suffix}.bp")
+
+
+def list_checkpoints(directory: str) -> List[Tuple[int, bool, str]]:
+    """Iteration, whether it is a full base, and path of every snapshot, in order."""
+    snapshots: Dict[int, Tuple[int, bool, str]] = {}
+    for name in os.listdir(directory):
+        match = _file_name.match(name)
+        if match is None:
+            continue
+        iteration, full = int(match.group(1)), match.group(2) is None
+        # A full base wins over a delta of the same iteration left by an
+        # interrupted compaction, and a binary file over a ``.gz`` converted
+        # to it.
+        previous = snapshots.get(iteration)
+        if (
+            previous is None
+            or full > previous[1]
+            or (full == previous[1] and match.group(3) == "bp")
+        ):
+            snapshots[iteration] = (iteration, full, os.path.join(directory, name))
+    return [snapshots[iteration] for iteration in sorted(snapshots)]
+
+
+def _remove(path: str, keep: str = ""):
+    """Delete a snapshot and the ``.gz`` it may have been converted from,
+    except the file `keep`."""
+    for twin in {path, re.sub(r"\.bp$", ".gz", path)} - {keep}:
+        if os.path.exists(twin):
+            os.remove(twin)
+
+
+def write_checkpoint(
+    table: InfoSetTable,
+    path: str,
+    rows: Optional[np.ndarray] = None,
+    iteration: Optional[int] = None,
+    parent: Optional[int] = None,
+    discounts: Optional[List[float]] = None,
+):
+    """Write `rows` of `table`, all rows by default, to `path`.
+
+    `iteration`, the `parent` snapshot of a delta and its `discounts` are
+    stored beside the regrets and strategies.
+    """
+    BinaryCheckpoint.from_table(table, rows, iteration, parent, discounts).save(path)
+
+
+def write_blueprint(table: InfoSetTable, path: str, iteration: Optional[int] = None):
+    """Write the average policy of every info set of `table` to `path`."""
+    blueprint = BinaryCheckpoint.from_table(table, iteration=iteration)
+    blueprint.strategy = average_policy(blueprint.strategy, blueprint.masks)
+    blueprint.regret = np.zeros_like(blueprint.regret)
+    blueprint.kind = "blueprint"
+    blueprint.save(path)
+
+
+def load_checkpoint(directory: str, iteration: Optional[int] = None) -> BinaryCheckpoint:
+    """Rebuild the checkpoint of `iteration`, the latest one by default."""
+    snapshots = list_checkpoints(directory)
+    iterations = [snapshot[0] for snapshot in snapshots]
+    if not snapshots:
+        raise ValueError(f"No checkpoints could be found at: {directory}")
+    if iteration is None:
+        iteration = iterations[-1]
+    if iteration not in iterations:
+        raise ValueError(f"Iteration {iteration} is not retained in {directory}.")
+    end = iterations.index(iteration) + 1
+    start = end - 1
+    while not snapshots[start][1]:
+        if start == 0:
+            raise ValueError(f"Iteration {iteration} has no full base in {directory}.")
+        start -= 1
+    chain = [read_checkpoint(path) for _, _, path in snapshots[start:end]]
+    for previous, (_, _, path), checkpoint in zip(
+        iterations[start:end], snapshots[start + 1 : end], chain[1:]
+    ):
+        if checkpoint.parent not in (None, previous):
+            raise ValueError(f"{path} is not a delta of iteration {previous}.")
+    if len(chain) == 1:
+        checkpoint = chain[0]
+    else:
+        checkpoint = BinaryCheckpoint.merge(chain)
+    checkpoint.iteration = iteration
+    checkpoint.parent = None
+    checkpoint.discounts = []
+    return checkpoint
+
+
+def retained_iterations(iterations: Sequence[int], keep_last: int, interval: int) -> Set[int]:
+    """Iterations kept by the retention policy.
+
+    Snapshots less than `keep_last` intervals older than the latest one are
+    kept. Beyond that the spacing doubles every time the age does: an
+    iteration whose age is between ``keep_last * 2**(j - 1)`` and
+    ``keep_last * 2**j`` intervals is kept if it is a multiple of ``2**j``
+    intervals. An iteration dropped once is never kept again. A `keep_last`
+    of 0 keeps every iteration.
+    """
+    if not iterations or keep_last <= 0:
+        return set(iterations)
+    latest = max(iterations)
+    kept = set()
+    for iteration in iterations:
+        age = (latest - iteration) / interval
+        if age < keep_last:
+            kept.add(iteration)
+            continue
+        spacing = 2 ** (int(math.log2(age / keep_last)) + 1)
+        if (iteration // interval) % spacing == 0:
+            kept.add(iteration)
+    return kept
+
+
+def compact(directory: str, keep: Iterable[int]):
+    """Delete the snapshots not in `keep`, folding them into the next kept one.
+
+    A kept delta after dropped snapshots becomes the delta of the previous
+    kept iteration, or a full base if a full base was dropped before it.
+    """
+    keep = set(keep)
+    dropped: List[Tuple[int, bool, str]] = []
+    previous = None
+    for snapshot in list_checkpoints(directory):
+        iteration, full, path = snapshot
+        if iteration not in keep:
+            dropped.append(snapshot)
+            continue
+        if dropped and not full:
+            chain = dropped + [snapshot]
+            bases = [i for i, (_, is_full, _) in enumerate(chain) if is_full]
+            if bases:
+                chain = chain[bases[-1] :]
+            elif previous is None:
+                raise ValueError(f"Iteration {iteration} has no full base in {directory}.")
+            checkpoint = BinaryCheckpoint.merge(
+                [read_checkpoint(chain_path) for _, _, chain_path in chain]
+            )
+            checkpoint.iteration = iteration
+            checkpoint.parent = None if bases else previous
+            if bases:
+                checkpoint.discounts = []
+            new_path = checkpoint_path(directory, iteration, bool(bases))
+            checkpoint.save(new_path)
+            _remove(path, keep=new_path)
+        for _, _, dropped_path in dropped:
+            _remove(dropped_path)
+        dropped = []
+        previous = iteration
+    for _, _, dropped_path in dropped:
+        _remove(dropped_path)
+
+
+def _write_and_compact(
+    table: InfoSetTable,
+    path: str,
+    rows: Optional[np.ndarray],
+    iteration: int,
+    parent: Optional[int],
+    discounts: List[float],
+    keep_last: int,
+    interval: int,
+):
+    """Body of the checkpoint process."""
+    write_checkpoint(table, path, rows, iteration, parent, discounts)
+    if keep_last:
+        directory = os.path.dirname(path)
+        iterations = [snapshot[0] for snapshot in list_checkpoints(directory)]
+        keep = retained_iterations(iterations, keep_last, interval)
+        if len(keep) < len(iterations):
+            compact(directory, keep)
+
+
+class AsyncCheckpointer:
+    """Writes snapshots of a table in a background process, one at a time.
+
+    Parameters
+    ----------
+    directory : str
+        Where the snapshots are written.
+    full_interval : int
+        Every `full_interval`-th snapshot is a full base, the others are
+        deltas. 1 writes only full bases.
+    keep_last : int
+        Number of snapshot intervals kept in full, older snapshots are
+        thinned geometrically. 0 keeps every snapshot.
+    interval : int
+        Iterations between two snapshots.
+    """
+
+    def __init__(
+        self, directory: str, full_interval: int = 1, keep_last: int = 0, interval: int = 1
+    ):
+        if full_interval < 1 or interval < 1 or keep_last < 0:
+            raise ValueError("full_interval and interval must be positive, keep_last not negative.")
+        self._directory = directory
+        self._full_interval = full_interval
+        self._keep_last = keep_last
+        self._interval = interval
+        self._n_saved = 0
+        self._parent: Optional[int] = None
+        self._process: Optional[mp.Process] = None
+        self._path: Optional[str] = None
+
+    def save(self, table: InfoSetTable, iteration: int, copy: bool = False):
+        """Start writing the snapshot of `iteration`, once the previous write is done.
+
+        Set `copy` if other processes keep changing `table`, the rows
+        written are then copied before returning.
+        """
+        self.wait()
+        full = self._n_saved % self._full_interval == 0
+        touched, log_discount = table.take_touched()
+        rows = None if full else touched
+        if copy:
+            table = table.snapshot(rows)
+            rows = None
+        parent = None if full else self._parent
+        discounts = [log_discount] if parent is not None and log_discount else []
+        self._path = checkpoint_path(self._directory, iteration, full)
+        self._process = mp.Process(
+            target=_write_and_compact,
+            args=(
+                table,
+                self._path,
+                rows,
+                iteration,
+                parent,
+                discounts,
+                self._keep_last,
+                self._interval,
+            ),
+            daemon=True,
+        )
+        self._process.start()
+        self._parent = iteration
+        self._n_saved += 1
+
+    def wait(self):
+        """Block until the write in flight, if any, is done."""
+        if self._process is None:
+            return
+        self._process.join()
+        exitcode = self._process.exitcode
+        self._process = None
+        if exitcode != 0:
+            raise RuntimeError(f"Writing checkpoint {self._path} failed, exit code {exitcode}.")
+
+    def close(self):
+        """Wait for the last write."""
+        self.wait()
+
+
+@click.command()
+@click.option("--directory", default="start", help="where the snapshots are.")
+@click.option("--keep_last", default=10, help="snapshot intervals kept in full.")
+@click.option("--interval", default=1, help="iterations between two snapshots.")
+@click.option(
+    "--iteration",
+    "iterations",
+    multiple=True,
+    type=int,
+    help="iterations to keep, instead of the retention policy.",
+)
+def cli(directory: str, keep_last: int, interval: int, iterations: Sequence[int]):
+    """Merge the snapshots of a run down to the retained iterations."""
+    all_iterations = [snapshot[0] for snapshot in list_checkpoints(directory)]
+    keep = set(iterations) or retained_iterations(all_iterations, keep_last, interval)
+    compact(directory, keep)
+    click.echo(f"kept {len(keep & set(all_iterations))} of {len(all_iterations)} snapshots.")
+
+
+if __name__ == "__main__":
+    cli()
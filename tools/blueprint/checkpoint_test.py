@@ -0,0 +1,97 @@
+"""Retention and compaction of checkpoint directories.
+
+A run that keeps only the last snapshots must rebuild every iteration it
+keeps exactly as a run with the same updates that keeps all of them.
+"""
+import random
+from pathlib import Path
+
+from tools.blueprint import checkpoint
+from tools.blueprint.info_set_table import InfoSetTable
+from tools.poker.info_set import append_action, new_key
+
+n_iterations = 40
+full_interval = 5
+keep_last = 4
+
+
+def run(directory: Path, keep_last: int) -> dict:
+    """Train a table on seeded random updates, checkpointing every iteration,
+    and return its dict of every iteration."""
+    directory.mkdir()
+    rng = random.Random(0)
+    table = InfoSetTable(4)
+    saver = checkpoint.AsyncCheckpointer(
+        str(directory), full_interval=full_interval, keep_last=keep_last, interval=1
+    )
+    expected = {}
+    for t in range(1, n_iterations + 1):
+        for _ in range(10):
+            key = new_key(rng.randrange(50))
+            if rng.random() < 0.5:
+                key = append_action(key, "call")
+            row = table.row(key, 7)
+            table.add_regret(row, [rng.randrange(3)], [rng.randrange(-50, 50)])
+            table.add_strategy(row, rng.randrange(3), 1)
+        if t % 7 == 0:
+            table.discount(0.5)
+        saver.save(table, t)
+        expected[t] = table.to_dict()
+    saver.close()
+    return expected
+
+
+def snapshots(directory) -> dict:
+    return {t: full for t, full, _ in checkpoint.list_checkpoints(str(directory))}
+
+
+def loaded(directory, t: int) -> dict:
+    return checkpoint.load_checkpoint(str(directory), t).to_dict()
+
+
+def test_compacted_run_matches_uncompacted_run(tmp_path):
+    expected = run(tmp_path / "all", keep_last=0)
+    assert run(tmp_path / "kept", keep_last=keep_last) == expected
+    every = snapshots(tmp_path / "all")
+    kept = snapshots(tmp_path / "kept")
+    assert sorted(every) == list(range(1, n_iterations + 1))
+    assert set(kept) < set(every)
+    # Some kept deltas have to be rebuilt across dropped snapshots.
+    assert any(not full and t - 1 not in kept for t, full in kept.items())
+    for t in kept:
+        from_kept = loaded(tmp_path / "kept", t)
+        assert from_kept == loaded(tmp_path / "all", t), t
+        assert {name: from_kept[name] for name in expected[t]} == expected[t], t
+
+
+def test_compact_keeps_the_retained_iterations(tmp_path):
+    run(tmp_path / "all", keep_last=0)
+    run(tmp_path / "kept", keep_last=keep_last)
+    before = {t: loaded(tmp_path / "all", t) for t in snapshots(tmp_path / "all")}
+    keep = checkpoint.retained_iterations(list(before), keep_last, 1)
+    checkpoint.compact(str(tmp_path / "all"), keep)
+    assert set(snapshots(tmp_path / "all")) == keep
+    for t in keep:
+        assert loaded(tmp_path / "all", t) == before[t], t
+
+
+def test_delta_after_discount_holds_touched_rows(tmp_path):
+    rng = random.Random(1)
+    table = InfoSetTable(4)
+    keys = [new_key(bucket) for bucket in range(50)]
+    for key in keys:
+        row = table.row(key, 7)
+        table.add_regret(row, [0, 1], [rng.randrange(-500, 500), rng.randrange(-500, 500)])
+        table.add_strategy(row, 2, 3)
+    saver = checkpoint.AsyncCheckpointer(str(tmp_path), full_interval=10)
+    saver.save(table, 1)
+    table.discount(0.3)
+    table.discount(0.7)
+    table.add_regret(table.row(keys[0], 7), [2], [9])
+    saver.save(table, 2)
+    saver.close()
+    delta = checkpoint.read_checkpoint(checkpoint.checkpoint_path(str(tmp_path), 2, False))
+    assert len(delta) == 1 and len(delta.discounts) == 1
+    from_delta = loaded(tmp_path, 2)
+    expected = table.to_dict()
+    assert {name: from_delta[name] for name in expected} == expected
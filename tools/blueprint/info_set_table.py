@@ -0,0 +1,514 @@
+"""Array-backed regret and strategy tables.
+
+Every info set key is given a row of preallocated NumPy arrays with one
+column per `Action` id: int32 regrets, float32 strategy counts and the
+bitmask of the legal actions. As in Pluribus regrets are stored as 4-byte
+integers with a floor of -310,000,000, which makes it easy to unprune
+actions that later improve, and they are clipped at the top so they can
+not overflow.
+
+The keys are not Python objects either. Every row holds its key as
+`key_to_bytes` in one bytearray, and an open addressing hash table with
+linear probing maps the hash of those bytes to rows. Its int32 slots hold
+the row plus one, 0 marks a free slot, and there are at least twice as
+many slots as rows. Bytes are hashed with a seed of their process, so the
+slots are rebuilt when a table is unpickled.
+
+The current strategy of every row, regret matching on its regrets, is kept
+beside them and only recomputed when the regrets of the row have changed,
+so repeat visits and opponent nodes read it without allocating. Rows are
+also flagged when they change, so checkpoints can hold only the rows
+touched since the previous one.
+
+Linear CFR discounts are applied lazily. `discount` only starts a new
+epoch and adds the log of its factor to a running sum, so it costs the
+same whatever the size of the table. Every row remembers the epoch it was
+last settled in and is scaled by the discounts since then the next time
+`row` returns it, or when the whole table is exported. Working in logs
+keeps the scale from underflowing, and once the epochs run out every row
+is settled and they start over. Regret matching does not change when all
+regrets of a row are scaled, so the cached strategies stay valid.
+
+A discount does not count as a change of the rows for checkpoints.
+`take_touched` settles every row and returns the log of the discounts since
+its previous call beside the changed rows, and a delta checkpoint stores it
+to scale the rows of its parent with `scale_rows`, rounded the same way.
+
+The strategy counts of a row are the running average of the strategies
+played at it, weighted as the trainer chooses. `average_policy` turns
+them into probabilities.
+
+Tables convert to and from the ``{"regret": {info_set: {action: value}},
+"strategy": ...}`` checkpoints of earlier runs, and load the arrays of the
+binary checkpoints of `tools.blueprint.binary_format` with `load_arrays`.
+"""
+import math
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tools.poker.actions import action_names, from_mask, n_actions, name_to_action, to_mask
+from tools.poker.info_set import bytes_to_key, key_bytes, key_to_bytes, key_to_str, str_to_key
+
+regret_floor: int = -310_000_000
+regret_ceiling: int = np.iinfo(np.int32).max
+# Discounts kept before every row is settled and the epochs start over.
+_max_epochs: int = 1 << 12
+
+# _mask_bits[mask, i] is 1 if action id i is set in the bitmask, _uniform is
+# the uniform strategy over the actions of the mask.
+_mask_bits = ((np.arange(1 << n_actions)[:, None] >> np.arange(n_actions)) & 1).astype(
+    np.float32
+)
+_uniform = _mask_bits / np.maximum(_mask_bits.sum(axis=1, keepdims=True), 1)
+
+
+def regret_matching(regret: np.ndarray, masks: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Current strategy of rows of regrets, written to `out`.
+
+    Legal actions get probabilities proportional to their positive regret,
+    or a uniform probability if none is positive.
+
+    Parameters
+    ----------
+    regret : np.ndarray
+        (n, n_actions) regrets.
+    masks : np.ndarray
+        (n,) bitmasks of the legal actions.
+    out : np.ndarray
+        (n, n_actions) float array the strategies are written to.
+
+    Returns
+    -------
+    out : np.ndarray
+    """
+    np.maximum(regret, 0, out=out)
+    out *= _mask_bits[masks]
+    total = out.sum(axis=1, keepdims=True)
+    no_regret = total[:, 0] == 0
+    out[no_regret] = _uniform[masks[no_regret]]
+    total[no_regret] = 1
+    out /= total
+    return out
+
+
+def scale_rows(
+    regret: np.ndarray, strategy: np.ndarray, log_factor: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Regrets and strategy counts of rows scaled by ``exp(log_factor)``.
+
+    The regrets are rounded, so scaling rows in several steps is not the
+    same as scaling them once by the product of the factors.
+
+    Parameters
+    ----------
+    regret : np.ndarray
+        (n, n_actions) regrets.
+    strategy : np.ndarray
+        (n, n_actions) strategy counts.
+    log_factor : np.ndarray
+        (n,) log of the factor of every row.
+
+    Returns
+    -------
+    regret, strategy : np.ndarray
+        int32 regrets and float32 strategy counts.
+    """
+    factor = np.exp(log_factor)[:, None]
+    return (
+        np.rint(regret * factor).astype(np.int32),
+        strategy * factor.astype(np.float32),
+    )
+
+
+def average_policy(strategy: np.ndarray, masks: np.ndarray) -> np.ndarray:
+    """Average strategy of rows of strategy counts.
+
+    Legal actions get probabilities proportional to their counts, or a
+    uniform probability if the row has no counts.
+
+    Parameters
+    ----------
+    strategy : np.ndarray
+        (n, n_actions) strategy counts.
+    masks : np.ndarray
+        (n,) bitmasks of the legal actions.
+
+    Returns
+    -------
+    policy : np.ndarray
+        (n, n_actions) float32 probabilities.
+    """
+    # The counts are never negative, so this is regret matching on them.
+    return regret_matching(
+        strategy, np.asarray(masks), np.empty((len(masks), n_actions), np.float32)
+    )
+
+
+class InfoSetTable:
+    """Regret and strategy rows of the info sets, indexed by info set key.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of rows allocated up front, the arrays double in size when
+        they are full.
+    """
+
+    def __init__(self, capacity: int = 1 << 16):
+        self._n_rows = 0
+        self._keys = bytearray(capacity * key_bytes)
+        self.regret = np.zeros((capacity, n_actions), dtype=np.int32)
+        self.strategy = np.zeros((capacity, n_actions), dtype=np.float32)
+        self.masks = np.zeros(capacity, dtype=np.uint8)
+        self.sigma = np.zeros((capacity, n_actions), dtype=np.float32)
+        self._stale = np.zeros(capacity, dtype=np.bool_)
+        self._touched = np.zeros(capacity, dtype=np.bool_)
+        self._epoch = np.zeros(capacity, dtype=np.uint16)
+        # Current epoch, and the log of the product of the discounts before
+        # every epoch.
+        self._now = np.zeros(1, dtype=np.int64)
+        self._log_scale = np.zeros(_max_epochs, dtype=np.float64)
+        # Epoch of the previous `take_touched`.
+        self._checkpoint_epoch = np.zeros(1, dtype=np.int64)
+        self._views()
+        self._index()
+
+    def _views(self):
+        """Memoryviews of the epochs, single items are read much faster from
+        them than from arrays."""
+        self._epoch_view = memoryview(self._epoch)
+        self._now_view = memoryview(self._now)
+
+    def _index(self):
+        """Build the slots of the index for the capacity, and insert the rows."""
+        # (rows, key_bytes) array over the keys, for whole table reads.
+        self._key_bytes = np.frombuffer(self._keys, dtype=np.uint8).reshape(-1, key_bytes)
+        n_slots = 1 << (2 * self.capacity - 1).bit_length()
+        self._slots = np.zeros(n_slots, dtype=np.int32)
+        self._slot_mask = n_slots - 1
+        self._slots_view = slots = memoryview(self._slots)
+        keys = bytes(self._keys[: len(self) * key_bytes])
+        for row in range(len(self)):
+            slot = hash(keys[row * key_bytes : (row + 1) * key_bytes]) & self._slot_mask
+            while slots[slot]:
+                slot = (slot + 1) & self._slot_mask
+            slots[slot] = row + 1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_epoch_view", "_now_view", "_key_bytes", "_slots", "_slots_view"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views()
+        self._index()
+
+    def __len__(self) -> int:
+        return self._n_rows
+
+    def __contains__(self, key: int) -> bool:
+        return self.find(key) >= 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.masks)
+
+    @property
+    def keys(self) -> List[int]:
+        return self.used_rows()[0]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the arrays of the rows in use and by the index."""
+        n_rows = len(self)
+        return self._slots.nbytes + n_rows * (
+            key_bytes
+            + self.regret.itemsize * n_actions
+            + self.strategy.itemsize * n_actions
+            + self.masks.itemsize
+            + self.sigma.itemsize * n_actions
+            + self._stale.itemsize
+            + self._touched.itemsize
+            + self._epoch.itemsize
+        )
+
+    def find(self, key: int) -> int:
+        """Return the row of `key`, or -1 if it has no row."""
+        encoded = key_to_bytes(key)
+        keys, slots = self._keys, self._slots_view
+        slot = hash(encoded) & self._slot_mask
+        while slots[slot]:
+            row = slots[slot] - 1
+            if keys.startswith(encoded, row * key_bytes):
+                return row
+            slot = (slot + 1) & self._slot_mask
+        return -1
+
+    def row(self, key: int, mask: int) -> int:
+        """Return the row of `key`, adding a zero row with legal actions `mask` if new.
+
+        Discounts since the row was last returned are applied to it first.
+        """
+        encoded = key_to_bytes(key)
+        keys, slots = self._keys, self._slots_view
+        slot = hash(encoded) & self._slot_mask
+        while slots[slot]:
+            row = slots[slot] - 1
+            # Compares in place, without slicing the bytearray.
+            if keys.startswith(encoded, row * key_bytes):
+                if self._epoch_view[row] != self._now_view[0]:
+                    self._settle(row)
+                return row
+            slot = (slot + 1) & self._slot_mask
+        row = self._n_rows
+        if row == self.capacity:
+            self._grow()
+            # The slots were rebuilt, probe for a free one again.
+            keys, slots = self._keys, self._slots_view
+            slot = hash(encoded) & self._slot_mask
+            while slots[slot]:
+                slot = (slot + 1) & self._slot_mask
+        self._n_rows += 1
+        keys[row * key_bytes : (row + 1) * key_bytes] = encoded
+        slots[slot] = row + 1
+        self.masks[row] = mask
+        self.sigma[row] = _uniform[mask]
+        self._touched[row] = True
+        self._epoch[row] = self._now[0]
+        return row
+
+    def _grow(self):
+        """Double the capacity of the arrays, and rebuild the index."""
+        capacity = 2 * self.capacity
+        self._keys = self._keys + bytes(len(self._keys))
+        for name in ("regret", "strategy", "masks", "sigma", "_stale", "_touched", "_epoch"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[: len(old)] = old
+            setattr(self, name, new)
+        self._views()
+        self._index()
+
+    def add_regret(self, row: int, action_ids: Sequence[int], deltas: Sequence[float]):
+        """Add `deltas` to the regrets of `action_ids`, keeping them in range."""
+        regret = self.regret[row, action_ids] + np.rint(deltas)
+        self.regret[row, action_ids] = np.clip(regret, regret_floor, regret_ceiling)
+        self._stale[row] = True
+        self._touched[row] = True
+
+    def add_strategy(self, row: int, action_id: int, count: float = 1):
+        """Add `count` to the strategy count of `action_id`."""
+        self.strategy[row, action_id] += count
+        self._touched[row] = True
+
+    def take_touched(self) -> Tuple[np.ndarray, float]:
+        """Rows changed since the previous call, clearing their flags, and the
+        log of the product of the discounts since then.
+
+        Every row is settled. The rows left out equal those of the previous
+        call scaled by the discounts with `scale_rows`.
+        """
+        now = int(self._now[0])
+        log_discount = float(self._log_scale[now] - self._log_scale[self._checkpoint_epoch[0]])
+        self._settle_all(touch=False)
+        rows = np.flatnonzero(self._touched)
+        self._touched[rows] = False
+        self._checkpoint_epoch[0] = now
+        return rows, log_discount
+
+    def current_strategy(self, row: int) -> np.ndarray:
+        """Regret matching strategy of `row`, indexed by action id.
+
+        The returned row is the cache itself, it must not be modified and
+        changes when the regrets of the row do.
+        """
+        sigma = self.sigma[row]
+        if self._stale[row]:
+            # regret_matching on a single row, without the temporaries of
+            # the batch version.
+            mask = self.masks[row]
+            np.maximum(self.regret[row], 0, out=sigma)
+            sigma *= _mask_bits[mask]
+            total = sigma.sum()
+            if total > 0:
+                sigma /= total
+            else:
+                sigma[:] = _uniform[mask]
+            self._stale[row] = False
+        return sigma
+
+    def refresh(self):
+        """Recompute the strategy of every stale row at once."""
+        rows = np.flatnonzero(self._stale)
+        if len(rows):
+            self.sigma[rows] = regret_matching(
+                self.regret[rows], self.masks[rows], np.empty((len(rows), n_actions), np.float32)
+            )
+            self._stale[rows] = False
+
+    def discount(self, factor: float):
+        """Multiply every regret and strategy count by `factor`.
+
+        The rows are scaled lazily, rows returned by `row` before the call
+        must be looked up again before they are updated.
+        """
+        if factor <= 0:
+            raise ValueError(f"Discount factor {factor} is not positive.")
+        now = int(self._now[0])
+        if now + 1 == len(self._log_scale):
+            # Every row is touched, the next delta holds them all.
+            self.settle()
+            self._epoch[:] = 0
+            self._log_scale[0] = 0
+            self._checkpoint_epoch[0] = 0
+            now = 0
+        self._log_scale[now + 1] = self._log_scale[now] + math.log(factor)
+        self._now[0] = now + 1
+
+    def _settle(self, row: int):
+        """Apply the discounts since `row` was last settled."""
+        now = self._now[0]
+        factor = math.exp(self._log_scale[now] - self._log_scale[self._epoch[row]])
+        self.regret[row] = np.rint(self.regret[row] * factor)
+        self.strategy[row] *= factor
+        self._epoch[row] = now
+        self._stale[row] = True
+        self._touched[row] = True
+
+    def _settle_rows(self, rows: np.ndarray, touch: bool = True):
+        """Apply the pending discounts to `rows`, flagging them as changed if `touch`."""
+        now = self._now[0]
+        rows = rows[self._epoch[rows] != now]
+        if len(rows):
+            self.regret[rows], self.strategy[rows] = self.settled(rows)
+            self._epoch[rows] = now
+            self._stale[rows] = True
+            if touch:
+                self._touched[rows] = True
+
+    def _settle_all(self, touch: bool):
+        self._settle_rows(np.arange(len(self)), touch)
+
+    def settle(self):
+        """Apply the pending discounts to every row, before reading the arrays directly."""
+        self._settle_all(touch=True)
+
+    def settled(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Regrets and strategy counts of `rows` with the pending discounts
+        applied, without changing the table."""
+        now = self._now[0]
+        return scale_rows(
+            self.regret[rows],
+            self.strategy[rows],
+            self._log_scale[now] - self._log_scale[self._epoch[rows]],
+        )
+
+    def used_rows(self) -> Tuple[List[int], np.ndarray]:
+        """Keys of the info sets and their rows."""
+        rows = np.arange(len(self))
+        return self.keys_of(rows), rows
+
+    def keys_of(self, rows: np.ndarray) -> List[int]:
+        """Keys of the info sets of `rows`."""
+        encoded = self._key_bytes.reshape(-1).view(f"S{key_bytes}")[rows]
+        return [bytes_to_key(key) for key in encoded.tolist()]
+
+    def snapshot(self, rows: Optional[np.ndarray] = None) -> "InfoSetTable":
+        """Copy of `rows`, by default of all rows in use.
+
+        Used to write a checkpoint while training goes on.
+        """
+        if rows is None:
+            keys, rows = self.used_rows()
+        else:
+            keys = self.keys_of(rows)
+        table = InfoSetTable(max(1, len(keys)))
+        table._n_rows = len(keys)
+        table._key_bytes[: len(keys)] = self._key_bytes.reshape(-1, key_bytes)[rows]
+        table._index()
+        table.regret[: len(keys)], table.strategy[: len(keys)] = self.settled(rows)
+        for name in ("masks", "sigma", "_stale"):
+            getattr(table, name)[: len(keys)] = getattr(self, name)[rows]
+        table._stale[: len(keys)] |= self._epoch[rows] != self._now[0]
+        return table
+
+    def to_dict(self, rows: Optional[np.ndarray] = None) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Export to the dict-of-dicts checkpoint format.
+
+        Only `rows` are exported if given, otherwise all rows in use.
+        Regrets are written for every legal action, strategies only for
+        info sets that have a strategy count.
+        """
+        if rows is None:
+            keys, rows = self.used_rows()
+        else:
+            keys = self.keys_of(rows)
+        regret, strategy = self.settled(rows)
+        regret, strategy = regret.tolist(), strategy.tolist()
+        has_strategy = self.strategy[rows].any(axis=1).tolist()
+        masks = self.masks[rows].tolist()
+        checkpoint = {"regret": {}, "strategy": {}}
+        for i, key in enumerate(keys):
+            info_set = key_to_str(key)
+            ids = from_mask(masks[i])
+            checkpoint["regret"][info_set] = {action_names[a]: regret[i][a] for a in ids}
+            if has_strategy[i]:
+                checkpoint["strategy"][info_set] = {
+                    action_names[a]: strategy[i][a] for a in ids
+                }
+        return checkpoint
+
+    def load_dict(self, checkpoint: Mapping[str, Mapping[str, Mapping[str, float]]]):
+        """Add the info sets of a dict-of-dicts checkpoint to the table.
+
+        The legal actions of an info set are the actions found for it in
+        either the regret or the strategy dict.
+        """
+        regret = checkpoint.get("regret", {})
+        strategy = checkpoint.get("strategy", {})
+        for info_set in _info_sets(checkpoint):
+            values = [regret.get(info_set, {}), strategy.get(info_set, {})]
+            ids = [name_to_action[action] for action in set(values[0]) | set(values[1])]
+            row = self.row(str_to_key(info_set), to_mask(ids))
+            for action, value in values[0].items():
+                self.regret[row, name_to_action[action]] = np.clip(
+                    round(value), regret_floor, regret_ceiling
+                )
+            for action, value in values[1].items():
+                self.strategy[row, name_to_action[action]] = value
+            self._stale[row] = True
+            self._touched[row] = True
+
+    def load_arrays(
+        self, keys: Sequence[int], masks: np.ndarray, regret: np.ndarray, strategy: np.ndarray
+    ):
+        """Add rows given as arrays, replacing the rows of keys already in the table."""
+        masks = np.asarray(masks)
+        rows = np.array(
+            [self.row(key, mask) for key, mask in zip(keys, masks.tolist())], dtype=np.int64
+        )
+        self.masks[rows] = masks
+        self.regret[rows] = regret
+        self.strategy[rows] = strategy
+        self._stale[rows] = True
+        self._touched[rows] = True
+
+    @classmethod
+    def from_dict(
+        cls, checkpoint: Mapping[str, Mapping[str, Mapping[str, float]]],
+        capacity: Optional[int] = None,
+    ) -> "InfoSetTable":
+        """Import a dict-of-dicts checkpoint into a new table."""
+        table = cls(capacity or max(1, len(_info_sets(checkpoint))))
+        table.load_dict(checkpoint)
+        return table
+
+
+def _info_sets(checkpoint: Mapping[str, Mapping[str, Mapping[str, float]]]) -> List[str]:
+    """Info sets that have a regret or a strategy in a checkpoint."""
+    regret = checkpoint.get("regret", {})
+    strategy = checkpoint.get("strategy", {})
+    return list(regret) + [info_set for info_set in strategy if info_set not in regret]
@@ -0,0 +1,204 @@
+"""Serve the probabilities of a blueprint from a memory mapped file.
+
+`BlueprintLookup` opens a ``.bp`` file written by `write_blueprint` or
+``average_strategy.py``, or a training checkpoint whose strategy counts are
+normalised on the fly. The keys of the file are sorted fixed width
+`key_to_bytes` strings, so they are the index: a query is encoded and found
+by binary search, and nothing is built or copied when a file is opened.
+All serving processes that open the same file share its pages in the page
+cache, instead of each holding a dict of Python objects.
+
+An info set is queried with the `PokerState.info_set` string of the README,
+its integer key, or the buckets of the dealt streets with the names of the
+actions made on each of them:
+
+    lookup = BlueprintLookup("start/blueprint_1000000.bp")
+    lookup['[[[12,"l","e"]],[[30,"l"]]]']
+    lookup[[12, 30], [["call", "raiseh"], ["call"]]]
+
+`BlueprintLookup.query_many` answers a batch at once: the keys are encoded
+into one array and found with a single vectorised search, and the masks and
+probabilities come back as dense arrays. Info sets the blueprint never
+visited get the uniform strategy over their legal actions, which are found
+by replaying the betting of their key on a `PokerState`. Betting that
+cannot happen has no legal actions, so one bad query does not fail the
+batch.
+"""
+import functools
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from tools.blueprint.binary_format import BinaryCheckpoint
+from tools.blueprint.info_set_table import _uniform, average_policy
+from tools.poker import info_set
+from tools.poker.actions import action_names, from_mask, n_actions
+from tools.poker.info_set import (
+    history_to_key,
+    key_bytes,
+    key_to_bytes,
+    key_to_history,
+    str_to_key,
+)
+from tools.poker.player import Player
+from tools.poker.pot import Pot
+from tools.poker.state import PokerState
+
+Query = Union[str, int, Tuple[Sequence[int], Sequence[Sequence[str]]]]
+
+
+def query_to_key(query: Query) -> int:
+    """Integer key of an info set string, key, or buckets and action histories."""
+    if isinstance(query, str):
+        return str_to_key(query)
+    if isinstance(query, (int, np.integer)):
+        return int(query)
+    buckets, histories = query
+    return history_to_key(buckets, histories)
+
+
+class _BettingState(PokerState):
+    """A `PokerState` that deals no buckets, the betting doesn't depend on them."""
+
+    def _deal_clusters(self, co_cards: List[str]):
+        self._info_set_keys = [info_set.append_street(key, 0) for key in self._info_set_keys]
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def legal_action_mask(histories: Tuple[Tuple[str, ...], ...], n_players: int = 2) -> int:
+    """Bitmask of the legal actions after the action histories of the streets.
+
+    Raises
+    ------
+    ValueError
+        If an action is illegal or a street ends early or late.
+    """
+    pot = Pot()
+    state = _BettingState(
+        [Player(id=player_i, initial_chips=10000, pot=pot) for player_i in range(n_players)]
+    )
+    for street, history in enumerate(histories):
+        if state.is_terminal or state.betting_round != street:
+            raise ValueError(f"Street {street} of {histories} is not being bet on.")
+        for action in history:
+            if state.is_terminal or action not in state.legal_actions:
+                raise ValueError(f"{action} is not legal in {histories}.")
+            state.apply_action(action, inplace=True)
+    if state.is_terminal or state.betting_round != len(histories) - 1:
+        raise ValueError(f"{histories} ends the hand or a street that has no bucket.")
+    return state.legal_action_mask
+
+
+class BlueprintLookup:
+    """Probabilities of the actions of the info sets of a blueprint file.
+
+    Parameters
+    ----------
+    path : str
+        A ``.bp`` blueprint or checkpoint.
+    """
+
+    def __init__(self, path: str):
+        self._file = BinaryCheckpoint.load(path, mmap=True)
+        self.iteration: Optional[int] = self._file.iteration
+
+    def __len__(self) -> int:
+        return len(self._file)
+
+    def __contains__(self, query: Query) -> bool:
+        return self.find(query) >= 0
+
+    def __getitem__(self, query: Query) -> Dict[str, float]:
+        """Probabilities of the legal actions of an info set, by action name."""
+        row = self.find(query)
+        if row < 0:
+            raise KeyError(query)
+        probabilities = self.probabilities(row).tolist()
+        return {action_names[a]: probabilities[a] for a in from_mask(self.mask(row))}
+
+    def get(self, query: Query, default=None) -> Optional[Dict[str, float]]:
+        """`lookup[query]`, or `default` if the blueprint has no such info set."""
+        try:
+            return self[query]
+        except KeyError:
+            return default
+
+    def find(self, query: Query) -> int:
+        """Row of an info set, or -1 if the blueprint has none."""
+        try:
+            encoded = key_to_bytes(query_to_key(query))
+        except ValueError:
+            # Longer than any key in the file.
+            return -1
+        keys = self._file.keys
+        row = int(np.searchsorted(keys, np.array(encoded, dtype=f"S{key_bytes}")))
+        if row < len(keys) and keys[row] == encoded.rstrip(b"\0"):
+            return row
+        return -1
+
+    def find_many(self, keys: Iterable[int]) -> np.ndarray:
+        """Rows of info set keys, -1 where the blueprint has none."""
+        encoded: List[bytes] = []
+        too_long: List[int] = []
+        for i, key in enumerate(keys):
+            try:
+                encoded.append(key_to_bytes(key))
+            except ValueError:
+                encoded.append(bytes(key_bytes))
+                too_long.append(i)
+        queries = np.array(encoded, dtype=f"S{key_bytes}")
+        file_keys = self._file.keys
+        rows = np.searchsorted(file_keys, queries)
+        found = rows < len(file_keys)
+        found[found] = file_keys[rows[found]] == queries[found]
+        found[too_long] = False
+        return np.where(found, rows, -1)
+
+    def query_many(
+        self, queries: Sequence[Query], n_players: int = 2
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Legal action masks and probabilities of a batch of info sets.
+
+        Info sets that are not in the blueprint get the uniform strategy over
+        the legal actions of their action histories. Those whose histories
+        cannot be played, see `legal_action_mask`, get mask 0 and all-zero
+        probabilities.
+
+        Returns
+        -------
+        masks : np.ndarray
+            uint8 bitmask of the legal actions of every query.
+        probabilities : np.ndarray
+            float32 array of shape (len(queries), n_actions) indexed by
+            action id, zero for illegal actions.
+        """
+        keys = [query_to_key(query) for query in queries]
+        rows = self.find_many(keys)
+        found = rows >= 0
+        masks = np.zeros(len(keys), dtype=np.uint8)
+        probabilities = np.zeros((len(keys), n_actions), dtype=np.float32)
+        masks[found] = self._file.masks[rows[found]]
+        strategy = self._file.strategy[rows[found]]
+        if self._file.kind == "blueprint":
+            probabilities[found] = strategy
+        else:
+            probabilities[found] = average_policy(strategy, masks[found])
+        for i in np.flatnonzero(~found):
+            _, histories = key_to_history(keys[i])
+            try:
+                masks[i] = legal_action_mask(tuple(map(tuple, histories)), n_players)
+            except ValueError:
+                # No such betting, the row keeps mask 0.
+                continue
+        probabilities[~found] = _uniform[masks[~found]]
+        return masks, probabilities
+
+    def mask(self, row: int) -> int:
+        """Bitmask of the legal actions of `row`."""
+        return int(self._file.masks[row])
+
+    def probabilities(self, row: int) -> np.ndarray:
+        """Probabilities of `row` indexed by action id, zero for illegal actions."""
+        if self._file.kind == "blueprint":
+            return np.array(self._file.strategy[row])
+        return average_policy(self._file.strategy[row : row + 1], self._file.masks[row : row + 1])[0]
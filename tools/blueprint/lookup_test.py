@@ -0,0 +1,23 @@
+"""Batched queries of `BlueprintLookup`."""
+import numpy as np
+
+from tools.blueprint.checkpoint import write_blueprint
+from tools.blueprint.info_set_table import InfoSetTable
+from tools.blueprint.lookup import BlueprintLookup, legal_action_mask
+from tools.poker.info_set import history_to_key
+
+
+def test_impossible_history_gets_no_actions(tmp_path):
+    table = InfoSetTable(4)
+    known = history_to_key([3], [[]])
+    mask = legal_action_mask(((),))
+    table.add_strategy(table.row(known, mask), 1, 5)
+    path = str(tmp_path / "blueprint_1.bp")
+    write_blueprint(table, path, 1)
+    lookup = BlueprintLookup(path)
+    queries = [known, ([4], [[]]), ([4], [["fold"]])]
+    masks, probabilities = lookup.query_many(queries)
+    assert masks.tolist() == [mask, mask, 0]
+    assert probabilities[0].tolist() == lookup.probabilities(lookup.find(known)).tolist()
+    assert np.isclose(probabilities[1].sum(), 1)
+    assert not probabilities[2].any()
@@ -0,0 +1,74 @@
+"""Action sampling from blocks of pre-generated uniforms.
+
+`np.random.choice` costs several microseconds of call overhead to pick one
+of a handful of actions. `ActionSampler` instead draws a block of uniforms
+at a time and samples by inverse CDF over the few probabilities in plain
+Python.
+
+Every sampler has its own Philox stream, keyed by the seed and the worker
+id, so each worker of a parallel run draws an independent and reproducible
+sequence. Games deal their cards from the same generator.
+"""
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class ActionSampler:
+    """Sampler of action indices for one worker.
+
+    Parameters
+    ----------
+    seed : int, optional
+        Seed shared by the workers of a run, fresh entropy if None.
+    worker_id : int
+        Index of the worker, selects the stream of this sampler.
+    block_size : int
+        Number of uniforms generated at a time.
+    """
+
+    def __init__(self, seed: Optional[int] = None, worker_id: int = 0, block_size: int = 4096):
+        if seed is None:
+            seed = np.random.SeedSequence().entropy & (1 << 64) - 1
+        if not 0 <= worker_id < 1 << 64 or not 0 <= seed < 1 << 64:
+            raise ValueError("seed and worker_id must fit in 64 bits.")
+        # The 128 bit Philox key holds both, so no two workers share a stream.
+        self._generator = np.random.Generator(np.random.Philox(key=seed | worker_id << 64))
+        self._block_size = block_size
+        self._block = []
+        self._i = 0
+
+    @property
+    def generator(self) -> np.random.Generator:
+        """Philox generator of the stream, e.g. to deal the cards of the worker."""
+        return self._generator
+
+    def uniform(self) -> float:
+        """Next uniform in [0, 1)."""
+        if self._i == len(self._block):
+            self._block = self._generator.random(self._block_size).tolist()
+            self._i = 0
+        u = self._block[self._i]
+        self._i += 1
+        return u
+
+    def choose(self, probabilities: Sequence[float]) -> int:
+        """Index drawn with the given probabilities.
+
+        Probabilities need not sum to exactly one, rounding is absorbed by
+        the last index with a positive probability.
+        """
+        if isinstance(probabilities, np.ndarray):
+            probabilities = probabilities.tolist()
+        u = self.uniform()
+        cumulative = 0.0
+        last = -1
+        for i, p in enumerate(probabilities):
+            if p > 0:
+                cumulative += p
+                if u < cumulative:
+                    return i
+                last = i
+        if last < 0:
+            raise ValueError("No index has a positive probability.")
+        return last
@@ -0,0 +1,359 @@
+"""Info set table in shared memory for multi process training.
+
+`SharedInfoSetTable` holds the same rows as `InfoSetTable`, with regrets,
+strategy counts, legal action masks and the cached current strategy, in one
+`multiprocessing.shared_memory` block. Workers read and update it directly
+instead of going through a Manager process.
+
+The index is an open addressing hash table with linear probing. Unlike
+the index of `InfoSetTable`, every slot holds a key as `key_to_bytes` and
+a used flag itself, and a key's slot is also its row. Slots are found
+from the hash of the int key, which is the same in every process. Rows
+are never moved or deleted. Writes take one of a set of striped locks,
+picked by the row:
+
+* To insert a key, a worker holds the slot's lock while it claims the
+  slot, writes the key and only then sets the used flag. Two workers that
+  insert the same key therefore agree on one row. Readers only compare
+  keys in slots whose flag is set.
+* Regret and strategy updates hold the row's lock for their
+  read-modify-write.
+
+Reads of regrets take no lock and may see a row that is mid-update, as in
+Hogwild style training. Pending discounts are applied to a row under its
+lock the first time a worker looks it up after the discount.
+
+The block has a fixed number of slots. While the workers are idle, the
+process that created the table can `grow` it: the rows are rehashed into
+a larger block, whose name goes to a shared buffer the workers check with
+`follow` before their next job.
+"""
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tools.blueprint.info_set_table import InfoSetTable, _max_epochs, _uniform
+from tools.poker.actions import n_actions
+from tools.poker.info_set import key_bytes, key_to_bytes
+
+_golden = 0x9E3779B97F4A7C15
+_mask64 = (1 << 64) - 1
+
+
+def _layout(capacity: int) -> List[Tuple[str, tuple, type, int]]:
+    """Name, shape, dtype and offset of every array in the block, and its size."""
+    arrays = [
+        ("_count", (1,), np.int64),
+        ("_now", (1,), np.int64),
+        ("_log_scale", (_max_epochs,), np.float64),
+        ("_checkpoint_epoch", (1,), np.int64),
+        ("regret", (capacity, n_actions), np.int32),
+        ("strategy", (capacity, n_actions), np.float32),
+        ("sigma", (capacity, n_actions), np.float32),
+        ("_epoch", (capacity,), np.uint16),
+        ("_key_bytes", (capacity * key_bytes,), np.uint8),
+        ("masks", (capacity,), np.uint8),
+        ("_used", (capacity,), np.uint8),
+        ("_stale", (capacity,), np.bool_),
+        ("_touched", (capacity,), np.bool_),
+    ]
+    layout = []
+    offset = 0
+    for name, shape, dtype in arrays:
+        layout.append((name, shape, dtype, offset))
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return layout + [("", (), None, offset)]
+
+
+class SharedInfoSetTable(InfoSetTable):
+    """`InfoSetTable` in shared memory, for workers of a fork or spawn.
+
+    The process that creates the table owns the block and must `unlink` it
+    once the other processes are done with it.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of slots, a power of two. Every slot takes about 134 bytes of
+        shared memory, about 560MB for the default of 1 << 22.
+    n_locks : int
+        Number of striped locks.
+    max_load : float
+        Fraction of the slots that may be used before inserts fail, the
+        table must `grow` before.
+    """
+
+    def __init__(self, capacity: int = 1 << 22, n_locks: int = 64, max_load: float = 0.75):
+        _check_capacity(capacity)
+        self._shm = shared_memory.SharedMemory(create=True, size=_layout(capacity)[-1][3])
+        # Forked workers inherit the table as is, so the owner is a pid.
+        self._owner_pid = os.getpid()
+        self._locks = [mp.Lock() for _ in range(n_locks)]
+        self._count_lock = mp.Lock()
+        self._max_load = max_load
+        # Name and capacity of the current block, for `follow`.
+        self._block_name = mp.RawArray("c", 64)
+        self._block_capacity = mp.RawValue("q")
+        self._block_name.value = self._shm.name.encode()
+        self._block_capacity.value = capacity
+        self._attach(capacity)
+
+    def _attach(self, capacity: int):
+        """Create the views of the arrays in the block."""
+        for name, shape, dtype, offset in _layout(capacity)[:-1]:
+            setattr(self, name, np.ndarray(shape, dtype, buffer=self._shm.buf, offset=offset))
+        # Single items are read much faster from memoryviews than arrays.
+        self._keys_view = memoryview(self._key_bytes)
+        self._used_view = memoryview(self._used)
+        self._views()
+        self._slot_mask = capacity - 1
+        self._shift = 64 - capacity.bit_length() + 1
+        self._max_rows = int(self._max_load * capacity)
+
+    def __getstate__(self):
+        if self._shm is None:
+            raise ValueError("The table is closed.")
+        return dict(
+            name=self._shm.name,
+            capacity=self.capacity,
+            locks=self._locks,
+            count_lock=self._count_lock,
+            max_load=self._max_load,
+            block_name=self._block_name,
+            block_capacity=self._block_capacity,
+        )
+
+    def __setstate__(self, state):
+        self._shm = _open(state["name"])
+        self._owner_pid = None
+        self._locks = state["locks"]
+        self._count_lock = state["count_lock"]
+        self._max_load = state["max_load"]
+        self._block_name = state["block_name"]
+        self._block_capacity = state["block_capacity"]
+        self._attach(state["capacity"])
+
+    def __len__(self) -> int:
+        return int(self._count[0])
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the shared memory block."""
+        return self._shm.size
+
+    @property
+    def load(self) -> float:
+        """Fraction of the slots in use."""
+        return len(self) / self.capacity
+
+    def _lock(self, row: int):
+        return self._locks[row % len(self._locks)]
+
+    def _home(self, key: int) -> int:
+        """First slot probed for `key`."""
+        return (hash(key) * _golden & _mask64) >> self._shift if self._shift < 64 else 0
+
+    def find(self, key: int) -> int:
+        """Return the row of `key`, or -1 if it has no row."""
+        encoded = key_to_bytes(key)
+        keys, used = self._keys_view, self._used_view
+        slot = self._home(key)
+        while used[slot]:
+            if keys[slot * key_bytes : (slot + 1) * key_bytes] == encoded:
+                return slot
+            slot = (slot + 1) & self._slot_mask
+        return -1
+
+    def row(self, key: int, mask: int) -> int:
+        """Return the row of `key`, adding a zero row with legal actions `mask` if new."""
+        encoded = key_to_bytes(key)
+        keys, used = self._keys_view, self._used_view
+        slot = self._home(key)
+        while True:
+            if not used[slot]:
+                with self._lock(slot):
+                    if not used[slot]:
+                        self._claim(slot, encoded, mask)
+                        return slot
+                # Another worker claimed the slot first, it may be our key.
+            if keys[slot * key_bytes : (slot + 1) * key_bytes] == encoded:
+                if self._epoch_view[slot] != self._now_view[0]:
+                    with self._lock(slot):
+                        if self._epoch[slot] != self._now[0]:
+                            self._settle(slot)
+                return slot
+            slot = (slot + 1) & self._slot_mask
+
+    def _claim(self, slot: int, encoded: bytes, mask: int):
+        """Write a new row into `slot`, whose lock is held."""
+        with self._count_lock:
+            if self._count[0] >= self._max_rows:
+                raise ValueError(
+                    f"The table is full, {self._count[0]} info sets fill "
+                    f"{self._max_load:.0%} of a capacity of {self.capacity}, "
+                    f"it has to grow before."
+                )
+            self._count[0] += 1
+        self._keys_view[slot * key_bytes : (slot + 1) * key_bytes] = encoded
+        self.regret[slot] = 0
+        self.strategy[slot] = 0
+        self.masks[slot] = mask
+        self.sigma[slot] = _uniform[mask]
+        self._stale[slot] = False
+        self._touched[slot] = True
+        self._epoch[slot] = self._now[0]
+        # Publish the row last, readers ignore the slot until then.
+        self._used_view[slot] = 1
+
+    def add_regret(self, row: int, action_ids: Sequence[int], deltas: Sequence[float]):
+        """Add `deltas` to the regrets of `action_ids`, keeping them in range."""
+        with self._lock(row):
+            super().add_regret(row, action_ids, deltas)
+
+    def add_strategy(self, row: int, action_id: int, count: float = 1):
+        """Add `count` to the strategy count of `action_id`."""
+        with self._lock(row):
+            super().add_strategy(row, action_id, count)
+
+    def current_strategy(self, row: int) -> np.ndarray:
+        """Regret matching strategy of `row`, indexed by action id.
+
+        A copy is returned, as other workers may recompute the cached row.
+        """
+        if self._stale[row]:
+            with self._lock(row):
+                super().current_strategy(row)
+        return self.sigma[row].copy()
+
+    def discount(self, factor: float):
+        """Multiply every regret and strategy count by `factor`.
+
+        Not locked, call it while no worker is updating the table.
+        """
+        super().discount(factor)
+
+    def settle(self):
+        """Apply the pending discounts to every row, before reading the arrays directly.
+
+        Not locked, call it while no worker is updating the table.
+        """
+        self._settle_all(touch=True)
+
+    def _settle_all(self, touch: bool):
+        chunk = 1 << 16
+        for start in range(0, self.capacity, chunk):
+            self._settle_rows(start + np.flatnonzero(self._used[start : start + chunk]), touch)
+
+    def used_rows(self) -> Tuple[List[int], np.ndarray]:
+        """Keys of the info sets and their rows."""
+        rows = np.flatnonzero(self._used)
+        return self.keys_of(rows), rows
+
+    def grow(self, capacity: Optional[int] = None):
+        """Move the rows to a new block of `capacity` slots, twice as many by default.
+
+        The keys are rehashed, so rows change. Not locked, call it in the
+        process that created the table while no worker uses it. The workers
+        move to the new block in `follow`.
+        """
+        if self._owner_pid != os.getpid():
+            raise ValueError("Only the process that created the table can grow it.")
+        capacity = 2 * self.capacity if capacity is None else capacity
+        _check_capacity(capacity)
+        if len(self) > self._max_load * capacity:
+            raise ValueError(f"{len(self)} info sets do not fit in a capacity of {capacity}.")
+        keys, rows = self.used_rows()
+        # The pending discounts move along with the epochs of the rows.
+        moved = {
+            name: getattr(self, name)[rows]
+            for name in ("regret", "strategy", "sigma", "masks", "_stale", "_touched", "_epoch")
+        }
+        key_rows = self._key_bytes.reshape(-1, key_bytes)[rows]
+        now, log_scale = int(self._now[0]), self._log_scale.copy()
+        checkpoint_epoch = int(self._checkpoint_epoch[0])
+        old = self._shm
+        self._detach()
+        self._shm = shared_memory.SharedMemory(create=True, size=_layout(capacity)[-1][3])
+        self._attach(capacity)
+        # Same probing as `row`, into a local copy of the used flags.
+        used = bytearray(capacity)
+        slots = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            slot = self._home(key)
+            while used[slot]:
+                slot = (slot + 1) & self._slot_mask
+            used[slot] = 1
+            slots[i] = slot
+        for name, values in moved.items():
+            getattr(self, name)[slots] = values
+        self._key_bytes.reshape(-1, key_bytes)[slots] = key_rows
+        self._now[0] = now
+        self._log_scale[:] = log_scale
+        self._checkpoint_epoch[0] = checkpoint_epoch
+        self._count[0] = len(keys)
+        self._used[:] = np.frombuffer(used, dtype=np.uint8)
+        old.close()
+        old.unlink()
+        self._block_name.value = self._shm.name.encode()
+        self._block_capacity.value = capacity
+
+    def follow(self):
+        """Attach to the block the table has grown into, if it has since the last call."""
+        name = self._block_name.value.decode()
+        if self._shm is None or name == self._shm.name:
+            return
+        self._detach()
+        self._shm.close()
+        self._shm = _open(name)
+        self._attach(self._block_capacity.value)
+
+    @classmethod
+    def from_dict(cls, checkpoint, capacity: Optional[int] = None) -> "SharedInfoSetTable":
+        """Import a dict-of-dicts checkpoint into a new table."""
+        table = cls(capacity) if capacity else cls()
+        table.load_dict(checkpoint)
+        return table
+
+    def _detach(self):
+        """Drop the views of the arrays in the block."""
+        self._keys_view.release()
+        self._used_view.release()
+        self._epoch_view.release()
+        self._now_view.release()
+        for name, *_ in _layout(0)[:-1]:
+            setattr(self, name, None)
+
+    def close(self):
+        """Detach this process from the block."""
+        if self._shm is None:
+            return
+        self._detach()
+        self._shm.close()
+
+    def unlink(self):
+        """Free the block, called once by the process that created it."""
+        if self._owner_pid == os.getpid():
+            self._shm.unlink()
+        self._shm = None
+
+
+def _check_capacity(capacity: int):
+    """Raise ValueError unless `capacity` is a power of two."""
+    if capacity < 1 or capacity & (capacity - 1):
+        raise ValueError(f"Capacity {capacity} is not a power of two.")
+
+
+def _open(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing block without taking part in its cleanup.
+
+    Only the creator of a block frees it. Before Python 3.13 attaching
+    registers the block again with the resource tracker the workers share
+    with their parent, which is harmless as registrations are a set.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
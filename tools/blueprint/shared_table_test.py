@@ -0,0 +1,92 @@
+"""Growth of `SharedInfoSetTable` into larger shared memory blocks."""
+import multiprocessing as mp
+import random
+
+import pytest
+
+from tools.blueprint.info_set_table import InfoSetTable
+from tools.blueprint.shared_table import SharedInfoSetTable
+from tools.poker.info_set import append_action, new_key
+
+
+def random_keys(rng: random.Random, n: int) -> list:
+    keys = []
+    for _ in range(n):
+        key = new_key(rng.randrange(200))
+        for _ in range(rng.randrange(4)):
+            key = append_action(key, rng.choice(["call", "bigfour", "raiseh"]))
+        keys.append(key)
+    return keys
+
+
+def update(table: InfoSetTable, keys: list, rng: random.Random):
+    for key in keys:
+        row = table.row(key, 0b111)
+        table.add_regret(row, [rng.randrange(3)], [rng.randrange(-50, 50)])
+        table.add_strategy(row, rng.randrange(3), 1)
+
+
+@pytest.fixture
+def table():
+    table = SharedInfoSetTable(1 << 6)
+    yield table
+    table.close()
+    table.unlink()
+
+
+def test_grow_keeps_rows(table):
+    plain = InfoSetTable(4)
+    rng = random.Random(0)
+    n_grown = 0
+    for t in range(30):
+        keys = random_keys(rng, 20)
+        seed = rng.random()
+        update(table, keys, random.Random(seed))
+        update(plain, keys, random.Random(seed))
+        if t % 7 == 6:
+            table.discount(0.5)
+            plain.discount(0.5)
+        while table.load > 0.5:
+            table.grow()
+            n_grown += 1
+    assert n_grown >= 3
+    assert table.to_dict() == plain.to_dict()
+
+
+def _insert(table: SharedInfoSetTable, keys: list, start, done):
+    start.wait()
+    table.follow()
+    update(table, keys, random.Random(0))
+    done.set()
+
+
+def test_workers_follow_growth(table):
+    context = mp.get_context("fork")
+    start, done = context.Event(), context.Event()
+    rng = random.Random(1)
+    keys = random_keys(rng, 40)
+    worker = context.Process(target=_insert, args=(table, keys, start, done))
+    worker.start()
+    update(table, random_keys(rng, 30), rng)
+    table.grow(1 << 8)
+    start.set()
+    worker.join(30)
+    assert worker.exitcode == 0 and done.is_set()
+    assert table.capacity == 1 << 8
+    assert all(key in table for key in keys)
+
+
+def test_only_the_owner_grows(table):
+    context = mp.get_context("fork")
+    errors = context.Queue()
+
+    def grow():
+        try:
+            table.grow()
+        except ValueError as error:
+            errors.put(str(error))
+
+    worker = context.Process(target=grow)
+    worker.start()
+    worker.join(30)
+    assert "created the table" in errors.get(timeout=5)
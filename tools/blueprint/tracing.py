@@ -0,0 +1,140 @@
+"""Sampled tracing of the game tree traversals of training.
+
+A `Tracer` is off unless it has a path. It then traces one iteration in
+`sample_every`, optionally only on some streets. Traversals test the plain
+attribute `on` before building anything, so with tracing off no string is
+formatted and no record is built on the hot path:
+
+    if agent.tracer.on and agent.tracer.traces(state.betting_round):
+        agent.tracer.record("cfr", info_set=state.info_set, value=vo)
+
+Records are JSON lines with the iteration and the event, buffered in memory
+and written to a rotating file. Every worker process writes a file of its
+own, see `for_worker`.
+"""
+import json
+import logging
+import logging.handlers
+import os
+from typing import Iterable, Optional
+
+streets = ["pre_flop", "flop", "turn", "river"]
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        # NumPy scalars and arrays through `tolist`.
+        return json.dumps(record.msg, separators=(",", ":"), default=lambda o: o.tolist())
+
+
+class Tracer:
+    """Writes sampled records of the traversals to a rotating file.
+
+    Parameters
+    ----------
+    path : str, optional
+        File of the records, tracing is off if None.
+    sample_every : int
+        Iterations t with t % sample_every == 0 are traced.
+    trace_streets : iterable of str, optional
+        Names of the streets that are traced, all of them if None.
+    max_bytes : int
+        Size at which the file is rotated.
+    backup_count : int
+        Rotated files that are kept.
+    capacity : int
+        Records buffered before they are written.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        sample_every: int = 1000,
+        trace_streets: Optional[Iterable[str]] = None,
+        max_bytes: int = 64 << 20,
+        backup_count: int = 3,
+        capacity: int = 1024,
+    ):
+        if sample_every < 1:
+            raise ValueError(f"sample_every must be at least 1, not {sample_every}.")
+        self.path = path
+        self.sample_every = sample_every
+        self._streets = (
+            None if trace_streets is None else frozenset(map(streets.index, trace_streets))
+        )
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.capacity = capacity
+        # True while an iteration that is sampled is traversed.
+        self.on = False
+        self.t = 0
+        self._logger: Optional[logging.Logger] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_logger"] = None
+        return state
+
+    def for_worker(self, worker_id: int) -> "Tracer":
+        """Tracer of a worker process, writing to a file of its own."""
+        if self.path is None:
+            return self
+        root, ext = os.path.splitext(self.path)
+        return Tracer(
+            f"{root}.worker_{worker_id}{ext}",
+            self.sample_every,
+            None if self._streets is None else [streets[s] for s in sorted(self._streets)],
+            self.max_bytes,
+            self.backup_count,
+            self.capacity,
+        )
+
+    def start_iteration(self, t: int):
+        """Turn tracing on if iteration `t` is sampled, off otherwise."""
+        self.t = t
+        self.on = self.path is not None and t % self.sample_every == 0
+
+    def traces(self, betting_round: int) -> bool:
+        """Whether records of the street `betting_round` are written."""
+        return self._streets is None or betting_round in self._streets
+
+    def record(self, event: str, **fields):
+        """Write a record of `event` at the current iteration.
+
+        The fields are formatted when the buffer is written, so they must not
+        be modified afterwards, copy arrays with `tolist`.
+        """
+        if self._logger is None:
+            self._logger = self._open()
+        self._logger.info({"t": self.t, "event": event, **fields})
+
+    def _open(self) -> logging.Logger:
+        handler = logging.handlers.RotatingFileHandler(
+            self.path,
+            maxBytes=self.max_bytes,
+            backupCount=self.backup_count,
+            encoding="utf-8",
+            delay=True,
+        )
+        handler.setFormatter(_JsonFormatter())
+        buffer = logging.handlers.MemoryHandler(
+            self.capacity, flushLevel=logging.CRITICAL, target=handler
+        )
+        # A logger per file, records don't reach the handlers of the root.
+        logger = logging.getLogger(f"{__name__}.{os.getpid()}.{self.path}")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(buffer)
+        return logger
+
+    def close(self):
+        """Write the buffered records and close the file."""
+        if self._logger is None:
+            return
+        for buffer in list(self._logger.handlers):
+            # Closing the buffer flushes it, but leaves its target open.
+            target = buffer.target
+            buffer.close()
+            target.close()
+            self._logger.removeHandler(buffer)
+        self._logger = None
@@ -0,0 +1,105 @@
+"""Integer ids of the betting actions.
+
+Actions are strings in the game API and in strategy files, the ids give
+them a fixed order so per info set data can be held in arrays of
+`n_actions` columns and sets of actions in a bitmask.
+"""
+import math
+from enum import IntEnum
+from typing import Dict, List, Tuple
+
+
+class Action(IntEnum):
+    fold = 0
+    call = 1
+    bigone = 2
+    bigfour = 3
+    bigtwenty = 4
+    raiseh = 5
+    raiseo = 6
+    allin = 7
+
+
+n_actions: int = len(Action)
+# Action id to the string used by `PokerState.apply_action` and in files.
+action_names: List[str] = [action.name for action in Action]
+name_to_action: Dict[str, Action] = {action.name: action for action in Action}
+
+
+def to_mask(action_ids) -> int:
+    """Bitmask with bit `id` set for every action id."""
+    mask = 0
+    for action_id in action_ids:
+        mask |= 1 << action_id
+    return mask
+
+
+def from_mask(mask: int) -> Tuple[Action, ...]:
+    """Action ids of the bits set in `mask`, in id order."""
+    return tuple(action for action in Action if mask >> action & 1)
+
+
+def legal_action_ids(
+    betting_stage: str,
+    n_chips: int,
+    pot: int,
+    n_chips_to_call: int,
+    last_raise: int,
+    n_raises: int,
+    has_allin: bool,
+    big_blind: int,
+) -> Tuple[Action, ...]:
+    """Actions an active player may take, the rules of `PokerState.legal_actions`.
+
+    Parameters
+    ----------
+    betting_stage : str
+        Current betting stage, "pre_flop", "flop", "turn" or "river".
+    n_chips : int
+        Chips the player has left.
+    pot : int
+        Chips in the pot.
+    n_chips_to_call : int
+        Chips the player has to add to match the biggest bet.
+    last_raise : int
+        Size of the last raise of the betting round.
+    n_raises : int
+        Number of raises in the betting round.
+    has_allin : bool
+        Whether a player is all in.
+    big_blind : int
+        Size of the big blind.
+
+    Returns
+    -------
+    action_ids : tuple of Action
+        The legal actions in id order.
+    """
+    halfpot = math.ceil(pot / 200) * 100
+    onepot = math.ceil(pot / 100) * 100
+    actions: List[Action] = []
+    if n_chips_to_call != 0:
+        actions.append(Action.fold)
+    actions.append(Action.call)
+    if not has_allin:
+        if betting_stage == "pre_flop":
+            if n_raises < 1:
+                actions.append(Action.bigone)
+            if last_raise <= 4 * big_blind and n_chips > n_chips_to_call + 4 * big_blind:
+                actions.append(Action.bigfour)
+            if last_raise <= 20 * big_blind and n_chips_to_call + 2000 < n_chips:
+                actions.append(Action.bigtwenty)
+        elif (
+            betting_stage == "flop"
+            and last_raise <= halfpot
+            and n_chips > n_chips_to_call + halfpot
+            and n_raises < 4
+        ):
+            actions += [Action.raiseh, Action.raiseo]
+        elif n_raises < 1 and last_raise <= halfpot and n_chips > n_chips_to_call + halfpot:
+            actions += [Action.raiseh, Action.raiseo]
+        elif last_raise <= onepot and n_chips > n_chips_to_call + onepot:
+            actions.append(Action.raiseo)
+        if n_chips > 0:
+            actions.append(Action.allin)
+    return tuple(actions)
@@ -0,0 +1,80 @@
+"""Memory and throughput benchmark of the game objects.
+
+Measures the memory held by freshly dealt games and the rate at which random
+games are played out through `PokerState.apply_action`, with copying and
+with in-place actions. Bucket lookups are replaced by a constant so only
+the game logic is timed.
+
+    python tools/poker/benchmark.py --n_games 2000
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(os.path.split(curPath)[0])[0]
+sys.path.append(rootPath)
+
+import click
+import numpy as np
+
+import tools.EHS_based_v2.bucket_table as bucket_table
+from tools.poker.state import new_game
+
+
+def _play_out(state, inplace: bool) -> int:
+    """Play random legal actions until the game ends, return the action count."""
+    n_actions = 0
+    while not state.is_terminal:
+        action = random.choice(state.legal_actions)
+        state = state.apply_action(action, inplace=True) if inplace else state.apply_action(action)
+        n_actions += 1
+    return n_actions
+
+
+def measure_memory(n_games: int) -> float:
+    """Bytes allocated per freshly dealt two player game."""
+    tracemalloc.start()
+    games = [new_game(2) for _ in range(n_games)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del games
+    return size / n_games
+
+
+def measure_throughput(n_games: int, inplace: bool) -> float:
+    """Actions applied per second while playing out random games."""
+    states = [new_game(2) for _ in range(n_games)]
+    start = time.perf_counter()
+    n_actions = sum(_play_out(state, inplace) for state in states)
+    return n_actions / (time.perf_counter() - start)
+
+
+def measure_legal_actions(n_games: int) -> float:
+    """legal_actions reads per second on fresh games."""
+    states = [new_game(2) for _ in range(n_games)]
+    start = time.perf_counter()
+    for _ in range(10):
+        for state in states:
+            state.legal_actions
+    return 10 * n_games / (time.perf_counter() - start)
+
+
+@click.command()
+@click.option("--n_games", default=2000, help="number of games per measurement.")
+@click.option("--seed", default=0, help="seed of the random actions and cards.")
+def cli(n_games: int, seed: int):
+    """Print the memory and throughput of the game objects."""
+    random.seed(seed)
+    np.random.seed(seed)
+    bucket_table.lossy_lookup = lambda board_card, hole_card: 0
+    click.echo(f"memory per game:       {measure_memory(n_games):10.0f} bytes")
+    click.echo(f"legal_actions:         {measure_legal_actions(n_games):10.0f} /s")
+    click.echo(f"apply_action (copy):   {measure_throughput(n_games, False):10.0f} /s")
+    click.echo(f"apply_action (inplace):{measure_throughput(n_games, True):10.0f} /s")
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,10 +1,35 @@
+import sys
 from typing import Dict, List, Set, Union
 
 from tools.poker.evaluation.eval_card import EvaluationCard
 
+_rank_to_char: Dict[int, str] = {
+    2: "2",
+    3: "3",
+    4: "4",
+    5: "5",
+    6: "6",
+    7: "7",
+    8: "8",
+    9: "9",
+    10: "T",
+    11: "J",
+    12: "Q",
+    13: "K",
+    14: "A",
+}
+# Suit char to the suit of EvaluationCard.str_to_int52.
+_suit_to_int52_suit: Dict[str, int] = {
+    suit: suit_int.bit_length() - 1
+    for suit, suit_int in EvaluationCard.CHAR_SUIT_TO_INT_SUIT.items()
+}
+
+
 class Card:
     """Card to represent a poker card."""
 
+    __slots__ = ("_rank", "_suit", "_eval_card", "_card_char")
+
     def __init__(self, rank: Union[str, int], suit: str):
         """Instanciate the card."""
         if not isinstance(rank, (int, str)):
@@ -17,9 +42,9 @@ class Card:
             )
         self._rank = rank
         self._suit = suit
-        rank_char = self._rank_to_char(rank)
-        suit_char = self.suit
-        self._eval_card = EvaluationCard.str_to_int52(f"{rank_char}{suit_char}")
+        # The card string never changes, build it once instead of per access.
+        self._card_char = sys.intern(_rank_to_char[rank] + suit)
+        self._eval_card = rank - 2 + 13 * _suit_to_int52_suit[suit]
         # self._cup_card = EvaluationCard.new(f"{rank_char}{suit_char}")
 
     def __repr__(self):
@@ -29,6 +54,13 @@ class Card:
     def __int__(self):
         return self._eval_card
 
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        """Cards are immutable, so copies of a state can share them."""
+        return self
+
 
     def __eq__(self, other):
         return int(self) == int(other)
@@ -99,40 +131,12 @@ class Card:
 
     def _rank_to_char(self, rank: int) -> str:
         """Convert the int rank to char used by the `EvaluationCard` object."""
-        return {
-            2: "2",
-            3: "3",
-            4: "4",
-            5: "5",
-            6: "6",
-            7: "7",
-            8: "8",
-            9: "9",
-            10: "T",
-            11: "J",
-            12: "Q",
-            13: "K",
-            14: "A",
-        }[rank]
+        return _rank_to_char[rank]
 
     @property
     def card_char(self) -> str:
         """Convert the int rank to char used by the `EvaluationCard` object."""
-        return {
-            2: "2",
-            3: "3",
-            4: "4",
-            5: "5",
-            6: "6",
-            7: "7",
-            8: "8",
-            9: "9",
-            10: "T",
-            11: "J",
-            12: "Q",
-            13: "K",
-            14: "A",
-        }[self._rank]+self._suit
+        return self._card_char
 
     # def _suit_to_icon(self, suit: str) -> str:
     #     """Icons for pretty printing."""
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+import copy
 import random
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 
@@ -12,18 +13,35 @@ default_include_ranks: List[int] = list(range(2, 15))
 
 
 class Deck:
-    """Class to manage the deck."""
+    """Class to manage the deck.
+
+    Cards are shuffled and picked with `rng` if given, else with the global
+    `random` and NumPy states. Copies of the deck draw from the same `rng`.
+    """
 
     def __init__(
         self,
         include_suits: List[str] = default_include_suits,
         include_ranks: List[int] = default_include_ranks,
+        rng: Optional[np.random.Generator] = None,
     ):
         """Construct the deck of cards."""
         self._include_suits = include_suits
         self._include_ranks = include_ranks
+        self._rng = rng
         self.reset()
 
+    def __deepcopy__(self, memo) -> Deck:
+        """Copy the cards but not the generator, so that copied states keep
+        dealing from one stream like they do from the global state."""
+        deck = Deck.__new__(Deck)
+        memo[id(self)] = deck
+        deck._include_suits = self._include_suits
+        deck._include_ranks = self._include_ranks
+        deck._rng = self._rng
+        deck._cards_in_deck = copy.deepcopy(self._cards_in_deck, memo)
+        return deck
+
     def __len__(self) -> int:
         """Return overall length of the deck."""
         return len(default_include_suits) + len(default_include_ranks)
@@ -35,7 +53,10 @@ class Deck:
             for suit in self._include_suits
             for rank in self._include_ranks
         ]
-        random.shuffle(self._cards_in_deck)
+        if self._rng is None:
+            random.shuffle(self._cards_in_deck)
+        else:
+            self._rng.shuffle(self._cards_in_deck)
 
     def pick(self, random: bool = True) -> Card:
         """Return a card from the deck.
@@ -53,8 +74,10 @@ class Deck:
         """
         if not len(self._cards_in_deck):
             raise ValueError("Deck is empty - please use Deck.reset()")
-        elif random:
+        elif random and self._rng is None:
             index: int = np.random.randint(len(self._cards_in_deck), size=None)
+        elif random:
+            index: int = int(self._rng.integers(len(self._cards_in_deck)))
         else:
             index: int = len(self._cards_in_deck) - 1
         card: Card = self._cards_in_deck.pop(index)
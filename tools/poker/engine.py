@@ -1,14 +1,9 @@
 from typing import TYPE_CHECKING
-import pickle
 
 if TYPE_CHECKING:
     pass
 from tools.poker.table import PokerTable
-
-import os
-curPath = os.path.abspath(os.path.dirname(__file__))
-with open(curPath+"/five_card_rank.pkl", "rb") as fb:
-    five_card_rank = pickle.load(fb)
+from tools.poker.evaluation.seven_card import get_evaluator
 
 class PokerEngine:
     def __init__(self, table: PokerTable, small_blind: int, big_blind: int):
@@ -31,18 +26,7 @@ class PokerEngine:
     def Maxstrength(self,cards):
         if len(cards) != 7:
             raise Exception('need seven cards')
-        strength = 100000
-        for k in range(len(cards)):
-            for j in range(k + 1, len(cards)):
-                cnt = 0
-                for i in range(len(cards)):
-                    if i != k and i != j:
-                        cnt += 1 << cards[i].eval_card
-                v = five_card_rank[cnt]
-                if strength > v:
-                    strength = v
-        return strength
-
+        return get_evaluator().evaluate([card.eval_card for card in cards])
 
     def compute_winner(self):
         community_cards  = self.table.community_cards
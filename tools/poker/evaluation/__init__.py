@@ -1,3 +1,4 @@
 from .eval_card import EvaluationCard
 from .evaluator import Evaluator
 from .lookup import LookupTable
+from .seven_card import SevenCardEvaluator
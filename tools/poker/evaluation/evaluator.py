@@ -1,7 +1,13 @@
 import itertools
 
+import numpy as np
+
 from tools.poker.evaluation.eval_card import EvaluationCard
 from tools.poker.evaluation.lookup import LookupTable
+from tools.poker.evaluation.seven_card import get_evaluator
+
+# (card >> 12) & 0xF has one bit set per suit, map it to the int52 suit.
+_suit_bit_to_suit = np.array([0, 0, 1, 0, 2, 0, 0, 0, 3], dtype=np.int64)
 
 
 class Evaluator(object):
@@ -18,6 +24,7 @@ class Evaluator(object):
     def __init__(self):
 
         self.table = LookupTable()
+        self.seven_card = get_evaluator()
 
         self.hand_size_map = {5: self._five, 6: self._six, 7: self._seven}
 
@@ -69,20 +76,50 @@ class Evaluator(object):
 
     def _seven(self, cards):
         """
-        Performs five_card_eval() on all (7 choose 5) = 21 subsets
-        of 5 cards in the set of 7 to determine the best ranking,
-        and returns this ranking.
+        Looks the best ranking of the 7 cards up in the tables of
+        `SevenCardEvaluator` instead of scoring all (7 choose 5) = 21
+        subsets of 5 cards, and returns this ranking.
         """
-        minimum = LookupTable.MAX_HIGH_CARD
+        return self.seven_card.evaluate(
+            [EvaluationCard.int_to_int52(c) for c in cards])
 
-        all5cardcombobs = itertools.combinations(cards, 5)
-        for combo in all5cardcombobs:
-
-            score = self._five(combo)
-            if score < minimum:
-                minimum = score
+    def evaluate_batch(self, hands, boards):
+        """
+        Batch version of evaluate. hands and boards are integer arrays of
+        card ints with one row per hand, e.g. (n, 2) and (n, 3 to 5), and
+        the result is an int64 array with the rank of every row, whatever
+        the number of cards.
 
-        return minimum
+        Five and six cards are scored from the array counterparts of the
+        lookup tables, seven cards with the tables of SevenCardEvaluator.
+        """
+        cards = np.hstack([np.asarray(hands, dtype=np.int64),
+                           np.asarray(boards, dtype=np.int64)])
+        if cards.shape[1] == 5:
+            return self._five_batch(cards)
+        if cards.shape[1] == 6:
+            return np.min([self._five_batch(cards[:, list(combo)])
+                           for combo in itertools.combinations(range(6), 5)],
+                          axis=0)
+        if cards.shape[1] == 7:
+            ranks = (cards >> 8) & 0xF
+            suits = _suit_bit_to_suit[(cards >> 12) & 0xF]
+            # The seven card tables are int16, cast like the other paths.
+            return self.seven_card.evaluate_batch(ranks + 13 * suits).astype(np.int64)
+        raise ValueError(f"Can not evaluate hands of {cards.shape[1]} cards.")
+
+    def _five_batch(self, cards):
+        """
+        Batch version of _five on an (n, 5) array of card ints.
+        """
+        flush = np.bitwise_and.reduce(cards, axis=1) & 0xF000
+        handOR = np.bitwise_or.reduce(cards, axis=1) >> 16
+        prime = np.prod(cards & 0xFF, axis=1)
+        index = np.searchsorted(self.table.unsuited_primes, prime)
+        # flush prime products are not in unsuited_primes, clip their index
+        index = np.minimum(index, len(self.table.unsuited_primes) - 1)
+        return np.where(flush != 0, self.table.flush_array[handOR & 0x1FFF],
+                        self.table.unsuited_ranks[index]).astype(np.int64)
 
     def get_rank_class(self, hr):
         """Returns the class of hand from the hand hand_rank from evaluate."""
@@ -1,5 +1,7 @@
 import itertools
 
+import numpy as np
+
 from tools.poker.evaluation.eval_card import EvaluationCard
 
 
@@ -25,6 +27,11 @@ class LookupTable(object):
     Examples:
     * Royal flush (best hand possible)          => 1
     * 7-5-4-3-2 unsuited (worst hand possible)  => 7462
+
+    The dictionaries have array counterparts for batch evaluation:
+    * flush_array[rankbits] is the rank of a flush with these 13 rank bits
+    * unsuited_ranks[i] is the rank of the prime product unsuited_primes[i],
+      unsuited_primes is sorted so it can be searched with np.searchsorted
     """
 
     MAX_STRAIGHT_FLUSH = 10
@@ -74,6 +81,7 @@ class LookupTable(object):
         # we reuse some of the bit sequences
         self.flushes()
         self.multiples()
+        self.arrays()
 
     def flushes(self):
         """
@@ -259,6 +267,21 @@ class LookupTable(object):
                 self.unsuited_lookup[product] = rank
                 rank += 1
 
+    def arrays(self):
+        """
+        Array counterparts of flush_lookup and unsuited_lookup.
+        """
+        self.flush_array = np.zeros(1 << 13, dtype=np.int16)
+        for ranks in itertools.combinations(EvaluationCard.INT_RANKS, 5):
+            rankbits = sum(1 << r for r in ranks)
+            prime_product = EvaluationCard.prime_product_from_rankbits(rankbits)
+            self.flush_array[rankbits] = self.flush_lookup[prime_product]
+
+        self.unsuited_primes = np.array(sorted(self.unsuited_lookup), dtype=np.int64)
+        self.unsuited_ranks = np.array(
+            [self.unsuited_lookup[p] for p in self.unsuited_primes.tolist()],
+            dtype=np.int16)
+
     def write_table_to_disk(self, table, filepath):
         """
         Writes lookup table to disk
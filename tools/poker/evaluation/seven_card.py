@@ -0,0 +1,93 @@
+"""Direct lookup evaluator for seven card hands.
+
+Instead of evaluating the 21 five card subsets of a seven card hand, the best
+hand is read from two precomputed tables:
+
+* ``flush[mask]`` is the best flush or straight flush that can be made from
+  the ranks in a 13 bit mask, for masks with at least five bits set.
+* ``unsuited[i]`` is the best hand ignoring suits of the i-th multiset of
+  seven ranks, in colexicographical order (C(19, 7) = 50388 entries).
+
+With seven cards at most one suit can hold five cards, and if it does no
+four of a kind or full house is possible, so the rank is the minimum of the
+two lookups. Ranks are those of `LookupTable`, 1 being a royal flush and 7462
+the worst high card.
+
+Cards are in `EvaluationCard.str_to_int52` form (``rank + 13 * suit``). The
+tables are generated and memory mapped by `tools.poker.evaluation.tables`.
+"""
+from typing import List, Sequence
+
+import numpy as np
+
+from tools.poker.evaluation import tables as rank_tables
+
+# _BINOMIAL[n][k] = n choose k, enough to rank multisets of seven ranks.
+_BINOMIAL: List[List[int]] = [[1] + [0] * 7]
+for _n in range(1, 20):
+    _BINOMIAL.append([1] + [_BINOMIAL[-1][k - 1] + _BINOMIAL[-1][k] for k in range(1, 8)])
+_POPCOUNT: List[int] = [bin(x).count("1") for x in range(1 << 13)]
+_POPCOUNT_ARRAY = np.array(_POPCOUNT, dtype=np.int64)
+
+
+def _multiset_index(sorted_ranks: Sequence[int]) -> int:
+    """Colex index of a non-decreasing sequence of seven ranks."""
+    return sum(_BINOMIAL[r + i][i + 1] for i, r in enumerate(sorted_ranks))
+
+
+class SevenCardEvaluator:
+    """Rank seven card hands with two table lookups.
+
+    `evaluate` ranks a single hand with plain Python lookups, `evaluate_batch`
+    ranks the rows of an array without looping over them.
+    """
+
+    def __init__(self, table_dir: str = rank_tables.default_table_dir):
+        self.tables = {
+            name: rank_tables.load_table(f"seven_card_{name}", table_dir)
+            for name in ("flush", "unsuited")
+        }
+        # Plain ndarray views of the maps, cheaper to index than np.memmap. They
+        # read the mapped pages, so processes keep sharing them.
+        self._flush = np.asarray(self.tables["flush"])
+        self._unsuited = np.asarray(self.tables["unsuited"])
+
+    def evaluate(self, cards: Sequence[int]) -> int:
+        """Return the rank of seven str_to_int52 cards, lower is better."""
+        suit_masks = [0, 0, 0, 0]
+        ranks = []
+        for card in cards:
+            suit, rank = divmod(card, 13)
+            suit_masks[suit] |= 1 << rank
+            ranks.append(rank)
+        ranks.sort()
+        rank = int(self._unsuited[_multiset_index(ranks)])
+        for suit_mask in suit_masks:
+            if _POPCOUNT[suit_mask] >= 5:
+                return min(rank, int(self._flush[suit_mask]))
+        return rank
+
+    def evaluate_batch(self, cards: np.ndarray) -> np.ndarray:
+        """Rank every row of an (n, 7) integer array of str_to_int52 cards."""
+        cards = np.asarray(cards, dtype=np.int64)
+        ranks = cards % 13
+        suits = cards // 13
+        index = rank_tables.multiset_index(ranks)
+        flush_mask = np.zeros(len(cards), dtype=np.int64)
+        for suit in range(4):
+            suit_mask = ((suits == suit) << ranks).sum(axis=1)
+            flush_mask |= np.where(_POPCOUNT_ARRAY[suit_mask] >= 5, suit_mask, 0)
+        return np.minimum(
+            self.tables["unsuited"][index], self.tables["flush"][flush_mask]
+        )
+
+
+_evaluator = None
+
+
+def get_evaluator() -> SevenCardEvaluator:
+    """Return a process wide evaluator, loading the tables on first use."""
+    global _evaluator
+    if _evaluator is None:
+        _evaluator = SevenCardEvaluator()
+    return _evaluator
@@ -0,0 +1,182 @@
+"""Generation and lazy loading of the hand rank tables.
+
+Ranks are those of `LookupTable`, 1 being a royal flush and 7462 the worst
+high card. Cards are in `EvaluationCard.str_to_int52` form (``rank + 13 *
+suit``). The tables are
+
+* ``five_card[five_card_index(cards)]``, the rank of every five card hand,
+  indexed by the colex index of its sorted cards (C(52, 5) = 2598960
+  entries).
+* ``seven_card_flush[mask]``, the best flush or straight flush that can be
+  made from the ranks in a 13 bit mask, for masks with at least five bits
+  set.
+* ``seven_card_unsuited[i]``, the best hand ignoring suits of the i-th
+  multiset of seven ranks in colex order (C(19, 7) = 50388 entries).
+
+They are generated deterministically with NumPy, stored as ``.npy`` files
+next to this module and memory mapped on first use, so importing the engine
+costs nothing and forked workers share the pages. Regenerate them with
+
+    python tools/poker/evaluation/tables.py
+"""
+import itertools
+import os
+import sys
+from typing import Callable, Dict, Sequence
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(os.path.split(os.path.split(curPath)[0])[0])[0]
+sys.path.append(rootPath)
+
+import click
+import numpy as np
+
+from tools.poker.evaluation.eval_card import EvaluationCard
+from tools.poker.evaluation.lookup import LookupTable
+
+default_table_dir: str = curPath
+
+# _binomial[n, k] = n choose k, enough to index five of 52 cards and
+# multisets of seven of 13 ranks.
+_binomial = np.zeros((53, 8), dtype=np.int64)
+_binomial[:, 0] = 1
+for _n in range(1, 53):
+    _binomial[_n, 1:] = _binomial[_n - 1, 1:] + _binomial[_n - 1, :-1]
+
+_primes = np.array(EvaluationCard.PRIMES, dtype=np.int64)
+_worst = LookupTable.MAX_HIGH_CARD + 1
+
+
+def five_card_index(cards: np.ndarray) -> np.ndarray:
+    """Colex index of every row of an (n, 5) array of distinct cards."""
+    cards = np.sort(np.asarray(cards, dtype=np.int64), axis=1)
+    return sum(_binomial[cards[:, i], i + 1] for i in range(5))
+
+
+def multiset_index(ranks: np.ndarray) -> np.ndarray:
+    """Colex index of every row of an (n, 7) array of ranks."""
+    ranks = np.sort(np.asarray(ranks, dtype=np.int64), axis=1)
+    return sum(_binomial[ranks[:, i] + i, i + 1] for i in range(7))
+
+
+def _unsuited_ranks(table: LookupTable, ranks: np.ndarray) -> np.ndarray:
+    """Rank of every row of an (n, 5) array of ranks, ignoring flushes."""
+    prime = np.prod(_primes[ranks], axis=1)
+    index = np.searchsorted(table.unsuited_primes, prime)
+    return table.unsuited_ranks[index]
+
+
+def generate_five_card() -> np.ndarray:
+    """Rank of every five card hand, in colex order."""
+    table = LookupTable()
+    cards = np.array(list(itertools.combinations(range(52), 5)), dtype=np.int8)
+    ranks = (cards % 13).astype(np.int64)
+    suits = cards // 13
+    flush = (suits == suits[:, :1]).all(axis=1)
+    rankbits = np.bitwise_or.reduce(np.int64(1) << ranks, axis=1)
+    five_card = np.empty(len(cards), dtype=np.int16)
+    five_card[five_card_index(cards)] = np.where(
+        flush, table.flush_array[rankbits], _unsuited_ranks(table, ranks)
+    )
+    return five_card
+
+
+def generate_seven_card_flush() -> np.ndarray:
+    """Best flush of every 13 bit rank mask, worse than any hand if none."""
+    table = LookupTable()
+    popcount = np.array([bin(x).count("1") for x in range(1 << 13)])
+    flush = np.full(1 << 13, _worst, dtype=np.int16)
+    flush[popcount == 5] = table.flush_array[popcount == 5]
+    # The best flush of a mask is the best one of the masks with one rank less.
+    for n_ranks in range(6, 14):
+        masks = np.flatnonzero(popcount == n_ranks)
+        for rank in range(13):
+            bit = 1 << rank
+            has_bit = masks[masks & bit != 0]
+            flush[has_bit] = np.minimum(flush[has_bit], flush[has_bit ^ bit])
+    return flush
+
+
+def generate_seven_card_unsuited() -> np.ndarray:
+    """Best hand ignoring suits of every multiset of seven ranks."""
+    table = LookupTable()
+    ranks = np.array(
+        list(itertools.combinations_with_replacement(range(13), 7)), dtype=np.int64
+    )
+    counts = np.stack([(ranks == r).sum(axis=1) for r in range(13)], axis=1)
+    valid = counts.max(axis=1) <= 4
+    ranks = ranks[valid]
+    best = np.min(
+        [
+            _unsuited_ranks(table, ranks[:, list(five)])
+            for five in itertools.combinations(range(7), 5)
+        ],
+        axis=0,
+    )
+    unsuited = np.full(_binomial[19, 7], _worst, dtype=np.int16)
+    unsuited[multiset_index(ranks)] = best
+    return unsuited
+
+
+generators: Dict[str, Callable[[], np.ndarray]] = {
+    "five_card": generate_five_card,
+    "seven_card_flush": generate_seven_card_flush,
+    "seven_card_unsuited": generate_seven_card_unsuited,
+}
+
+_tables: Dict[str, np.ndarray] = {}
+
+
+def table_path(name: str, table_dir: str = default_table_dir) -> str:
+    """Return the path of the ``.npy`` file of the table `name`."""
+    return os.path.join(table_dir, f"{name}.npy")
+
+
+def save_table(name: str, table_dir: str = default_table_dir) -> str:
+    """Generate the table `name` and write it to `table_dir`."""
+    path = table_path(name, table_dir)
+    # Write under a temporary name first, so concurrent loaders never map a
+    # partially written file.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, generators[name]())
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_table(name: str, table_dir: str = default_table_dir) -> np.ndarray:
+    """Memory map the table `name`, generating and caching it if missing.
+
+    The result is cached, so only the first call per table reads the disk.
+    """
+    path = table_path(name, table_dir)
+    if path not in _tables:
+        if not os.path.isfile(path):
+            try:
+                save_table(name, table_dir)
+            except OSError:
+                # Read-only installs still work, the table is just kept in memory.
+                _tables[path] = generators[name]()
+                return _tables[path]
+        _tables[path] = np.load(path, mmap_mode="r")
+    return _tables[path]
+
+
+@click.command()
+@click.option("--table_dir", default=default_table_dir, help="where to write the tables.")
+@click.option(
+    "--name",
+    "names",
+    multiple=True,
+    type=click.Choice(list(generators)),
+    help="tables to generate, all of them by default.",
+)
+def cli(table_dir: str, names: Sequence[str]):
+    """Generate the hand rank tables."""
+    os.makedirs(table_dir, exist_ok=True)
+    for name in names or generators:
+        click.echo(save_table(name, table_dir))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,530 @@
+"""Suit-isomorphic indexing of hole card + board combinations.
+
+Two hands that only differ by a relabelling of the suits play identically, so
+any table keyed by (hole cards, board) only needs one entry per isomorphism
+class. `HandIndexer` maps every hand onto a dense index in
+``[0, indexer.size)`` and back again, following the construction of Waugh,
+"A Fast and Optimal Hand Isomorphism Algorithm" (2013).
+
+Cards are the integers produced by `EvaluationCard.str_to_int52`, i.e.
+``rank + 13 * suit`` with rank 0 (deuce) to 12 (ace). A hand is described by
+the number of cards dealt in each round, e.g. ``(2, 3)`` for hole cards plus
+flop. Cards within a round are unordered, cards in different rounds are not
+interchangeable.
+
+Besides the scalar `index`/`unindex`, `index_batch` and `unindex_batch` work
+on whole NumPy arrays of hands without looping over them in Python, which is
+what table builders and array-backed caches should use.
+"""
+from __future__ import annotations
+
+import bisect
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+N_SUITS = 4
+N_RANKS = 13
+
+_POPCOUNT: List[int] = [bin(x).count("1") for x in range(1 << N_RANKS)]
+_SMALL_BINOMIAL: List[List[int]] = [[1]]
+for _n in range(1, 64):
+    _row = _SMALL_BINOMIAL[-1]
+    _SMALL_BINOMIAL.append([1] + [_row[k - 1] + _row[k] for k in range(1, _n)] + [1])
+
+
+def _binomial(n: int, k: int) -> int:
+    """Return n choose k, zero outside of the triangle."""
+    if k < 0 or n < k:
+        return 0
+    if n < 64:
+        return _SMALL_BINOMIAL[n][k]
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
+
+
+def _popcount(x: int) -> int:
+    """Number of set bits of a rank mask."""
+    return _POPCOUNT[x & 0x1FFF]
+
+
+def _colex_rank(positions: Sequence[int]) -> int:
+    """Rank of a strictly increasing sequence in colexicographical order."""
+    return sum(_binomial(p, i + 1) for i, p in enumerate(positions))
+
+
+def _colex_unrank(rank: int, k: int) -> List[int]:
+    """Inverse of `_colex_rank` for sequences of length k."""
+    positions = [0] * k
+    for i in range(k, 0, -1):
+        if i == 1:
+            p = rank
+        else:
+            # Largest p with C(p, i) <= rank, found by doubling then bisection.
+            low, high = i - 1, i
+            while _binomial(high, i) <= rank:
+                low, high = high, 2 * high
+            while high - low > 1:
+                middle = (low + high) // 2
+                if _binomial(middle, i) <= rank:
+                    low = middle
+                else:
+                    high = middle
+            p = low
+        rank -= _binomial(p, i)
+        positions[i - 1] = p
+    return positions
+
+
+def _binomial_array(n: np.ndarray, k: np.ndarray) -> np.ndarray:
+    """Element-wise n choose k for small k, zero outside of the triangle."""
+    n = np.asarray(n, dtype=np.int64)
+    k = np.asarray(k, dtype=np.int64)
+    result = np.ones(np.broadcast(n, k).shape, dtype=np.int64)
+    for i in range(int(k.max(initial=0))):
+        # C(n, i + 1) = C(n, i) * (n - i) / (i + 1) is always an integer.
+        result = np.where(i < k, result * (n - i) // (i + 1), result)
+    return np.where((k < 0) | (n < k), 0, result)
+
+
+_POPCOUNT_ARRAY = np.array(_POPCOUNT, dtype=np.int64)
+_BINOMIAL_ARRAY = np.zeros((N_RANKS + 1, N_RANKS + 1), dtype=np.int64)
+for _n in range(N_RANKS + 1):
+    _BINOMIAL_ARRAY[_n, : _n + 1] = _SMALL_BINOMIAL[_n]
+# _SELECT[used, p] is the p-th rank (ascending) that is not set in used.
+_SELECT = np.full((1 << N_RANKS, N_RANKS), -1, dtype=np.int64)
+for _used in range(1 << N_RANKS):
+    _available = [rank for rank in range(N_RANKS) if not _used >> rank & 1]
+    _SELECT[_used, : len(_available)] = _available
+
+
+class HandIndexer:
+    """Perfect hash between suit-isomorphic hands and ``range(size)``.
+
+    Parameters
+    ----------
+    cards_per_round : sequence of int
+        The number of cards dealt in each round, for example ``(2, 3)`` to
+        index hole cards together with the flop.
+    """
+
+    def __init__(self, cards_per_round: Sequence[int]):
+        """Enumerate the suit configurations and their index offsets."""
+        self.cards_per_round: Tuple[int, ...] = tuple(cards_per_round)
+        self.n_rounds = len(self.cards_per_round)
+        self.n_cards = sum(self.cards_per_round)
+        if self.n_rounds == 0 or self.n_cards > N_SUITS * N_RANKS:
+            raise ValueError(f"Invalid cards_per_round: {cards_per_round}")
+        # A configuration lists, for each suit in canonical (ascending) order,
+        # how many cards of that suit were dealt in each round.
+        self._configurations: List[Tuple[Tuple[int, ...], ...]] = []
+        self._enumerate_configurations(
+            list(self.cards_per_round), [], tuple([0] * self.n_rounds)
+        )
+        self._configuration_id: Dict[Tuple[Tuple[int, ...], ...], int] = {
+            configuration: i for i, configuration in enumerate(self._configurations)
+        }
+        # For every configuration, the runs of identical suit count vectors
+        # as (first suit position, number of suits, indices per suit) and the
+        # size of each run's multiset space.
+        self._groups: List[List[Tuple[int, int, int]]] = []
+        self._group_sizes: List[List[int]] = []
+        self._offsets: List[int] = [0]
+        for configuration in self._configurations:
+            groups, sizes = [], []
+            start = 0
+            while start < N_SUITS:
+                stop = start
+                while stop < N_SUITS and configuration[stop] == configuration[start]:
+                    stop += 1
+                n_suit_indices = self._suit_size(configuration[start])
+                groups.append((start, stop - start, n_suit_indices))
+                sizes.append(_binomial(n_suit_indices + stop - start - 1, stop - start))
+                start = stop
+            self._groups.append(groups)
+            self._group_sizes.append(sizes)
+            configuration_size = 1
+            for size in sizes:
+                configuration_size *= size
+            self._offsets.append(self._offsets[-1] + configuration_size)
+        self._batch_tables: Optional[Dict[str, np.ndarray]] = None
+
+    def __repr__(self):
+        """Return a helpful description of object in strings and debugger."""
+        return f"<HandIndexer cards_per_round={self.cards_per_round} size={self.size}>"
+
+    @property
+    def size(self) -> int:
+        """Number of isomorphism classes, i.e. one more than the last index."""
+        return self._offsets[-1]
+
+    def _enumerate_configurations(
+        self,
+        remaining: List[int],
+        suits: List[Tuple[int, ...]],
+        minimum: Tuple[int, ...],
+    ):
+        """Recursively list the non-decreasing suit count vectors."""
+        if len(suits) == N_SUITS:
+            if not any(remaining):
+                self._configurations.append(tuple(suits))
+            return
+        for vector in self._vectors_from(minimum, remaining):
+            for r, n in enumerate(vector):
+                remaining[r] -= n
+            self._enumerate_configurations(remaining, suits + [vector], vector)
+            for r, n in enumerate(vector):
+                remaining[r] += n
+
+    def _vectors_from(self, minimum: Tuple[int, ...], remaining: List[int]):
+        """Yield the count vectors >= `minimum` that fit in `remaining`."""
+        vectors = [()]
+        for r in range(self.n_rounds):
+            vectors = [v + (n,) for v in vectors for n in range(remaining[r] + 1)]
+        for vector in vectors:
+            if vector >= minimum and sum(vector) <= N_RANKS:
+                yield vector
+
+    def _suit_size(self, vector: Tuple[int, ...]) -> int:
+        """Number of distinct rank patterns for one suit with these counts."""
+        size, used = 1, 0
+        for n in vector:
+            size *= _binomial(N_RANKS - used, n)
+            used += n
+        return size
+
+    def _suit_index(self, vector: Tuple[int, ...], masks: Sequence[int]) -> int:
+        """Index the per round rank masks of a single suit."""
+        index, used = 0, 0
+        for n, mask in zip(vector, masks):
+            positions = []
+            remaining = mask
+            while remaining:
+                lowest = remaining & -remaining
+                positions.append(_popcount(~used & (lowest - 1)))
+                remaining ^= lowest
+            index = index * _binomial(N_RANKS - _popcount(used), n) + _colex_rank(
+                positions
+            )
+            used |= mask
+        return index
+
+    def _suit_unindex(self, vector: Tuple[int, ...], index: int) -> List[int]:
+        """Inverse of `_suit_index`, returns the per round rank masks."""
+        radices, used_count = [], 0
+        for n in vector:
+            radices.append(_binomial(N_RANKS - used_count, n))
+            used_count += n
+        digits = [0] * self.n_rounds
+        for r in range(self.n_rounds - 1, -1, -1):
+            index, digits[r] = divmod(index, radices[r])
+        masks, used = [], 0
+        for n, digit in zip(vector, digits):
+            available = [rank for rank in range(N_RANKS) if not used >> rank & 1]
+            mask = 0
+            for position in _colex_unrank(digit, n):
+                mask |= 1 << available[position]
+            masks.append(mask)
+            used |= mask
+        return masks
+
+    def _split(self, cards: Sequence[int]) -> List[List[int]]:
+        """Return the rank masks indexed as [suit][round]."""
+        if len(cards) != self.n_cards:
+            raise ValueError(
+                f"Expected {self.n_cards} cards but {len(cards)} were provided."
+            )
+        masks = [[0] * self.n_rounds for _ in range(N_SUITS)]
+        i = 0
+        for r, n in enumerate(self.cards_per_round):
+            for card in cards[i : i + n]:
+                suit, rank = divmod(int(card), N_RANKS)
+                if masks[suit][r] >> rank & 1:
+                    raise ValueError(f"Duplicate card in {list(cards)}")
+                masks[suit][r] |= 1 << rank
+            i += n
+        return masks
+
+    def index(self, cards: Sequence[int]) -> int:
+        """Return the index of the isomorphism class of `cards`.
+
+        Parameters
+        ----------
+        cards : sequence of int
+            Cards in `EvaluationCard.str_to_int52` form, ordered by round
+            (hole cards first, then the board).
+
+        Returns
+        -------
+        index : int
+            An integer in ``[0, self.size)``.
+        """
+        masks = self._split(cards)
+        suits = []
+        for suit_masks in masks:
+            vector = tuple(_popcount(mask) for mask in suit_masks)
+            suits.append((vector, self._suit_index(vector, suit_masks)))
+        suits.sort()
+        configuration_i = self._configuration_id[tuple(vector for vector, _ in suits)]
+        index = 0
+        for (start, n_suits, _), size in zip(
+            self._groups[configuration_i], self._group_sizes[configuration_i]
+        ):
+            multiset = _colex_rank(
+                [suits[start + j][1] + j for j in range(n_suits)]
+            )
+            index = index * size + multiset
+        return self._offsets[configuration_i] + index
+
+    def unindex(self, index: int) -> List[int]:
+        """Return the canonical representative of the class with `index`.
+
+        The canonical hand assigns suits in the order of the configuration,
+        and lists the cards of each round in ascending order.
+        """
+        if not 0 <= index < self.size:
+            raise ValueError(f"Index {index} is out of range [0, {self.size}).")
+        configuration_i = bisect.bisect_right(self._offsets, index) - 1
+        configuration = self._configurations[configuration_i]
+        index -= self._offsets[configuration_i]
+        multisets = []
+        for size in reversed(self._group_sizes[configuration_i]):
+            index, multiset = divmod(index, size)
+            multisets.append(multiset)
+        multisets.reverse()
+        rounds: List[List[int]] = [[] for _ in range(self.n_rounds)]
+        for (start, n_suits, _), multiset in zip(
+            self._groups[configuration_i], multisets
+        ):
+            positions = _colex_unrank(multiset, n_suits)
+            for j, position in enumerate(positions):
+                suit = start + j
+                masks = self._suit_unindex(configuration[suit], position - j)
+                for r, mask in enumerate(masks):
+                    rounds[r].extend(
+                        rank + N_RANKS * suit
+                        for rank in range(N_RANKS)
+                        if mask >> rank & 1
+                    )
+        return [card for cards in rounds for card in sorted(cards)]
+
+    def _get_batch_tables(self) -> Dict[str, np.ndarray]:
+        """Lazily build the per configuration arrays used by the batch API."""
+        if self._batch_tables is not None:
+            return self._batch_tables
+        radix = [n + 1 for n in self.cards_per_round]
+        n_codes = int(np.prod(radix))
+
+        def encode(vector):
+            code = 0
+            for n, base in zip(vector, radix):
+                code = code * base + n
+            return code
+
+        n_configurations = len(self._configurations)
+        keys = np.zeros(n_configurations, dtype=np.int64)
+        counts = np.zeros((n_configurations, N_SUITS, self.n_rounds), dtype=np.int64)
+        # Per suit position: rank within its group, size of its group, and
+        # the stride and size of its group in the mixed radix index.
+        rank_in_group = np.zeros((n_configurations, N_SUITS), dtype=np.int64)
+        group_k = np.zeros((n_configurations, N_SUITS), dtype=np.int64)
+        stride = np.zeros((n_configurations, N_SUITS), dtype=np.int64)
+        group_size = np.zeros((n_configurations, N_SUITS), dtype=np.int64)
+        max_multiset_n = np.zeros(N_SUITS + 1, dtype=np.int64)
+        for i, configuration in enumerate(self._configurations):
+            key = 0
+            for vector in configuration:
+                key = key * n_codes + encode(vector)
+            keys[i] = key
+            counts[i] = configuration
+            group_stride = 1
+            for (start, n_suits, n_suit_indices), size in reversed(
+                list(zip(self._groups[i], self._group_sizes[i]))
+            ):
+                for j in range(n_suits):
+                    rank_in_group[i, start + j] = j
+                    group_k[i, start + j] = n_suits
+                    stride[i, start + j] = group_stride
+                    group_size[i, start + j] = size
+                max_multiset_n[n_suits] = max(
+                    max_multiset_n[n_suits], n_suit_indices + n_suits
+                )
+                group_stride *= size
+        order = np.argsort(keys)
+        # binomials[k][b] = C(b, k) for the colex unranking of suit multisets,
+        # only needed for k >= 2 where the number of suit indices is small.
+        binomials = {
+            k: _binomial_array(np.arange(max_multiset_n[k:].max() + 1), k)
+            for k in range(2, N_SUITS + 1)
+        }
+        self._batch_tables = dict(
+            radix=np.array(radix, dtype=np.int64),
+            n_codes=np.int64(n_codes),
+            sorted_keys=keys[order],
+            sorted_ids=order.astype(np.int64),
+            offsets=np.array(self._offsets, dtype=np.int64),
+            counts=counts,
+            rank_in_group=rank_in_group,
+            group_k=group_k,
+            stride=stride,
+            group_size=group_size,
+            binomials=binomials,
+        )
+        return self._batch_tables
+
+    def index_batch(self, cards: np.ndarray) -> np.ndarray:
+        """Vectorised `index` over the rows of an array.
+
+        Parameters
+        ----------
+        cards : np.ndarray
+            Integer array of shape (n_hands, n_cards), each row ordered like
+            the argument of `index`. Rows are not checked for duplicates.
+
+        Returns
+        -------
+        indices : np.ndarray
+            int64 array of shape (n_hands,).
+        """
+        tables = self._get_batch_tables()
+        cards = np.asarray(cards, dtype=np.int64)
+        if cards.ndim != 2 or cards.shape[1] != self.n_cards:
+            raise ValueError(
+                f"Expected an array of shape (n, {self.n_cards}) but got "
+                f"{cards.shape}."
+            )
+        n_hands = len(cards)
+        rows = np.arange(n_hands)
+        suits, ranks = np.divmod(cards, N_RANKS)
+        masks = np.zeros((n_hands, N_SUITS, self.n_rounds), dtype=np.int64)
+        column = 0
+        for r, n in enumerate(self.cards_per_round):
+            for _ in range(n):
+                masks[rows, suits[:, column], r] |= 1 << ranks[:, column]
+                column += 1
+        counts = _POPCOUNT_ARRAY[masks]
+        # Rank the per round masks of every suit like `_suit_index`.
+        codes = np.zeros((n_hands, N_SUITS), dtype=np.int64)
+        suit_indices = np.zeros((n_hands, N_SUITS), dtype=np.int64)
+        used = np.zeros((n_hands, N_SUITS), dtype=np.int64)
+        for r in range(self.n_rounds):
+            mask = masks[:, :, r]
+            digit = np.zeros_like(mask)
+            seen = np.zeros_like(mask)
+            for rank in range(N_RANKS):
+                bit = mask >> rank & 1
+                position = _POPCOUNT_ARRAY[~used & ((1 << rank) - 1) & 0x1FFF]
+                digit += bit * _BINOMIAL_ARRAY[position, np.minimum(seen + 1, N_RANKS)]
+                seen += bit
+            n_available = N_RANKS - _POPCOUNT_ARRAY[used]
+            suit_indices = suit_indices * _BINOMIAL_ARRAY[n_available, counts[:, :, r]]
+            suit_indices += digit
+            codes = codes * tables["radix"][r] + counts[:, :, r]
+            used |= mask
+        # Canonical suit order: by count vector, then by suit index.
+        sort_keys = np.sort((codes << 32) | suit_indices, axis=1)
+        codes, suit_indices = sort_keys >> 32, sort_keys & 0xFFFFFFFF
+        configuration_keys = np.zeros(n_hands, dtype=np.int64)
+        for suit in range(N_SUITS):
+            configuration_keys = configuration_keys * tables["n_codes"] + codes[:, suit]
+        configuration_i = tables["sorted_ids"][
+            np.searchsorted(tables["sorted_keys"], configuration_keys)
+        ]
+        j = tables["rank_in_group"][configuration_i]
+        multisets = _binomial_array(suit_indices + j, j + 1)
+        indices = tables["offsets"][configuration_i]
+        indices += (multisets * tables["stride"][configuration_i]).sum(axis=1)
+        return indices
+
+    def unindex_batch(self, indices: np.ndarray) -> np.ndarray:
+        """Vectorised `unindex`, returns an int64 array (n_hands, n_cards)."""
+        tables = self._get_batch_tables()
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.ndim != 1:
+            raise ValueError("Expected a one dimensional array of indices.")
+        if len(indices) and (indices.min() < 0 or indices.max() >= self.size):
+            raise ValueError(f"Indices are out of range [0, {self.size}).")
+        n_hands = len(indices)
+        configuration_i = np.searchsorted(tables["offsets"], indices, side="right") - 1
+        remainder = indices - tables["offsets"][configuration_i]
+        multisets = (
+            remainder[:, None] // tables["stride"][configuration_i]
+            % tables["group_size"][configuration_i]
+        )
+        group_k = tables["group_k"][configuration_i]
+        j = tables["rank_in_group"][configuration_i]
+        # Colex unrank each group's multiset and keep this suit's element.
+        suit_indices = np.zeros((n_hands, N_SUITS), dtype=np.int64)
+        for i in range(N_SUITS, 0, -1):
+            active = i <= group_k
+            if i == 1:
+                position = multisets
+            else:
+                binomials = tables["binomials"][i]
+                clipped = np.where(active, multisets, 0)
+                position = np.searchsorted(binomials, clipped, side="right") - 1
+            position = np.where(active, position, 0)
+            if i > 1:
+                multisets = multisets - np.where(
+                    active, tables["binomials"][i][position], 0
+                )
+            suit_indices = np.where(j == i - 1, position - j, suit_indices)
+        # Split every suit index into per round digits like `_suit_unindex`.
+        counts = tables["counts"][configuration_i]
+        radices = np.zeros_like(counts)
+        used_count = np.zeros((n_hands, N_SUITS), dtype=np.int64)
+        for r in range(self.n_rounds):
+            radices[:, :, r] = _BINOMIAL_ARRAY[N_RANKS - used_count, counts[:, :, r]]
+            used_count += counts[:, :, r]
+        digits = np.zeros_like(counts)
+        for r in range(self.n_rounds - 1, -1, -1):
+            suit_indices, digits[:, :, r] = np.divmod(suit_indices, radices[:, :, r])
+        cards = np.zeros((n_hands, self.n_cards), dtype=np.int64)
+        used = np.zeros((n_hands, N_SUITS), dtype=np.int64)
+        column = 0
+        for r, n in enumerate(self.cards_per_round):
+            round_masks = np.zeros((n_hands, N_SUITS), dtype=np.int64)
+            digit = digits[:, :, r]
+            for i in range(max(n, 1), 0, -1):
+                active = i <= counts[:, :, r]
+                position = (
+                    np.searchsorted(_BINOMIAL_ARRAY[:, i], digit, side="right") - 1
+                )
+                position = np.where(active, np.minimum(position, N_RANKS - 1), 0)
+                digit = digit - np.where(active, _BINOMIAL_ARRAY[position, i], 0)
+                rank = _SELECT[used, position]
+                round_masks |= np.where(active, 1 << np.maximum(rank, 0), 0)
+            used |= round_masks
+            # Lay the suits out as a 52 bit mask and read the cards back in
+            # ascending order.
+            cards_mask = np.zeros(n_hands, dtype=np.int64)
+            for suit in range(N_SUITS):
+                cards_mask |= round_masks[:, suit] << (N_RANKS * suit)
+            for _ in range(n):
+                lowest = cards_mask & -cards_mask
+                cards[:, column] = np.log2(lowest.astype(np.float64)).astype(np.int64)
+                cards_mask ^= lowest
+                column += 1
+        return cards
+
+
+street_to_cards_per_round: Dict[str, Tuple[int, ...]] = {
+    "pre_flop": (2,),
+    "flop": (2, 3),
+    "turn": (2, 3, 1),
+    "river": (2, 3, 1, 1),
+}
+_street_indexers: Dict[str, HandIndexer] = {}
+
+
+def get_street_indexer(street: str) -> HandIndexer:
+    """Return the cached indexer of a betting stage of `PokerState`.
+
+    Each street is its own round, so e.g. the turn card is distinguished from
+    the flop cards. The pre flop indexer has the 169 canonical starting hands.
+    """
+    if street not in _street_indexers:
+        _street_indexers[street] = HandIndexer(street_to_cards_per_round[street])
+    return _street_indexers[street]
@@ -0,0 +1,143 @@
+"""Integer keys of information sets.
+
+`PokerState.info_set` is a JSON string such as ``[[[12,"l","e"]],[[30,"l"]]]``,
+the bucket of every dealt street followed by the last character of each
+action of that street. The same information packs into an int, written here
+as hex digits:
+
+    1 | bucket (2 digits) | one digit per action | f | bucket | actions | f ...
+
+The leading 1 keeps leading zero buckets significant, actions are the codes
+1-8 of `action_to_code` (the `Action` id plus one) and f ends every street
+but the current one. Keys are extended one action or street at a time, so
+states keep them up to date instead of rebuilding the string, and they hash
+and compare much faster.
+"""
+import json
+from typing import Dict, List, Mapping, Sequence, Tuple, TypeVar
+
+from tools.poker.actions import Action
+
+V = TypeVar("V")
+
+# Codes start at 1 so that an action is never written as a 0 digit.
+action_to_code: Dict[str, int] = {action.name: action + 1 for action in Action}
+# Character of the action in info set strings, `action_str[-1]`.
+token_to_code: Dict[str, int] = {
+    action[-1]: code for action, code in action_to_code.items()
+}
+code_to_token: Dict[int, str] = {code: token for token, code in token_to_code.items()}
+
+street_end = 0xF
+max_bucket = 0xFF
+# Fixed width of keys stored in arrays and files, 64 hex digits. Every raise
+# needs chips, so histories are bounded: the longest key of a game with the
+# stacks of `new_game` has 46 digits, see `tools/poker/state_test.py`.
+key_bytes = 32
+
+
+def new_key(bucket: int) -> int:
+    """Key of a player that has been dealt the pre flop bucket `bucket`."""
+    if not 0 <= bucket <= max_bucket:
+        raise ValueError(f"Bucket {bucket} does not fit in 8 bits.")
+    return 1 << 8 | bucket
+
+
+def append_action(key: int, action: str) -> int:
+    """Key after `action` has been made on the current street."""
+    return key << 4 | action_to_code[action]
+
+
+def append_street(key: int, bucket: int) -> int:
+    """Key after a new street has been dealt with bucket `bucket`."""
+    if not 0 <= bucket <= max_bucket:
+        raise ValueError(f"Bucket {bucket} does not fit in 8 bits.")
+    return (key << 4 | street_end) << 8 | bucket
+
+
+def history_to_key(buckets: Sequence[int], histories: Sequence[Sequence[str]]) -> int:
+    """Key of the info set with the bucket of every dealt street and the
+    names of the actions made on it, e.g. ``[12, 30], [["call", "raiseh"], []]``."""
+    if not buckets or len(buckets) != len(histories):
+        raise ValueError("Every dealt street needs a bucket and an action history.")
+    key = None
+    for bucket, history in zip(buckets, histories):
+        key = new_key(bucket) if key is None else append_street(key, bucket)
+        for action in history:
+            key = append_action(key, action)
+    return key
+
+
+def key_to_history(key: int) -> Tuple[List[int], List[List[str]]]:
+    """Buckets and action histories of the streets of a key, see `history_to_key`."""
+    digits = format(key, "x")
+    if digits[0] != "1":
+        raise ValueError(f"{key} is not an info set key.")
+    buckets: List[int] = []
+    histories: List[List[str]] = []
+    i = 1
+    while i < len(digits):
+        buckets.append(int(digits[i : i + 2], 16))
+        histories.append([])
+        i += 2
+        while i < len(digits) and digits[i] != "f":
+            histories[-1].append(Action(int(digits[i], 16) - 1).name)
+            i += 1
+        # Skip the end of street marker.
+        i += 1
+    return buckets, histories
+
+
+def key_to_str(key: int) -> str:
+    """Convert a key to the `PokerState.info_set` string."""
+    digits = format(key, "x")
+    if digits[0] != "1":
+        raise ValueError(f"{key} is not an info set key.")
+    streets: List[list] = []
+    i = 1
+    while i < len(digits):
+        street = [int(digits[i : i + 2], 16)]
+        i += 2
+        while i < len(digits) and digits[i] != "f":
+            street.append(code_to_token[int(digits[i], 16)])
+            i += 1
+        # Skip the end of street marker.
+        i += 1
+        streets.append([street])
+    return json.dumps(streets, separators=(",", ":"))
+
+
+def str_to_key(info_set: str) -> int:
+    """Convert a `PokerState.info_set` string to a key."""
+    key = None
+    for (street,) in json.loads(info_set):
+        bucket, tokens = street[0], street[1:]
+        key = new_key(bucket) if key is None else append_street(key, bucket)
+        for token in tokens:
+            key = key << 4 | token_to_code[token]
+    if key is None:
+        raise ValueError(f"{info_set} has no dealt street.")
+    return key
+
+
+def key_to_bytes(key: int) -> bytes:
+    """Fixed width big endian bytes of a key, which sort like the keys."""
+    try:
+        return key.to_bytes(key_bytes, "big")
+    except OverflowError:
+        raise ValueError(f"Info set key {key:x} is longer than {key_bytes} bytes.")
+
+
+def bytes_to_key(data: bytes) -> int:
+    """Key of `key_to_bytes` output, also if NumPy stripped its trailing zeros."""
+    return int.from_bytes(data.ljust(key_bytes, b"\0"), "big")
+
+
+def keys_to_str(table: Mapping[int, V]) -> Dict[str, V]:
+    """Re-key a table by info set strings, e.g. to write it to a file."""
+    return {key_to_str(key): value for key, value in table.items()}
+
+
+def str_to_keys(table: Mapping[str, V]) -> Dict[int, V]:
+    """Re-key a table read from a file by integer keys."""
+    return {str_to_key(info_set): value for info_set, value in table.items()}
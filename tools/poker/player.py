@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import uuid
 from typing import List, TYPE_CHECKING
 
 
@@ -37,6 +36,19 @@ class Player:
     of all players' contributions.
     """
 
+    __slots__ = (
+        "initial_chips",
+        "n_chips",
+        "cards",
+        "id",
+        "pot",
+        "is_small_blind",
+        "is_big_blind",
+        "is_dealer",
+        "active",
+        "clusters",
+    )
+
     def __init__(self, id: int, initial_chips: int, pot: Pot):
         """Instanciate a player."""
         self.initial_chips = initial_chips
@@ -57,8 +69,8 @@ class Player:
 
     def __repr__(self):
         """"""
-        return '<Player name="{}" n_chips={:05d} n_bet_chips={:05d} >'.format(
-                self.name,
+        return '<Player id="{}" n_chips={:05d} n_bet_chips={:05d} >'.format(
+                self.id,
                 self.n_chips,
                 self.n_bet_chips)
 
@@ -1,18 +1,23 @@
 from __future__ import annotations
 
-import collections
-import uuid
+from typing import Dict, Tuple
 
 from tools.poker.player import Player
 # from numba import jitclass,int32, deferred_type, boolean,int16,types
 
 class Pot:
-    """"""
+    """The chips put into the pot by every player.
+
+    The total is kept up to date as chips are added, so reading it does not
+    sum the contributions.
+    """
+
+    __slots__ = ("_pot", "_total")
 
     def __init__(self):
         """"""
-        self._pot = collections.Counter()
-        self._uid = str(uuid.uuid4().hex)
+        self._pot: Dict[Player, int] = {}
+        self._total = 0
 
     def __repr__(self):
         """Nicer way to print a Pot object."""
@@ -23,22 +28,27 @@ class Pot:
         if not isinstance(player, Player):
             raise ValueError(
                 f'Index the pot with the player to get the contribution.')
-        return self._pot[player]
+        return self._pot.get(player, 0)
 
     def add_chips(self, player: Player, n_chips: int):
         """Add chips to the pot, from a player for a given round."""
-        self._pot[player] += n_chips
+        self._pot[player] = self._pot.get(player, 0) + n_chips
+        self._total += n_chips
 
     def reset(self):
         """Reset the pot."""
-        self._pot = collections.Counter()
+        self._pot = {}
+        self._total = 0
 
-    @property
-    def uid(self):
-        """Get a unique identifier for this pot."""
-        return self._uid
+    def snapshot(self) -> Tuple[Dict[Player, int], int]:
+        """Copy of the contributions, to be given back to `restore`."""
+        return self._pot.copy(), self._total
+
+    def restore(self, snapshot: Tuple[Dict[Player, int], int]):
+        """Go back to the contributions of a `snapshot`."""
+        self._pot, self._total = snapshot
 
     @property
     def total(self):
         """Return the total in the pot from all players."""
-        return sum(self._pot.values())
+        return self._total
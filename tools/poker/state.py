@@ -6,9 +6,12 @@ import os
 from typing import Dict, List, Optional, Tuple
 import math
 import dill as pickle
+import numpy as np
 
 from tools import utils
 from tools.poker.card import Card
+from tools.poker import info_set
+from tools.poker.actions import Action, action_names, legal_action_ids, to_mask
 from tools.poker.engine import PokerEngine
 from tools.poker.player import Player
 from tools.poker.pot import Pot
@@ -17,6 +20,7 @@ from tools.poker.table import PokerTable
 # logger = logging.getLogger("tools.games.short_deck.state")
 InfoSetLookupTable = Dict[str, Dict[Tuple[int, ...], str]]
 import tools.EHS_based_v2.EHS_based_bucket as EHS_based_bucket
+import tools.EHS_based_v2.bucket_table as bucket_table
 
 
 def load_pickle_files(pickle_dir: str) -> Dict[str, Dict[Tuple[int, ...], str]]:
@@ -53,7 +57,11 @@ def load_pickle_files(pickle_dir: str) -> Dict[str, Dict[Tuple[int, ...], str]]:
 def new_game(
     n_players: int, info_set_luts: InfoSetLookupTable = {}, **kwargs
 ) -> PokerState:
-    """Create a new game of short deck poker."""
+    """Create a new game of short deck poker.
+
+    Keyword arguments go to `PokerState`, e.g. ``rng`` to deal the cards
+    from a generator of its own instead of the global random state.
+    """
     pot = Pot()
     players = [
         Player(id=player_i, initial_chips=10000, pot=pot)
@@ -75,6 +83,10 @@ class PokerState:
 
     The class is immutable and new state can be instanciated from once an
     action is applied via the `ShortDeckPokerState.new_state` method.
+
+    For tree traversals `apply_action(action, inplace=True)` mutates the
+    state instead of copying it and records an undo entry, `undo_action`
+    restores the state as it was before the last in-place action.
     """
 
     def __init__(
@@ -82,6 +94,7 @@ class PokerState:
         players: List[PokerState],
         small_blind: int = 50,
         big_blind: int = 100,
+        rng: Optional[np.random.Generator] = None,
         # pickle_dir: str = "../clustering/data",
         # load_pickle_files: bool = True,
     ):
@@ -98,7 +111,10 @@ class PokerState:
         #     self.info_set_lut = {}
         # Get a reference of the pot from the first player.
         self._table = PokerTable(
-            players=players, pot=players[0].pot, include_ranks=[2,3,4,5,6,7,8,9,10, 11, 12, 13, 14]
+            players=players,
+            pot=players[0].pot,
+            include_ranks=[2,3,4,5,6,7,8,9,10, 11, 12, 13, 14],
+            rng=rng,
         )
         # Get a reference of the initial number of chips for the payout.
         self._initial_n_chips = players[0].n_chips
@@ -113,7 +129,11 @@ class PokerState:
         # Deal private cards to players.
         self._table.dealer.deal_private_cards(self._table.players)
         for player in self._table.players:
-            player.clusters.append(EHS_based_bucket.lossless([player.cards[1].card_char, player.cards[0].card_char]))
+            player.clusters.append(EHS_based_bucket.lossless_int52(player.cards[1].eval_card, player.cards[0].eval_card))
+        # Integer info set key of every player, see `info_set_key`.
+        self._info_set_keys: List[int] = [
+            info_set.new_key(player.clusters[0]) for player in self._table.players
+        ]
         # Store the actions as they come in here.
         self._history: List[List[str]] = [[],[],[],[]]
         self._betting_stage = "pre_flop"
@@ -148,12 +168,15 @@ class PokerState:
         # self.current_player.is_turn = True
         self.last_raise = 0
         self.has_allin = False
+        self._undo_stack: List[tuple] = []
+        # (ids, mask, names) of the legal actions, see `legal_actions`.
+        self._legal_actions: Optional[tuple] = None
 
     def __repr__(self):
         """Return a helpful description of object in strings and debugger."""
         return f"<PokerState player_i={self.player_i} betting_stage={self._betting_stage}>"
     # @jit(nopython=True)
-    def apply_action(self, action_str: Optional[str]) -> PokerState:
+    def apply_action(self, action_str: Optional[str], inplace: bool = False) -> PokerState:
         """Create a new state after applying an action.
 
         Parameters
@@ -162,12 +185,16 @@ class PokerState:
             The description of the action the current player is making. Can be
             any of {"fold, "call", "raise"}, the latter two only being possible
             if the agent hasn't folded already.
+        inplace : bool
+            If true, apply the action to this state and record an undo entry
+            for `undo_action` instead of copying the state.
 
         Returns
         -------
         new_state : ShortDeckPokerState
             A poker state instance that represents the game in the next
-            timestep, after the action has been applied.
+            timestep, after the action has been applied. This state itself
+            if `inplace` is true.
         """
         if action_str not in self.legal_actions:
             raise Exception('the action is invalid')
@@ -178,11 +205,22 @@ class PokerState:
         # from state to state.
         # lut = self.info_set_lut
         # self.info_set_lut = {}
-        new_state = copy.deepcopy(self)
+        if inplace:
+            self._undo_stack.append(self._undo_entry())
+            new_state = self
+        else:
+            # The undo entries belong to this state only, don't copy them.
+            undo_stack, self._undo_stack = self._undo_stack, []
+            new_state = copy.deepcopy(self)
+            self._undo_stack = undo_stack
+        new_state._legal_actions = None
         # new_state.info_set_lut = self.info_set_lut = lut
         # An action has been made, so alas we are not in the first move of the
         # current betting round.
         new_state._history[new_state._betting_stage_to_round[new_state.betting_stage]].append(str(action_str[-1]))
+        new_state._info_set_keys = [
+            info_set.append_action(key, action_str) for key in new_state._info_set_keys
+        ]
         if action_str is None:
             # Assert active player has folded already.
             assert (
@@ -263,6 +301,55 @@ class PokerState:
         new_state._first_move_of_current_round = False
         return new_state
 
+    def undo_action(self):
+        """Restore the state from before the last in-place `apply_action`."""
+        if not self._undo_stack:
+            raise ValueError("There is no in-place action to undo.")
+        (
+            self._betting_stage,
+            self._player_i_index,
+            self._n_raises,
+            self.last_raise,
+            self.has_allin,
+            self._first_move_of_current_round,
+            self._all_players_have_made_action,
+            history_round,
+            self._info_set_keys,
+            self._legal_actions,
+            players,
+            pot,
+            n_community_cards,
+            cards_in_deck,
+        ) = self._undo_stack.pop()
+        self._history[history_round].pop()
+        for player, (n_chips, active, n_clusters) in zip(self._table.players, players):
+            player.n_chips = n_chips
+            player.active = active
+            del player.clusters[n_clusters:]
+        self._table.pot.restore(pot)
+        if len(self._table.community_cards) != n_community_cards:
+            del self._table.community_cards[n_community_cards:]
+            self._table.dealer.deck._cards_in_deck = cards_in_deck
+
+    def _undo_entry(self) -> tuple:
+        """Everything an action can change, see `undo_action`."""
+        return (
+            self._betting_stage,
+            self._player_i_index,
+            self._n_raises,
+            self.last_raise,
+            self.has_allin,
+            self._first_move_of_current_round,
+            self._all_players_have_made_action,
+            self._betting_stage_to_round[self._betting_stage],
+            self._info_set_keys,
+            self._legal_actions,
+            [(p.n_chips, p.active, len(p.clusters)) for p in self._table.players],
+            self._table.pot.snapshot(),
+            len(self._table.community_cards),
+            list(self._table.dealer.deck._cards_in_deck),
+        )
+
     def _move_to_next_player(self):
         """Ensure state points to next valid active player."""
         self._player_i_index ^= 1
@@ -289,25 +376,19 @@ class PokerState:
             self._betting_stage = "flop"
             self._poker_engine.table.dealer.deal_flop(self._table)
             co_cards = [card.card_char for card in self._table.community_cards[:3]]
-            for player in self._table.players:
-                player.clusters.append(
-                    EHS_based_bucket.lossy_single(co_cards, [player.cards[1].card_char, player.cards[0].card_char]))
+            self._deal_clusters(co_cards)
         elif self._betting_stage == "flop":
             # Progress from flop to turn.
             self._betting_stage = "turn"
             self._poker_engine.table.dealer.deal_turn(self._table)
             co_cards = [card.card_char for card in self._table.community_cards[:4]]
-            for player in self._table.players:
-                player.clusters.append(
-                    EHS_based_bucket.lossy_single(co_cards, [player.cards[1].card_char, player.cards[0].card_char]))
+            self._deal_clusters(co_cards)
         elif self._betting_stage == "turn":
             # Progress from turn to river.
             self._betting_stage = "river"
             self._poker_engine.table.dealer.deal_river(self._table)
             co_cards = [card.card_char for card in self._table.community_cards[:5]]
-            for player in self._table.players:
-                player.clusters.append(
-                    EHS_based_bucket.lossy_single(co_cards, [player.cards[1].card_char, player.cards[0].card_char]))
+            self._deal_clusters(co_cards)
         elif self._betting_stage == "river":
             # Progress to the showdown.
             self._betting_stage = "show_down"
@@ -316,6 +397,15 @@ class PokerState:
         else:
             raise ValueError(f"Unknown betting_stage: {self._betting_stage}")
 
+    def _deal_clusters(self, co_cards: List[str]):
+        """Append the bucket of the new street to every player."""
+        keys = []
+        for key, player in zip(self._info_set_keys, self._table.players):
+            cluster = bucket_table.lossy_lookup(co_cards, [player.cards[1].card_char, player.cards[0].card_char])
+            player.clusters.append(cluster)
+            keys.append(info_set.append_street(key, cluster))
+        self._info_set_keys = keys
+
     @property
     def player_i(self) -> int:
         """Get the index of the players turn it is."""
@@ -433,6 +523,15 @@ class PokerState:
             print('cards_cluster', cards_cluster,"_history",self._history)
             raise Exception("_history is error")
 
+    @property
+    def info_set_key(self) -> int:
+        """Integer form of `info_set` for the current player.
+
+        Kept up to date by `apply_action`, so reading it is free. Convert
+        with `tools.poker.info_set.key_to_str` and `str_to_key`.
+        """
+        return self._info_set_keys[self._player_i_index]
+
     @property
     def payout(self) -> Dict[int, int]:
         """Return player index to payout number of chips dictionary."""
@@ -462,37 +561,44 @@ class PokerState:
 
     @property
     def legal_actions(self) -> List[Optional[str]]:
-        """Return the actions that are legal for this game state."""
-        chips = self._table.players[self.player_i].n_chips
-        pot = self._table.players[self.player_i].pot.total
-        biggest_bet = max(p.n_bet_chips for p in self.players)
-        n_chips_to_call = biggest_bet - self.current_player.n_bet_chips
-        halfpot = math.ceil(pot / 200) * 100
-        onepot = math.ceil(pot / 100) * 100
-        actions: List[Optional[str]] = []
-        if self.current_player.active:
-            if n_chips_to_call != 0:
-                actions += ["fold"]
-            actions += ["call"]
-            if self.has_allin == False:
-                if self._betting_stage == 'pre_flop':
-                    if self._n_raises < 1:
-                        actions += ['bigone']
-                    if self.last_raise <= 4 * self.big_blind:
-                        actions += ['bigfour']
-                    if self.last_raise <= 20 * self.big_blind and n_chips_to_call + 2000 < chips:
-                        actions += ['bigtwenty']
-                elif self._betting_stage == 'flop' and self.last_raise <= halfpot and chips > n_chips_to_call + halfpot and self._n_raises < 4:
-                    # In limit hold'em we can only bet/raise if there have been
-                    # less than three raises in this round of betting, or if there
-                    # are two players playing.
-                    actions += ["raiseh","raiseo"]
-                elif self._n_raises < 1 and self.last_raise <= halfpot and chips > n_chips_to_call + halfpot:
-                    actions += ["raiseh","raiseo"]
-                elif self.last_raise <= onepot and chips > n_chips_to_call + onepot:
-                    actions += ["raiseo"]
-                if chips > 0:
-                    actions += ['allin']
+        """Return the actions that are legal for this game state.
+
+        Computed once per state, don't modify the returned list.
+        """
+        if self._legal_actions is None:
+            self._compute_legal_actions()
+        return self._legal_actions[2]
+
+    @property
+    def legal_action_ids(self) -> Tuple[Action, ...]:
+        """Return the ids of the legal actions, empty if the player is out."""
+        if self._legal_actions is None:
+            self._compute_legal_actions()
+        return self._legal_actions[0]
+
+    @property
+    def legal_action_mask(self) -> int:
+        """Return the bitmask of `legal_action_ids`."""
+        if self._legal_actions is None:
+            self._compute_legal_actions()
+        return self._legal_actions[1]
+
+    def _compute_legal_actions(self):
+        """Cache the legal action ids, their mask and their names."""
+        player = self.current_player
+        if player.active:
+            ids = legal_action_ids(
+                betting_stage=self._betting_stage,
+                n_chips=player.n_chips,
+                pot=player.pot.total,
+                n_chips_to_call=max(p.n_bet_chips for p in self.players) - player.n_bet_chips,
+                last_raise=self.last_raise,
+                n_raises=self._n_raises,
+                has_allin=self.has_allin,
+                big_blind=self.big_blind,
+            )
+            names: List[Optional[str]] = [action_names[i] for i in ids]
         else:
-            actions += [None]
-        return actions
+            ids = ()
+            names = [None]
+        self._legal_actions = (ids, to_mask(ids), names)
@@ -0,0 +1,173 @@
+"""In-place apply_action/undo_action of PokerState against copied states.
+
+The walk applies every visited action twice from the same state, once as a
+copy and once in place, and the two states must agree. Undoing the in-place
+action must give back the state from before it.
+"""
+import random
+
+import numpy as np
+import pytest
+
+import tools.EHS_based_v2.bucket_table as bucket_table
+from tools.poker.info_set import key_bytes, key_to_bytes
+from tools.poker.state import PokerState, new_game
+
+
+@pytest.fixture(autouse=True)
+def fake_buckets(monkeypatch):
+    """Deterministic post flop buckets instead of the equity rollout, which
+    takes seconds per street without the precomputed tables."""
+    monkeypatch.setattr(
+        bucket_table,
+        "lossy_lookup",
+        lambda board, hole: sum(map(ord, "".join(board + hole))) % 200,
+    )
+
+
+def observe(state: PokerState) -> tuple:
+    """Everything of a state that an action can change."""
+    return (
+        state.betting_stage,
+        state.player_i,
+        state.is_terminal,
+        state.info_set,
+        state.info_set_key,
+        list(state.legal_actions),
+        state.legal_action_mask,
+        state.payout,
+        [card.card_char for card in state.community_cards],
+        [
+            (player.n_chips, player.n_bet_chips, player.active, list(player.clusters))
+            for player in state.players
+        ],
+        state._table.pot.total,
+        len(state._table.dealer.deck),
+    )
+
+
+def walk(state: PokerState, rng: random.Random, width: int, depth: int) -> int:
+    """Check `width` random actions of every state down to `depth`, and
+    return the number of actions checked."""
+    before = observe(state)
+    if state.is_terminal or depth == 0:
+        return 0
+    n_checked = 0
+    actions = list(state.legal_actions)
+    for action in rng.sample(actions, min(width, len(actions))):
+        # Both branches have to deal the same cards.
+        generator = state._table.dealer.deck._rng
+        np_state, py_state = np.random.get_state(), random.getstate()
+        generator_state = generator and generator.bit_generator.state
+        copied = state.apply_action(action)
+        np.random.set_state(np_state)
+        random.setstate(py_state)
+        if generator is not None:
+            generator.bit_generator.state = generator_state
+        state.apply_action(action, inplace=True)
+        assert observe(state) == observe(copied), action
+        n_checked += 1 + walk(state, rng, width, depth - 1)
+        state.undo_action()
+        assert observe(state) == before, action
+    return n_checked
+
+
+def test_apply_undo_matches_copies():
+    rng = random.Random(0)
+    np.random.seed(0)
+    random.seed(0)
+    n_checked = 0
+    for _ in range(200):
+        n_checked += walk(new_game(2), rng, width=2, depth=8)
+    assert n_checked > 10000
+
+
+def test_apply_undo_matches_copies_with_generator():
+    rng = random.Random(1)
+    generator = np.random.Generator(np.random.Philox(1))
+    n_checked = 0
+    for _ in range(20):
+        n_checked += walk(new_game(2, rng=generator), rng, width=2, depth=8)
+    assert n_checked > 1000
+
+
+def test_generator_deals_reproducible_games():
+    def play(seed):
+        rng = random.Random(seed)
+        state = new_game(2, rng=np.random.Generator(np.random.Philox(seed)))
+        observed = [observe(state)]
+        while not state.is_terminal:
+            state = state.apply_action(rng.choice(state.legal_actions))
+            observed.append(observe(state))
+        return observed
+
+    np.random.seed(0)
+    random.seed(0)
+    first = [play(seed) for seed in range(50)]
+    np.random.seed(1)
+    random.seed(1)
+    assert [play(seed) for seed in range(50)] == first
+
+
+def test_copies_share_the_generator():
+    generator = np.random.Generator(np.random.Philox(0))
+    state = new_game(2, rng=generator)
+    copied = state.apply_action(state.legal_actions[-1])
+    assert copied._table.dealer.deck._rng is generator
+
+
+def test_raise_chain_needs_chips():
+    state = new_game(2)
+    state = state.apply_action("call").apply_action("bigone")
+    n_raises = 0
+    while "bigfour" in state.legal_actions:
+        player = state.current_player
+        to_call = max(p.n_bet_chips for p in state.players) - player.n_bet_chips
+        assert player.n_chips > to_call + 4 * state.big_blind
+        state = state.apply_action("bigfour")
+        key_to_bytes(state.info_set_key)
+        n_raises += 1
+    assert n_raises == 24
+    while not state.is_terminal:
+        key_to_bytes(state.info_set_key)
+        state = state.apply_action(state.legal_actions[-1])
+
+
+def key_growth(state: PokerState, memo: dict) -> int:
+    """Most hex digits the actions from `state` on can add to its key."""
+    if state.is_terminal:
+        return 0
+    # The growth depends on the betting, not on the cards.
+    betting = (
+        state.betting_stage,
+        state.player_i,
+        state._n_raises,
+        state.last_raise,
+        state.has_allin,
+        state._first_move_of_current_round,
+        tuple((p.n_chips, p.n_bet_chips, p.active) for p in state.players),
+        state._table.pot.total,
+    )
+    if betting not in memo:
+        digits = len(format(state.info_set_key, "x"))
+        growth = 0
+        for action in list(state.legal_actions):
+            state.apply_action(action, inplace=True)
+            added = len(format(state.info_set_key, "x")) - digits
+            growth = max(growth, added + key_growth(state, memo))
+            state.undo_action()
+        memo[betting] = growth
+    return memo[betting]
+
+
+def test_longest_key_fits():
+    state = new_game(2)
+    longest = len(format(state.info_set_key, "x")) + key_growth(state, {})
+    assert longest == 46
+    assert longest <= 2 * key_bytes
+
+
+def test_undo_without_action_raises():
+    state = new_game(2)
+    with pytest.raises(ValueError):
+        state.undo_action()
@@ -17,6 +17,15 @@ class PokerTable:
     Each player is responisble for handling his own cards privately.
     """
 
+    __slots__ = (
+        "players",
+        "total_n_chips_on_table",
+        "pot",
+        "dealer",
+        "community_cards",
+        "n_games",
+    )
+
     def __init__(self, players: List[Player], pot: Pot, **deck_kwargs):
         """Construct the table."""
         self.players: List[Player] = players
@@ -27,7 +36,7 @@ class PokerTable:
         self.n_games: int = 0
         if self.n_players < 2:
             raise ValueError(f'Must be atleast two players on the table.')
-        if not all(p.pot.uid == self.pot.uid for p in self.players):
+        if not all(p.pot is self.pot for p in self.players):
             raise ValueError(f'Players and table point to different pots.')
 
     def reset(self):
@@ -44,7 +53,7 @@ class PokerTable:
     def set_players(self, players: List[Player]):
         """Set the players."""
         self.players = players
-        if not all(p.pot.uid == self.pot.uid for p in self.players):
+        if not all(p.pot is self.pot for p in self.players):
             raise ValueError(f'Players and table point to different pots.')
 
     def add_community_card(self, card: Card):